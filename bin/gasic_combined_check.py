@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#--- Option parsing ---#
+"""
+gasic_combined_check.py: check that combined-index & pairwise mapping agree
+
+Usage:
+  gasic_combined_check.py [options] <nameFile>
+  gasic_combined_check.py -h | --help
+  gasic_combined_check.py --version
+
+Options:
+  <nameFile>          Name file (See gasic_seqDB_batch.py). Use a small set of references.
+  --mapper=<m>        Read mapper ('bowtie2', 'minimap2' or 'kmer'). [default: bowtie2]
+  --simulator=<sm>    Read simulator ('mason' or 'numpy'). [default: numpy]
+  --read-length=<rl>  Simulated read length (illumina). [default: 100]
+  --nreads-sim=<ns>   Number of reads to simulate per reference. [default: 1000]
+  --max-diff=<md>     Max fraction of reads with differing mapped-read flags for any
+                      reference pair. [default: 0]
+  --ncores-3rd=<nt>   Number of cores used by 3rd party software. [default: 1]
+  --version           Show version.
+  -h --help           Show this screen.
+
+Description:
+  The simulated reads of each reference are mapped to all references
+  (1) pairwise, with 1 mapper call per reference pair, and (2) against a
+  combined index of all references (gasic_seqDB_batch.py --combined-index).
+  The mapped-read fractions of each (query, subject) pair are written as a
+  tab-delimited table to STDOUT: query, subject, pairwise fraction,
+  combined fraction, fraction of reads with differing flags.
+
+  Exit status 1 if the flags differ for > --max-diff of the reads of any pair.
+"""
+
+from docopt import docopt
+import os, sys
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.1')
+
+
+#--- Package import ---#
+import tempfile
+import shutil
+
+import numpy as np
+
+scriptDir = os.path.dirname(__file__)
+libDir = os.path.join(scriptDir, '../lib/')
+sys.path.append(libDir)
+
+import gasicBatch.NameFile as NameFile
+from gasicBatch.ReadMapper import ReadMapper
+from gasicBatch.ReadSimulator import ReadSimulator
+from gasicBatch.IndexStore import IndexStore
+
+
+#--- Main ---#
+ncores_3rd = int(args['--ncores-3rd'])
+params = {'-f':'', '-p':ncores_3rd}
+nameF = NameFile.NameFile(args['<nameFile>'])
+n_refs = nameF.len()
+
+tmpdir = tempfile.mkdtemp()
+
+# mapper & reference indexes
+indexDir = os.path.join(tmpdir, 'indexes')
+if args['--mapper'] == 'bowtie2':
+    mapper = ReadMapper.getMapper('bowtie2')
+    IndexStore(indexDir, mapper).parallel(nameF, threads=ncores_3rd)
+else:
+    mapper = ReadMapper.getMapper(args['--mapper'], indexStore=indexDir)
+
+# simulated reads (seeded)
+simulator = ReadSimulator.getSimulator(args['--simulator'])
+simParams = {'--num-reads' : int(args['--nreads-sim']),
+             '--read-length' : int(args['--read-length']),
+             '--seed' : 0}
+if simulator.parallel(nameF, outDir=tmpdir, platform='illumina', params=simParams):
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    sys.stderr.write('ERROR: read simulation failed\n')
+    sys.exit(1)
+
+# pairwise & combined-index mapping
+pairRows = mapper.pairwise_rows(nameF, range(n_refs), params=params)
+indexFile, contigMap = mapper.make_combinedIndex(nameF, outDir=tmpdir)
+combRows = mapper.pairwise_combined(nameF, indexFile, contigMap, params=params)
+
+# comparing mapped-read flags
+maxDiff = 0.0
+print '\t'.join(['query', 'subject', 'pairwise_fraction', 'combined_fraction', 'diff_fraction'])
+for i,name in enumerate(nameF.iter_names()):
+    for j,subject in enumerate(nameF.iter_names()):
+        pair = pairRows[i][j,:]
+        comb = combRows[i][j,:]
+        diff = np.mean(pair != comb)
+        maxDiff = max(maxDiff, diff)
+        print '\t'.join([str(x) for x in [name.get_fastaFile(), subject.get_fastaFile(),
+                                          np.mean(pair), np.mean(comb), diff]])
+
+shutil.rmtree(tmpdir, ignore_errors=True)
+if maxDiff > float(args['--max-diff']):
+    sys.stderr.write('Combined-index & pairwise mapping differ (max diff fraction: {})\n'.format(maxDiff))
+    sys.exit(1)
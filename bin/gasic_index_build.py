@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+#--- Option parsing ---#
+"""
+gasic_index_build.py: build read mapper indexes for all references in a name file
+
+Usage:
+  gasic_index_build.py [options] <nameFile> <storeDir>
+  gasic_index_build.py -h | --help
+  gasic_index_build.py --version
+
+Options:
+  <nameFile>          Name file (See gasic_seqDB_batch.py).
+  <storeDir>          Index store directory (created if needed).
+  --nprocs=<np>       Number of parallel index builds. [default: 1]
+  --threads=<t>       Number of threads used by each index build. [default: 1]
+  --version           Show version.
+  -h --help           Show this screen.
+
+Description:
+  A bowtie2 index is built for each reference in the nameFile that is
+  not already in the index store. Indexes are keyed by the reference fasta
+  checksum & the bowtie2-build version, so an index is only built once for
+  all runs (or nodes) sharing <storeDir>.
+
+  A name file (2 columns: 'reference_fasta', 'reference_index') with the
+  index of each reference in the store is written to STDOUT.
+"""
+
+from docopt import docopt
+import os, sys
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.1')
+
+
+#--- Package import ---#
+scriptDir = os.path.dirname(__file__)
+libDir = os.path.join(scriptDir, '../lib/')
+sys.path.append(libDir)
+
+import gasicBatch.NameFile as NameFile
+from gasicBatch.ReadMapper import ReadMapper
+from gasicBatch.IndexStore import IndexStore
+
+
+#--- Main ---#
+nameF = NameFile.NameFile(args['<nameFile>'])
+indexStore = IndexStore(args['<storeDir>'], ReadMapper.getMapper('bowtie2'))
+indexStore.parallel(nameF, nprocs=int(args['--nprocs']), threads=int(args['--threads']))
+
+for name in nameF.iter_names():
+    print '\t'.join([name.get_fastaFile(), name.get_indexFile()])
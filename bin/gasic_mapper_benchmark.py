@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+#--- Option parsing ---#
+"""
+gasic_mapper_benchmark.py: compare read mappers (throughput & mapped fraction)
+
+Usage:
+  gasic_mapper_benchmark.py [options] <readFile> <refFasta>...
+  gasic_mapper_benchmark.py -h | --help
+  gasic_mapper_benchmark.py --version
+
+Options:
+  <readFile>          Read file (fasta) to map (eg., 454 or sanger reads).
+  <refFasta>...       Reference fasta file(s).
+  --mappers=<m>       Mappers to compare (comma-delim list; 'bowtie2', 'minimap2' or 'kmer').
+                      [default: bowtie2,minimap2]
+  --baseline=<b>      Mapper used as the reference for the recall & precision of the
+                      other mappers (eg., bowtie2 on simulated reads). [default: bowtie2]
+  --threads=<t>       Number of threads used by each mapper call. [default: 1]
+  --version           Show version.
+  -h --help           Show this screen.
+
+Description:
+  The reads are mapped to each reference with each mapper (bowtie2 is
+  run with --local, as in gasic_seqDB_batch.py). Indexes are built
+  before mapping; index build time is reported separately from the
+  mapping time. Written as a tab-delimited table to STDOUT:
+  mapper, reference, index build seconds, mapping seconds, reads/second,
+  peak RSS (MB), mapped fraction, recall & precision of the mapped reads
+  relative to the --baseline mapper (NA if the baseline is not in --mappers).
+
+  For accuracy on simulated data, use reads simulated from one of the
+  references (see gasic_simulator_benchmark.py): reads mapped by the
+  baseline to the source reference are the true hits, and reads mapped
+  to the other references show cross-mapping.
+"""
+
+from docopt import docopt
+import os, sys
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.1')
+
+
+#--- Package import ---#
+import time
+import tempfile
+import shutil
+
+import numpy as np
+import pysam
+
+scriptDir = os.path.dirname(__file__)
+libDir = os.path.join(scriptDir, '../lib/')
+sys.path.append(libDir)
+
+from gasicBatch.ReadMapper import ReadMapper
+from gasicBatch.ReadSimulator import countReads
+
+
+#--- Main ---#
+threads = int(args['--threads'])
+nReads = countReads(args['<readFile>'], 'fasta')
+
+tmpdir = tempfile.mkdtemp()
+print '\t'.join(['mapper', 'reference', 'index_seconds', 'map_seconds', 'reads_per_second',
+                 'max_rss_mb', 'mapped_fraction', 'recall', 'precision'])
+
+# baseline mapper first (mapped reads of the baseline for each reference)
+mapperNames = args['--mappers'].split(',')
+if args['--baseline'] in mapperNames:
+    mapperNames.remove(args['--baseline'])
+    mapperNames.insert(0, args['--baseline'])
+baseline = dict()
+
+for mapperName in mapperNames:
+    mapper = ReadMapper.getMapper(mapperName)
+    for refFile in args['<refFasta>']:
+        # index
+        start = time.time()
+        prefix = os.path.join(tmpdir, mapperName + '_' + os.path.splitext(os.path.basename(refFile))[0])
+        indexFile = mapper.make_index(refFile, outFile=prefix, threads=threads)
+        indexSeconds = time.time() - start
+
+        # mapping
+        samFile, stats = mapper(indexFile, args['<readFile>'], outFile=prefix + '.sam', stats=True,
+                                params={'-f':'', '-p':threads})
+        samfh = pysam.Samfile(samFile, 'r')
+        mapped = np.array([int(not read.is_unmapped) for read in samfh if not read.is_secondary])
+        samfh.close()
+        os.remove(samFile)
+
+        # recall & precision relative to the baseline mapper
+        recall = precision = 'NA'
+        if mapperName == args['--baseline']:
+            baseline[refFile] = mapped
+        elif refFile in baseline:
+            both = float(np.sum(mapped * baseline[refFile]))
+            recall = both / max(baseline[refFile].sum(), 1)
+            precision = both / max(mapped.sum(), 1)
+
+        print '\t'.join([str(x) for x in [mapperName, refFile, round(indexSeconds, 3),
+                                          round(stats['wall_sec'], 3),
+                                          round(nReads / max(stats['wall_sec'], 1e-9), 1),
+                                          round(stats['max_rss_mb'], 1), np.mean(mapped),
+                                          recall, precision]])
+
+shutil.rmtree(tmpdir, ignore_errors=True)
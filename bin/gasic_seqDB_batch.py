@@ -22,7 +22,81 @@ Options:
   --npar-boot=<pb>    Number of parallel bootstrap iteractions. [default: 1]
   --nbootstrap=<nb>   Number of bootstrap iterations. [default: 100]
   --nreads-sim=<ns>   Number of reads to simulate per reference. [default: 10000]
+  --sim-shard-size=<ss>  References larger than this (bp) are split into contig/region shards
+                      that are simulated in parallel. 0 = no splitting. [default: 0]
+  --simulator=<sm>    Read simulator ('mason' or 'numpy'; see ReadSimulator). [default: mason]
+  --sim-single-run    Simulate reads for all references in one run, with reads tagged by source
+                      reference (numpy simulator only). With --combined-index, all simulated reads
+                      are mapped in one mapper call.
+  --sim-precision=<sp>  Adaptive number of simulated reads: reads are simulated in batches of
+                      --nreads-sim until the 95% CI half-width of all cross-mapping fractions
+                      of the reference is <= this value (not with --sim-store or --sim-single-run).
+                      0 = not adaptive. [default: 0]
+  --nreads-sim-max=<nm>  Max number of simulated reads per reference for --sim-precision. [default: 100000]
+  --max-reads=<xr>    Max number of reads per metagenome. Larger metagenomes are subsampled (reservoir
+                      sampling) after download; total & corrected read counts are scaled by the
+                      sampling fraction. 0 = no subsampling. [default: 0]
+  --subsample-seed=<ss>  Random seed for --max-reads subsampling. [default: 0]
+  --screen-reads=<sr>  Presence screening: this many reads (seeded subsample) of each metagenome are
+                      mapped to all references; references with < --screen-min-hits hits are
+                      reported with zero abundance & skipped for all other stages. 0 = no screening.
+                      [default: 0]
+  --screen-min-hits=<sh>  Min screening hits for a reference to be considered present. [default: 1]
   --min-reads=<mr>    Minimum reads that a metagenome must contain. [default: 1000]
+  --sim-len-bin=<lb>  Bin size (bp) for the read lengths used for read simulation.
+                      Metagenomes with the same simulation profile share simulated reads &
+                      similarity matrices. 0 = no binning. [default: 0]
+  --sim-err-bin=<eb>  Bin size (bp) for the read length error (stdev) used for read simulation
+                      of 454/sanger reads. 0 = no binning. [default: 0]
+  --sim-master-len=<ml>  Illumina metagenomes (mason only): simulate reads of this length once per reference
+                      and derive shorter read lengths by trimming these reads. 0 = off. [default: 0]
+  --combined-index    Pairwise mapping of simulated reads against one combined index of all
+                      references (1 mapper call per reference instead of 1 per reference pair).
+  --map-chunk-size=<mc>  Map metagenome reads in chunks of this many reads (--npar-map chunks
+                      mapped in parallel, each call using --ncores-3rd cores). 0 = no chunking. [default: 0]
+  --fanout            Per-reference mapping: the metagenome read file is read once for each group of
+                      --npar-map concurrent mapper calls and streamed to all of them (bowtie2 &
+                      minimap2; saves read I/O, eg., on network file systems).
+  --dedup             Collapse exact duplicate metagenome reads before mapping; only unique reads are
+                      mapped & read multiplicities are used as weights in the correction.
+  --dedup-on-disk     Deduplicate via temporary bucket files instead of in memory (--dedup).
+  --mapper=<m>        Read mapper for illumina metagenomes ('bowtie2', 'minimap2' or 'kmer').
+                      'kmer' = alignment-free k-mer classification (eg., for fast screening of
+                      many metagenomes). [default: bowtie2]
+  --long-read-mapper=<lm>  Read mapper for 454 & sanger metagenomes ('bowtie2', 'minimap2' or 'kmer').
+                      [default: minimap2]
+  --mm-index          Memory-map mapper indexes (bowtie2 --mm), so parallel mapper calls
+                      share 1 copy of each index in RAM.
+  --single-pass-map   Map the metagenome reads once against a combined index of all references
+                      (multi-hit reporting) instead of once per reference index.
+  --joint-max-reads=<jr>  Metagenomes with <= this many (mapped) reads are mapped jointly in groups:
+                      reads are tagged by metagenome, the reads of a group are mapped in 1 mapper
+                      call per reference (or against the combined index) & demultiplexed.
+                      0 = no joint mapping. [default: 0]
+  --joint-group-size=<jg>  Max number of metagenomes mapped jointly (--joint-max-reads). [default: 10]
+  --map-cache=<mp>    Mapping cache directory. The mapped-read flags of each metagenome read file &
+                      reference are cached (keyed by the read file & reference checksums, mapper
+                      version & mapping params), so only references that are not in the cache are
+                      mapped when a metagenome is processed again (eg., after an interrupted run or
+                      after adding references to the nameFile).
+  --sketch-prefilter=<sp>  Min k-mer containment of a query reference in a subject reference
+                      needed for pairwise mapping of the query's simulated reads to the subject.
+                      Pairs below the cutoff are set to 'no reads mapped'. Query references that are
+                      too small for a k-mer sketch (< 10 sketch hashes) are not prefiltered (all
+                      pairs mapped). 0 = no prefilter. [default: 0]
+  --cluster-refs=<cr>  Collapse near-identical references: references with a mutual k-mer
+                      containment >= this value are clustered, and only cluster representatives
+                      are used for simulation, mapping & correction. 0 = no clustering. [default: 0]
+  --cluster-map=<cm>  Output file for the reference -> cluster representative map (--cluster-refs).
+                      [default: gasic_clusterMap.txt]
+  --index-store=<is>  Index store directory (see gasic_index_build.py). If bowtie2 is used (--mapper or
+                      --long-read-mapper), missing bowtie2 indexes of the references are built up front
+                      (--npar-map builds in parallel, each using --ncores-3rd threads); the nameFile
+                      'reference_index' column is not needed. minimap2 & kmer indexes are built in
+                      the store when first needed.
+  --sim-store=<ss>    Similarity store directory (see gasic_simStore_build.py). Pairwise mappings of
+                      simulated reads are taken from the store; missing pairs are added to it.
+  --cache-dir=<cd>    Directory for caching data (eg., k-mer sketches, simulated reads) across runs.
   --last-run=<lr>     Output from last run. Only metagenomes lacking abundance data will be processed.
                       New output combined with old output.
   --version           Show version.
@@ -49,13 +123,14 @@ Description:
 Output:
   Table with columns:
     metagenome_id
-    reference sequence file
+    reference sequence file (cluster representative if --cluster-refs)
     total reads
     number of reads mapped
     corrected number of reads mapped
     standard error for the number of reads mapped
     P-value
     sequencing platform of downloaded reads
+    fraction of reads used (--max-reads subsampling; 'number of reads mapped' is for the used reads)
 """
 
 from docopt import docopt
@@ -94,6 +169,12 @@ from gasicBatch.ReadMapper import ReadMapper
 from gasicBatch.ReadSimulator import ReadSimulator
 from gasicBatch.CorrectAbundances import CorrectAbundances
 from gasicBatch.Writer import OutputWriter
+from gasicBatch.Sketch import Sketcher
+from gasicBatch.Cluster import RefClusterer, writeClusterMap
+from gasicBatch.Cache import paramsKey
+from gasicBatch.SimStore import SimStore
+from gasicBatch.IndexStore import IndexStore
+from gasicBatch.MapCache import MapCache
 
 
 #--- Option error testing ---#
@@ -105,6 +186,10 @@ def fileExists(fileName):
 
 fileExists(args['<metaFile>'])
 fileExists(args['<nameFile>'])
+if args['--sim-single-run'] and args['--simulator'].lower() != 'numpy':
+    raise ValueError('--sim-single-run requires --simulator=numpy')
+if float(args['--sim-precision']) > 0 and (args['--sim-store'] is not None or args['--sim-single-run']):
+    raise ValueError('--sim-precision cannot be combined with --sim-store or --sim-single-run')
 
 
 
@@ -117,6 +202,474 @@ nBootstrap = int(args['--nbootstrap'])
 npar_boot = int(args['--npar-boot'])
 nSimReads = int(args['--nreads-sim'])
 minReads = int(args['--min-reads'])
+mapChunkSize = int(args['--map-chunk-size'])
+jointMaxReads = int(args['--joint-max-reads'])
+jointGroupSize = int(args['--joint-group-size'])
+maxReads = int(args['--max-reads'])
+screenReads = int(args['--screen-reads'])
+screenMinHits = int(args['--screen-min-hits'])
+simPrecision = float(args['--sim-precision'])
+nSimReadsMax = int(args['--nreads-sim-max'])
+lengthBin = int(args['--sim-len-bin'])
+errorBin = float(args['--sim-err-bin'])
+masterLength = int(args['--sim-master-len'])
+shardSize = int(args['--sim-shard-size'])
+if shardSize <= 0:
+    shardSize = None
+sketchPrefilter = float(args['--sketch-prefilter'])
+clusterThreshold = float(args['--cluster-refs'])
+simCacheDir = None
+if args['--cache-dir'] is not None:
+    args['--cache-dir'] = os.path.abspath(args['--cache-dir'])
+    simCacheDir = os.path.join(args['--cache-dir'], 'simReads')
+
+
+def simulate(names, simulator, platform, simParams, outDir):
+    """Simulating reads for each reference in names.
+    
+    Return:
+    boolean on run success/fail (see ReadSimulator)
+    """
+    if masterLength > 0 and hasattr(simulator, 'parallel_trimmed'):
+        # trimming reads of master read sets (simulated once)
+        return simulator.parallel_trimmed(names, masterLength, os.path.join(simDir, 'master'),
+                                          nprocs=npar_sim, outDir=outDir, platform=platform,
+                                          params=simParams, cacheDir=simCacheDir)
+    else:
+        return simulator.parallel(names, nprocs=npar_sim, outDir=outDir, platform=platform,
+                                  params=simParams, cacheDir=simCacheDir, shardSize=shardSize)
+
+
+def mapSimReads(nameF, mapper, rows, skipPairs=None):
+    """Pairwise mapping of the simulated reads from each ref in rows to all references.
+
+    Args:
+    nameF -- NameFile instance
+    mapper -- ReadMapper instance
+    rows -- indices of query references in nameF
+    skipPairs -- boolean array (n_refs, n_refs); pairs not mapped. Default: workSkipPairs().
+                 Not used with --combined-index (whole rows are mapped in 1 call).
+
+    Return:
+    list of numpy arrays (n_refs, n_simReads) of mapped-read flags (1 per row)
+    """
+    if args['--combined-index']:
+        # one mapper call per reference against the combined index (all references; selecting refIdx)
+        mappedRows = mapper.pairwise_combined(nameF.subset(rows), getCombIndex(mapper), contigMap, nprocs=npar_map,
+                                              params={'-f':'', '-p':ncores_3rd})
+        return [mapped[refIdx,:] for mapped in mappedRows]
+
+    if skipPairs is None:
+        skipPairs = workSkipPairs()
+    return mapper.pairwise_rows(nameF, rows, skipPairs=skipPairs, nprocs=npar_map,
+                                params={'-f':'', '-p':ncores_3rd})
+
+
+def getMapper(platform):
+    """Read mapper for a sequencing platform (--mapper & --long-read-mapper)"""
+    if platform == 'illumina':
+        mapperName = args['--mapper']
+    else:
+        mapperName = args['--long-read-mapper']
+    if mapperName == 'bowtie2':
+        return ReadMapper.getMapper(mapperName, sharedIndex=args['--mm-index'])
+    ## index store (each reference is indexed once); run-only store if no store/cache dir is given
+    indexStoreDir = args['--index-store']
+    if indexStoreDir is None and args['--cache-dir'] is not None:
+        indexStoreDir = os.path.join(args['--cache-dir'], 'indexes')
+    if indexStoreDir is None:
+        indexStoreDir = os.path.join(simDir, 'indexes')
+    if mapperName == 'minimap2':
+        return ReadMapper.getMapper(mapperName, indexStore=indexStoreDir, threads=ncores_3rd)
+    return ReadMapper.getMapper(mapperName, indexStore=indexStoreDir)
+
+
+def getCombIndex(mapper):
+    """Combined index of all references for the mapper (built once per mapper)"""
+    global contigMap
+    if mapper.mapperName not in combIndexes:
+        combIndexes[mapper.mapperName], contigMap = mapper.make_combinedIndex(nameF, outDir=indexDir)
+    return combIndexes[mapper.mapperName]
+
+
+def workSkipPairs():
+    """skipPairs of the references used for the current metagenome (refIdx)"""
+    return skipPairs[np.ix_(refIdx, refIdx)]
+
+
+def screenRefs(mg, mapper):
+    """Presence screening: mapping a seeded subsample of --screen-reads reads
+    to all references.
+
+    Args:
+    mg -- MetaFile row instance (fasta read file)
+    mapper -- ReadMapper instance
+
+    Return:
+    list -- indices (in nameF) of references with >= --screen-min-hits hits
+    """
+    sample, total = MetaFile.reservoirSample(SeqIO.parse(mg.get_readFile(), 'fasta'), screenReads,
+                                             seed=int(args['--subsample-seed']))
+    screenFile = os.path.join(tmpdir, 'screen_reads.fasta')
+    SeqIO.write(sample, screenFile, 'fasta')
+
+    params = {'-f':'', '-p':ncores_3rd}
+    if args['--combined-index'] or args['--single-pass-map']:
+        hits = mapper.map_combined(getCombIndex(mapper), contigMap, screenFile, len(sample), params=params).sum(axis=1)
+    else:
+        comps = [(0, j, mapper.get_indexFile(name), screenFile) for j,name in enumerate(nameF.iter_names())]
+        hits = np.zeros(nameF.len())
+        for (i,j,indexFile,readFile,samFile) in mapper.pairwise(comps, nprocs=npar_map,
+                                                                tmpFile=True, params=params):
+            samfh = pysam.Samfile(samFile, 'r')
+            hits[j] = sum(1 for read in samfh if not read.is_unmapped)
+            samfh.close()
+            os.remove(samFile)
+    os.remove(screenFile)
+
+    present = [j for j in range(nameF.len()) if hits[j] >= screenMinHits]
+    msg = 'Presence screening ({} reads): {} of {} references present\n'
+    sys.stderr.write(msg.format(len(sample), len(present), nameF.len()))
+    return present
+
+
+def simMatrix(nameF, mapper, simulator, platform, simParams, outDir):
+    """Similarity estimation by pairwise mapping simulated reads.
+    
+    Args:
+    nameF -- NameFile instance
+    mapper -- ReadMapper instance
+    simulator -- ReadSimulator instance
+    platform -- sequencing platform for the simulator
+    simParams -- simulator params
+    outDir -- directory for simulated reads & the similarity matrix
+
+    Return:
+    similarity matrix file name; None if read simulation failed
+    """
+    n_refs = nameF.len()
+    if simPrecision > 0:
+        return simMatrixAdaptive(nameF, mapper, simulator, platform, simParams, outDir)
+    if simStore is not None:
+        return simMatrixStore(nameF, mapper, simulator, platform, simParams, outDir)
+
+    ## calling simulator
+    if args['--sim-single-run']:
+        # one simulator run for all references; reads tagged by source reference
+        taggedFile = os.path.join(outDir, 'simReads_tagged.fna')
+        simulator.simulate_tagged(nameF, taggedFile, outDir=outDir, split=not args['--combined-index'],
+                                  platform=platform, params=simParams)
+    else:
+        # process pool
+        retVal = simulate(nameF, simulator, platform, simParams, outDir)
+        if retVal:
+            return None
+        
+    # finding out how many reads were generated
+    num_reads = [name.get_simReadsCount() for name in nameF.iter_names()]
+    if len(set(num_reads)) > 1:
+        read_counts = ','.join([str(x) for x in set(num_reads)])
+        sys.stderr.write('\nWARNING: differing numbers of reads generated by simulator: {}\n\n'.format(read_counts))
+    if min(num_reads) == 0:
+        return None
+
+    #-- pairwise mapping of the simulated reads from each ref to all references --#
+    if args['--sim-single-run'] and args['--combined-index']:
+        # one mapper call for the whole tensor
+        mappedReads = mapper.pairwise_tagged(taggedFile, getCombIndex(mapper), contigMap, num_reads,
+                                             params={'-f':'', '-p':ncores_3rd})
+        mappedReads = mappedReads[:n_refs][:,refIdx,:min(num_reads)]
+    else:
+        mappedRows = mapSimReads(nameF, mapper, range(n_refs))
+        mappedReads = np.array([mapped[:,:min(num_reads)] for mapped in mappedRows])
+
+    # save the similarity matrix
+    matrixOutFile = os.path.join(outDir, 'simMtx')
+    np.save(matrixOutFile, mappedReads)
+    matrixOutFile += '.npy'
+    sys.stderr.write('Wrote similarity matrix: {}\n'.format(matrixOutFile))
+    return matrixOutFile
+
+
+def simMatrixAdaptive(nameF, mapper, simulator, platform, simParams, outDir):
+    """Similarity estimation with an adaptive number of simulated reads per reference.
+    Reads are simulated & mapped in batches of --nreads-sim reads. Batches are
+    added only for references (rows) with a 95% confidence interval half-width
+    of any cross-mapping fraction > --sim-precision (max: --nreads-sim-max reads).
+    See simMatrix for args.
+    
+    Return:
+    similarity matrix file name ('.npz' with 'mapped' & 'counts'); None if read
+    simulation failed
+    """
+    n_refs = nameF.len()
+    mappedRows = [[] for i in range(n_refs)]
+    counts = np.zeros(n_refs, dtype=int)
+    rows = range(n_refs)
+    batch = 0
+    while len(rows) > 0:
+        ## simulating batch (new seed for each batch)
+        batchParams = dict(simParams)
+        batchParams['--seed'] = batch
+        retVal = simulate(nameF.subset(rows), simulator, platform, batchParams, outDir)
+        if retVal:
+            return None
+
+        ## mapping batch
+        for i,mapped in zip(rows, mapSimReads(nameF, mapper, rows)):
+            mappedRows[i].append(mapped)
+            counts[i] += mapped.shape[1]
+
+        ## rows needing more reads
+        nextRows = []
+        for i in rows:
+            frac = np.mean(np.concatenate(mappedRows[i], axis=1), axis=1)
+            halfWidth = 1.96 * np.sqrt(frac * (1 - frac) / counts[i])
+            if halfWidth.max() > simPrecision and counts[i] < nSimReadsMax:
+                nextRows.append(i)
+        msg = 'Adaptive read simulation: batch {}; {} of {} references need more reads\n'
+        sys.stderr.write(msg.format(batch + 1, len(nextRows), n_refs))
+        rows = nextRows
+        batch += 1
+
+    # padded tensor (n_refs, n_refs, max reads) & per-row read counts
+    mappedReads = np.zeros((n_refs, n_refs, counts.max()))
+    for i in range(n_refs):
+        mappedReads[i,:,:counts[i]] = np.concatenate(mappedRows[i], axis=1)
+
+    # save the similarity matrix
+    matrixOutFile = os.path.join(outDir, 'simMtx.npz')
+    np.savez(matrixOutFile, mapped=mappedReads, counts=counts)
+    sys.stderr.write('Wrote similarity matrix: {}\n'.format(matrixOutFile))
+    return matrixOutFile
+
+
+def simMatrixStore(nameF, mapper, simulator, platform, simParams, outDir):
+    """Similarity estimation using the similarity store (--sim-store).
+    Only reference pairs missing from the store are simulated & mapped
+    (and then added to the store). See simMatrix for args.
+    """
+    # simulation profile (seeded, so simulated reads are reproducible)
+    simParams = dict(simParams)
+    simParams.setdefault('--seed', 0)
+    profile = paramsKey(args['--simulator'].lower(), platform, simParams, mapper.mapperName)
+
+    # pairs missing from the store (only these are mapped & added)
+    mapSkip = simStore.skipMask(nameF, profile, workSkipPairs())
+    rows = [i for i in range(nameF.len()) if not mapSkip[i].all()]
+    msg = 'Similarity store: {} pairs of {} references need pairwise mapping\n'
+    sys.stderr.write(msg.format((~mapSkip).sum(), len(rows)))
+    if len(rows) > 0:
+        retVal = simulate(nameF.subset(rows), simulator, platform, simParams, outDir)
+        if retVal:
+            return None
+        mappedRows = mapSimReads(nameF, mapper, rows, skipPairs=mapSkip)
+        simStore.add_rows(nameF, profile, rows, mappedRows, mapSkip)
+
+    # extracting the tensor for all references
+    mappedReads = simStore.extract(nameF, profile, workSkipPairs())
+    matrixOutFile = os.path.join(outDir, 'simMtx')
+    np.save(matrixOutFile, mappedReads)
+    matrixOutFile += '.npy'
+    sys.stderr.write('Wrote similarity matrix: {}\n'.format(matrixOutFile))
+    return matrixOutFile
+
+
+def mapSample(mg, mapper, idx, nMapReads):
+    """Mapping the metagenome reads to the references idx.
+
+    Args:
+    mg -- MetaFile row instance (fasta read file)
+    mapper -- ReadMapper instance
+    idx -- indices of references in nameF
+    nMapReads -- number of reads in the read file
+
+    Return:
+    numpy array (len(idx), n_reads) of mapped-read flags; None if the reads were
+    mapped to reference SAM files (refSamFile of each name; see ReadMapper.parallel)
+    """
+    params = {'-f':'', '-p':ncores_3rd}
+    if args['--single-pass-map']:
+        ## one mapper call against the combined index -> mapping signatures (n_refs x n_reads)
+        return mapper.map_combined(getCombIndex(mapper), contigMap, mg.get_readFile(), nMapReads,
+                                   params=params)[idx,:]
+    elif mapChunkSize > 0:
+        ## mapping chunks of reads in parallel -> mapping signatures (n_refs x n_reads)
+        return mapper.parallel_chunked(nameF.subset(idx), mg.get_readFile(), mapChunkSize, nprocs=npar_map,
+                                       outDir=tmpdir, params=params)
+    elif args['--fanout'] and mapper.streamReads:
+        ## calling mapper for each index file; 1 read of the read file per group of mapper calls
+        mapper.parallel_fanout(nameF.subset(idx), mg.get_readFile(), nprocs=npar_map, params=params)
+        return None
+    else:
+        ## calling mapper for each index file
+        if args['--fanout']:
+            msg = 'WARNING: mapper "{}" cannot read from STDIN; --fanout is not used\n'
+            sys.stderr.write(msg.format(mapper.mapperName))
+        mapper.parallel(nameF.subset(idx), mg, nprocs=npar_map, params=params)
+        return None
+
+
+def mapSampleCached(mg, mapper, idx, nMapReads):
+    """Mapping the metagenome reads to the references idx that are not in
+    the mapping cache (--map-cache) & adding the new mappings to the cache.
+    See mapSample for args.
+
+    Return:
+    numpy array (len(idx), n_reads) of mapped-read flags
+    """
+    names = nameF.subset(idx)
+    profile = mapCache.profile(mg.get_readFile(), mapper, mapCacheParams)
+    missing = mapCache.missing(names, profile)
+    msg = 'Mapping cache: {} of {} references need mapping\n'
+    sys.stderr.write(msg.format(len(missing), len(idx)))
+    if len(missing) > 0:
+        mapped = mapSample(mg, mapper, [idx[i] for i in missing], nMapReads)
+        if mapped is None:
+            samFiles = [names.get_name(i).get_refSamFile() for i in missing]
+            mapped = CorrectAbundances.mappedFromSam(samFiles)
+        mapCache.add_rows(names, profile, missing, mapped)
+    return mapCache.extract(names, profile)
+
+
+def correctSample(job, sampleMapped=None):
+    """Similarity correction of a mapped metagenome & writing the output.
+    Moves back to the original working directory & deletes the metagenome's
+    tmp directory.
+
+    Args:
+    job -- dict of metagenome data (set in the main loop)
+    sampleMapped -- numpy array (n_refs, n_reads) of mapped-read flags for the
+                    references in job['refIdx']. If None: the reference SAM files are used.
+    """
+    global refIdx
+    mg, writer, mapper = job['mg'], job['writer'], job['mapper']
+    refIdx, mgNameF = job['refIdx'], job['mgNameF']
+    sampleFrac = job['sampleFrac']
+
+    result = None
+    if len(refIdx) > 0:
+        #-- similarity estimation by pairwise mapping simulated reads --#
+        ## select simulator
+        simulator = ReadSimulator.getSimulator(args['--simulator'])
+        ## setting params based on metagenome read stats & platform
+        platform, simParams = simulator.get_paramsByReadStats(mg, params={'--num-reads':nSimReads},
+                                                              lengthBin=lengthBin, errorBin=errorBin)
+
+        ## metagenomes with the same simulation profile (& set of references) share simulated reads
+        ## & similarity matrix
+        profile = paramsKey(platform, simParams, refIdx, mapper.mapperName)
+        if profile in simProfiles:
+            matrixOutFile = simProfiles[profile]
+            msg = 'Using similarity matrix of simulation profile "{}": {}\n'
+            sys.stderr.write(msg.format(profile, matrixOutFile))
+        else:
+            profileDir = os.path.join(simDir, profile)
+            if not os.path.isdir(profileDir):
+                os.makedirs(profileDir)
+            matrixOutFile = simMatrix(mgNameF, mapper, simulator, platform, simParams, profileDir)
+            if matrixOutFile is None:
+                writer.simReadError()
+                cleanupSample(job)
+                return
+            simProfiles[profile] = matrixOutFile
+
+    
+
+        #-- similarity correction --#
+        ## input: matrix & original reads -> ref sam file
+        ## will bootstrap similarity matrix based on 'nBootstrap'
+        refSamFiles = None
+        if sampleMapped is None:
+            refSamFiles = [name.get_refSamFile() for name in mgNameF.iter_names()]
+        CorAbund = CorrectAbundances()            # create instance
+        result = CorAbund.similarityCorrection(refSamFiles, matrixOutFile, nBootstrap, npar_boot,
+                                               mapped=sampleMapped, weights=job['readWeights'])
+
+    
+    #-- writing output --#
+    ## references absent in presence screening: zero abundance
+    if result is None:
+        total = int(round(mg.get_readCount() / sampleFrac))
+    else:
+        total = int(round(result['total'] / sampleFrac))   # reads in the metagenome (before subsampling)
+    workIdx = dict((j,i) for i,j in enumerate(refIdx))
+    for j,name in enumerate(nameF.get_names()):
+        outvals = dict(
+            ref = name.get_fastaFile(),
+            total = total,
+            mapped = 0,
+            corr = 0.0,
+            error = 0.0,
+            pval = 1.0,
+            mgID = mg.get_ID(),    # metagenome containing the reads used
+            mg_platform = job['platform'],
+            sample_frac = sampleFrac
+            )
+        if j in workIdx:
+            i = workIdx[j]
+            outvals.update(mapped = result['num_reads'][i],
+                           corr = result['corr'][i] * total,
+                           error = result['err'][i] * total,
+                           pval = result['p'][i])
+        writer.writeValues(outvals)
+
+    cleanupSample(job)
+
+
+def cleanupSample(job):
+    """Moving back to original working directory; deleting the metagenome's tmp directory"""
+    if args['--debug'] == False:
+        os.chdir(origWorkDir)
+        try:
+            shutil.rmtree(job['tmpdir'])
+        except OSError:
+            sys.stderr.write(' WARNING: could not delete temporary directory: {}\n'.format(job['tmpdir']))
+
+
+def mapJoint(jobs):
+    """Joint mapping of a group of small metagenomes (--joint-max-reads): the
+    reads of all metagenomes in the group are mapped in 1 mapper run per
+    reference (or 1 run against the combined index), instead of 1 run per
+    metagenome & reference. Each metagenome is then corrected separately.
+
+    Args:
+    jobs -- list of metagenome job dicts (same mapper)
+    """
+    mapper = jobs[0]['mapper']
+
+    # references to map (indices in nameF); only those not in the mapping cache (--map-cache)
+    for job in jobs:
+        job['mapIdx'] = job['refIdx']
+        if mapCache is not None:
+            job['mapProfile'] = mapCache.profile(job['readFile'], mapper, mapCacheParams)
+            job['mapIdx'] = [job['refIdx'][i] for i in mapCache.missing(job['mgNameF'], job['mapProfile'])]
+    mapJobs = [job for job in jobs if len(job['mapIdx']) > 0]
+
+    if len(mapJobs) > 0:
+        readFiles = [job['readFile'] for job in mapJobs]
+        params = {'-f':'', '-p':ncores_3rd}
+        if args['--combined-index'] or args['--single-pass-map']:
+            mappedSamples = mapper.map_joint(nameF, readFiles, outDir=mapJobs[0]['tmpdir'], nprocs=npar_map,
+                                             indexFile=getCombIndex(mapper), contigMap=contigMap, params=params)
+            mappedSamples = [mapped[job['mapIdx'],:] for job,mapped in zip(mapJobs, mappedSamples)]
+        else:
+            # union of the references needed by any of the metagenomes
+            jointIdx = sorted(set([j for job in mapJobs for j in job['mapIdx']]))
+            rowIdx = dict((j,i) for i,j in enumerate(jointIdx))
+            mappedSamples = mapper.map_joint(nameF.subset(jointIdx), readFiles, outDir=mapJobs[0]['tmpdir'],
+                                             nprocs=npar_map, params=params)
+            mappedSamples = [mapped[[rowIdx[j] for j in job['mapIdx']],:]
+                             for job,mapped in zip(mapJobs, mappedSamples)]
+        for job,mapped in zip(mapJobs, mappedSamples):
+            job['mapped'] = mapped
+            if mapCache is not None:
+                mapCache.add_rows(nameF, job['mapProfile'], job['mapIdx'], mapped)
+
+    for job in jobs:
+        if mapCache is not None:
+            job['mapped'] = mapCache.extract(job['mgNameF'], job['mapProfile'])
+        correctSample(job, job.pop('mapped'))
 
 
 #-- reading files --#
@@ -141,6 +694,60 @@ elif args['--seqDB'] == 'SRA':
 # current working directory
 origWorkDir = os.path.abspath(os.curdir)
 
+# collapsing redundant references (cluster representatives are used from here on)
+if clusterThreshold > 0:
+    clusterer = RefClusterer(clusterThreshold, cacheDir=args['--cache-dir'])
+    clusterMap = clusterer.cluster(nameF, nprocs=npar_sim)
+    writeClusterMap(nameF, clusterMap, args['--cluster-map'])
+    reps = sorted(set(clusterMap))
+    msg = 'Reference clustering: {} references collapsed into {} clusters. Wrote cluster map: {}\n'
+    sys.stderr.write(msg.format(nameF.len(), len(reps), args['--cluster-map']))
+    nameF = nameF.subset(reps)
+
+# bowtie2 indexes from the index store (built if missing); only if bowtie2 is used
+# (minimap2 & kmer indexes are built in the store on first use; see getMapper)
+if args['--index-store'] is not None and 'bowtie2' in [args['--mapper'], args['--long-read-mapper']]:
+    indexStore = IndexStore(args['--index-store'], ReadMapper.getMapper('bowtie2'))
+    indexStore.parallel(nameF, nprocs=npar_map, threads=ncores_3rd)
+
+# combined index of all references (built once per mapper for all metagenomes; see getCombIndex)
+if args['--combined-index'] or args['--single-pass-map']:
+    indexDir = tempfile.mkdtemp()
+    combIndexes = dict()
+
+# k-mer containment between references (pairs below cutoff are not mapped)
+if sketchPrefilter > 0:
+    sketcher = Sketcher(cacheDir=args['--cache-dir'])
+    containment = sketcher.containment(nameF, nprocs=npar_sim)
+    ## unknown containment (NaN; too small sketch): pair is mapped
+    containment = np.where(np.isnan(containment), 1.0, containment)
+    skipPairs = (containment < sketchPrefilter) & ~np.eye(nameF.len(), dtype=bool)
+    msg = 'k-mer sketch prefilter: skipping {} of {} pairwise mappings\n'
+    sys.stderr.write(msg.format(skipPairs.sum(), skipPairs.size))
+else:
+    skipPairs = np.zeros((nameF.len(), nameF.len()), dtype=bool)
+
+# persistent similarity store
+if args['--sim-store'] is not None:
+    simStore = SimStore(args['--sim-store'])
+else:
+    simStore = None
+
+# simulated reads & similarity matrices for each simulation profile (shared among metagenomes)
+simDir = tempfile.mkdtemp()
+simProfiles = dict()
+
+# persistent cache of metagenome read mappings
+if args['--map-cache'] is not None:
+    mapCache = MapCache(args['--map-cache'])
+else:
+    mapCache = None
+## mapping params that determine the mapping results (part of the mapping cache key)
+mapCacheParams = {'-f':'', 'single-pass-map':args['--single-pass-map']}
+
+# small metagenomes queued for joint mapping (per mapper; see mapJoint)
+jointJobs = defaultdict(list)
+
 # each metagenome (getting from certain seqDB)
 for mg in metaF.iterByRow():
     
@@ -178,6 +785,11 @@ for mg in metaF.iterByRow():
         writer.noReadFile()
         continue
         
+    ## subsampling to --max-reads reads
+    sampleFrac = 1.0
+    if maxReads > 0:
+        sampleFrac = mg.subsample(maxReads, seed=int(args['--subsample-seed']), rmFile=True)
+
     ## convert to fasta if fasta
     if mg.get_readFileFormat() == 'fastq':        
         ret = mg.to_fasta(rmFile=True)
@@ -192,9 +804,9 @@ for mg in metaF.iterByRow():
         continue        
 
     ## skipping if number of reads < minReads
-    if mg.get_readCount() < minReads:
+    if mg.get_readCount() / sampleFrac < minReads:
         msg = '\n  Metagenome "{}" has {} reads, which is < --min-reads. Skipping metagenome\n\n'
-        sys.stderr.write( msg.format(mgID, str(mg.get_readCount())) )
+        sys.stderr.write( msg.format(mgID, str(int(round(mg.get_readCount() / sampleFrac)))) )
         continue
         
     ## skipping if platform in platform skip list or not determined
@@ -213,111 +825,51 @@ for mg in metaF.iterByRow():
     # debug download & read stats
     #continue
 
-        
     #-- read mapping --#
     ## creating object for specific mapper
-    mapper = ReadMapper.getMapper('bowtie2')    # factory class
+    mapper = getMapper(mg_platform)    # factory class
    # mapper.set_paramsByReadStats(mg)
-    
-    ## calling mapper for each index file
-    mapper.parallel(nameF, mg, nprocs=npar_map, params={'-f':'', '-p':ncores_3rd})
-
 
-    #-- similarity estimation by pairwise mapping simulated reads --#
-    ## select simulator
-    simulator = ReadSimulator.getSimulator('mason')
-    ## setting params based on metagenome read stats & platform
-    platform, simParams = simulator.get_paramsByReadStats(mg, params={'--num-reads':nSimReads})
-    
-    ## calling simulator using process pool
-    retVal = simulator.parallel(nameF, nprocs=npar_sim, outDir=tmpdir, platform=platform, params=simParams)
-    if retVal:
-        writer.simReadError()
+    ## presence screening: working set of references for this metagenome (indices in nameF)
+    refIdx = range(nameF.len())
+    if screenReads > 0:
+        refIdx = screenRefs(mg, mapper)
+    mgNameF = nameF.subset(refIdx)
+
+    ## collapsing duplicate reads (unique reads are mapped; multiplicities used as weights)
+    readWeights = None
+    nMapReads = mg.get_readCount()
+    if args['--dedup']:
+        readWeights = mg.dedup(onDisk=args['--dedup-on-disk'], rmFile=True)
+        nMapReads = len(readWeights)
+
+    job = dict(mg=mg, writer=writer, tmpdir=tmpdir, platform=mg_platform, mapper=mapper,
+               refIdx=refIdx, mgNameF=mgNameF, sampleFrac=sampleFrac, readWeights=readWeights)
+
+    ## small metagenomes: queued & mapped jointly with other small metagenomes (see mapJoint)
+    if len(refIdx) > 0 and nMapReads <= jointMaxReads:
+        job['readFile'] = os.path.abspath(mg.get_readFile())
+        jointJobs[mapper.mapperName].append(job)
+        if len(jointJobs[mapper.mapperName]) >= jointGroupSize:
+            mapJoint(jointJobs.pop(mapper.mapperName))
         continue
-        
-    # finding out how many reads were generated
-    num_reads = [name.get_simReadsCount() for name in nameF.iter_names()]
-    if len(set(num_reads)) > 1:
-        read_counts = ','.join([str(x) for x in set(num_reads)])
-        sys.stderr.write('\nWARNING: differing numbers of reads generated by simulator: {}\n\n'.format(read_counts))
-    num_reads = num_reads[0]
 
-        
-    #-- pairwise mapping of the simulated reads from each ref to all references --#
-    # making list of tuples for all pairwise comparisons
-    pairwiseComps = []
-    n_refs = nameF.len()
-    for i in range(n_refs):
-        # getting simulated reads from first query reference taxon
-        nameQuery = nameF.get_name(i)
-        simReadsFile = nameQuery.get_simReadsFile()
-        
-        for j in range(n_refs):
-        # getting index file of subject for mapping to subject
-            nameSubject = nameF.get_name(j)
-            indexFile = nameSubject.get_indexFile()
-            # append values
-            pairwiseComps.append((i,j,indexFile,simReadsFile,))
-
-    # pairwise mapping
-    pairwiseComps = mapper.pairwise(pairwiseComps, nprocs=npar_map,
-                                    tmpFile=True, params={'-f':'', '-p':ncores_3rd})
-
-    # convert to numpy array
-    simSamFiles = np.array([['' for i in range(n_refs)] for j in range(n_refs)], dtype=object)
-    for row in pairwiseComps:
-        i = row[0]
-        j = row[1]
-        simSamFile = row[4]
-        simSamFiles[i,j] = simSamFile
-        
-    # parse SAM files to create numpy array of number reads mapped    
-    mappedReads = np.zeros((n_refs, n_refs, num_reads))
-    for i in range(n_refs):
-         for j in range(n_refs):
-             # count the reads in i mapping to subject j
-             samfh = pysam.Samfile(simSamFiles[i,j], "r")
-             mappedReads[i,j,:] = np.array( [int(not read.is_unmapped) for read in samfh] )
-             samfh.close()
-             
-    # save the similarity matrix
-    matrixOutFile = mgID + '_simMtx'
-    np.save(matrixOutFile, mappedReads)
-    matrixOutFile += '.npy'
-    sys.stderr.write('Wrote similarity matrix: {}\n'.format(matrixOutFile))
+    if len(refIdx) == 0:
+        sampleMapped = None    # no references present (see screenRefs)
+    elif mapCache is not None:
+        sampleMapped = mapSampleCached(mg, mapper, refIdx, nMapReads)
+    else:
+        sampleMapped = mapSample(mg, mapper, refIdx, nMapReads)
 
-    
+    correctSample(job, sampleMapped)
 
-    #-- similarity correction --#
-    ## input: matrix & original reads -> ref sam file
-    ## will bootstrap similarity matrix based on 'nBootstrap'
-    refSamFiles = [name.get_refSamFile() for name in nameF.iter_names()]
-    CorAbund = CorrectAbundances()            # create instance
-    result = CorAbund.similarityCorrection(refSamFiles, matrixOutFile, nBootstrap, npar_boot)
+# remaining (incomplete) groups of small metagenomes
+for mapperName in sorted(jointJobs.keys()):
+    mapJoint(jointJobs[mapperName])
 
-    
-    #-- writing output --#
-    for i,name in enumerate(nameF.get_names()):
-        total = result['total']
-        outvals = dict(
-            ref = name.get_fastaFile(),
-            total = total,
-            mapped = result['num_reads'][i],
-            corr = result['corr'][i] * total,
-            error = result['err'][i] * total,
-            pval = result['p'][i],
-            mgID = mgID,    # metagenome containing the reads used
-            mg_platform = mg_platform
-            )
-        writer.writeValues(outvals)
 
-        
-    # moving back to original working directory; deleting tmp directory
-    if args['--debug'] == False:
-        tmpdir = os.path.abspath(os.curdir)
-        os.chdir(origWorkDir)
-        try:
-            shutil.rmtree(tmpdir)
-        except OSError:
-            sys.stderr.write(' WARNING: could not delete temporary directory: {}\n'.format(tmpdir))
-        
+# removing combined index & simulated reads
+if args['--combined-index'] or args['--single-pass-map']:
+    shutil.rmtree(indexDir, ignore_errors=True)
+if args['--debug'] == False:
+    shutil.rmtree(simDir, ignore_errors=True)
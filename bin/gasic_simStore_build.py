@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+#--- Option parsing ---#
+"""
+gasic_simStore_build.py: fill the GASiC similarity store for a set of references
+
+Usage:
+  gasic_simStore_build.py [options] <nameFile> <storeDir>
+  gasic_simStore_build.py -h | --help
+  gasic_simStore_build.py --version
+
+Options:
+  <nameFile>          Name file (See gasic_seqDB_batch.py).
+  <storeDir>          Similarity store directory (created if needed).
+  --platform=<p>      Sequencing platform of the simulated reads ('illumina', '454' or 'sanger').
+                      [default: illumina]
+  --read-length=<rl>  Simulated read length (illumina). [default: 100]
+  --read-length-mean=<lm>   Mean simulated read length (454/sanger). [default: 400]
+  --read-length-error=<le>  Stdev of simulated read lengths (454/sanger). [default: 40]
+  --nreads-sim=<ns>   Number of reads to simulate per reference. [default: 10000]
+  --seed=<s>          Simulator seed. [default: 0]
+  --simulator=<sm>    Read simulator ('mason' or 'numpy'). [default: mason]
+  --mapper=<m>        Read mapper ('bowtie2', 'minimap2' or 'kmer'). [default: bowtie2]
+  --shard=<sh>        Shard of the query references to process (0-based). [default: 0]
+  --nshards=<nsh>     Total number of shards. [default: 1]
+  --npar-map=<nm>     Number of parallel read mapping calls. [default: 1]
+  --npar-sim=<ns>     Number of parallel read simulations. [default: 1]
+  --ncores-3rd=<nt>   Number of cores used by 3rd party software. [default: 1]
+  --version           Show version.
+  -h --help           Show this screen.
+
+Description:
+  Simulated reads of each query reference are mapped to all references in
+  the nameFile, and the mapped-read flags of each (query, subject) pair are
+  added to the similarity store. Pairs already in the store are skipped.
+
+  Query references are split into --nshards shards by row index, so the
+  store can be filled by independent batch jobs (1 per shard) that share
+  <storeDir>.
+
+  The simulation profile is determined by --simulator, --platform, the read length
+  params, --nreads-sim, --seed and --mapper. gasic_seqDB_batch.py --sim-store uses
+  entries with the same profile (use --sim-len-bin/--sim-err-bin so that
+  metagenome read stats fall on the read lengths in the store).
+"""
+
+from docopt import docopt
+import os, sys
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.1')
+
+
+#--- Package import ---#
+import tempfile
+import shutil
+
+scriptDir = os.path.dirname(__file__)
+libDir = os.path.join(scriptDir, '../lib/')
+sys.path.append(libDir)
+libDir = os.path.join(scriptDir, '../lib/gasic-r16/')
+sys.path.append(libDir)
+
+import gasicBatch.NameFile as NameFile
+from gasicBatch.ReadMapper import ReadMapper
+from gasicBatch.ReadSimulator import ReadSimulator
+from gasicBatch.SimStore import SimStore
+from gasicBatch.Cache import paramsKey
+
+
+#--- Main ---#
+# unpack args
+shard = int(args['--shard'])
+nshards = int(args['--nshards'])
+npar_map = int(args['--npar-map'])
+npar_sim = int(args['--npar-sim'])
+ncores_3rd = int(args['--ncores-3rd'])
+platform = args['--platform'].lower()
+
+# simulation profile (same params as set by gasic_seqDB_batch.py)
+simParams = {'--num-reads' : int(args['--nreads-sim']),
+             '--seed' : int(args['--seed'])}
+if platform == 'illumina':
+    simParams['--read-length'] = int(args['--read-length'])
+else:
+    simParams['--read-length-mean'] = float(args['--read-length-mean'])
+    simParams['--read-length-error'] = float(args['--read-length-error'])
+profile = paramsKey(args['--simulator'].lower(), platform, simParams, args['--mapper'])
+sys.stderr.write('Simulation profile: {}\n'.format(profile))
+
+# references
+nameF = NameFile.NameFile(args['<nameFile>'])
+simStore = SimStore(args['<storeDir>'])
+
+# query references of this shard that have pairs missing from the store
+# (only the missing pairs are mapped & added)
+shardRows = range(shard, nameF.len(), nshards)
+mapSkip = simStore.skipMask(nameF, profile)
+rows = [i for i in shardRows if not mapSkip[i].all()]
+msg = 'Shard {} of {}: {} pairs of {} of {} query references need pairwise mapping\n'
+sys.stderr.write(msg.format(shard, nshards, (~mapSkip[rows]).sum(), len(rows), len(shardRows)))
+if len(rows) == 0:
+    sys.exit(0)
+
+# simulating reads
+tmpdir = tempfile.mkdtemp()
+simulator = ReadSimulator.getSimulator(args['--simulator'])
+retVal = simulator.parallel(nameF.subset(rows), nprocs=npar_sim, outDir=tmpdir,
+                            platform=platform, params=simParams)
+if retVal:
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    sys.stderr.write('ERROR: read simulation failed\n')
+    sys.exit(1)
+
+# pairwise mapping & adding to the store
+if args['--mapper'] == 'bowtie2':
+    mapper = ReadMapper.getMapper(args['--mapper'])
+else:
+    # each reference indexed once (not once per mapper call)
+    mapper = ReadMapper.getMapper(args['--mapper'], indexStore=os.path.join(tmpdir, 'indexes'))
+mappedRows = mapper.pairwise_rows(nameF, rows, skipPairs=mapSkip, nprocs=npar_map,
+                                  params={'-f':'', '-p':ncores_3rd})
+simStore.add_rows(nameF, profile, rows, mappedRows, mapSkip)
+sys.stderr.write('Added {} references to similarity store: {}\n'.format(len(rows), args['<storeDir>']))
+
+shutil.rmtree(tmpdir, ignore_errors=True)
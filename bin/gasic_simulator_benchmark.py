@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+#--- Option parsing ---#
+"""
+gasic_simulator_benchmark.py: compare read simulators (speed & simulated read stats)
+
+Usage:
+  gasic_simulator_benchmark.py [options] <refFasta>...
+  gasic_simulator_benchmark.py -h | --help
+  gasic_simulator_benchmark.py --version
+
+Options:
+  <refFasta>...       Reference fasta file(s) used for read simulation.
+  --simulators=<s>    Simulators to compare (comma-delim list). [default: mason,numpy]
+  --platform=<p>      Sequencing platform ('illumina', '454' or 'sanger'). [default: illumina]
+  --read-length=<rl>  Simulated read length (illumina). [default: 100]
+  --read-length-mean=<lm>   Mean simulated read length (454/sanger). [default: 400]
+  --read-length-error=<le>  Stdev of simulated read lengths (454/sanger). [default: 40]
+  --nreads-sim=<ns>   Number of reads to simulate per reference. [default: 10000]
+  --index=<ix>        bowtie2 index of the references (comma-delim list; same order as
+                      <refFasta>). If provided, the fraction of simulated reads mapping to
+                      the source reference is reported.
+  --version           Show version.
+  -h --help           Show this screen.
+
+Description:
+  Each simulator is run on each reference; the run time and stats of the
+  simulated reads (read length mean & stdev, GC content, mapped fraction)
+  are written as a tab-delimited table to STDOUT.
+"""
+
+from docopt import docopt
+import os, sys
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='0.1')
+
+
+#--- Package import ---#
+import time
+import tempfile
+import shutil
+
+import numpy as np
+import pysam
+from Bio import SeqIO
+
+scriptDir = os.path.dirname(__file__)
+libDir = os.path.join(scriptDir, '../lib/')
+sys.path.append(libDir)
+
+from gasicBatch.ReadMapper import ReadMapper
+from gasicBatch.ReadSimulator import ReadSimulator
+
+
+#--- Main ---#
+platform = args['--platform'].lower()
+simParams = {'--num-reads' : int(args['--nreads-sim'])}
+if platform == 'illumina':
+    simParams['--read-length'] = int(args['--read-length'])
+else:
+    simParams['--read-length-mean'] = float(args['--read-length-mean'])
+    simParams['--read-length-error'] = float(args['--read-length-error'])
+
+indexFiles = None
+if args['--index'] is not None:
+    indexFiles = args['--index'].split(',')
+    mapper = ReadMapper.getMapper('bowtie2')
+
+tmpdir = tempfile.mkdtemp()
+print '\t'.join(['simulator', 'reference', 'seconds', 'n_reads', 'length_mean',
+                 'length_stdev', 'GC', 'mapped_fraction'])
+for simName in args['--simulators'].split(','):
+    simulator = ReadSimulator.getSimulator(simName)
+    for i,refFile in enumerate(args['<refFasta>']):
+        # simulation
+        start = time.time()
+        res = simulator(refFile, outDir=tmpdir, platform=platform, params=dict(simParams))
+        seconds = time.time() - start
+        if res['simReadsFile'] is None:
+            sys.stderr.write('WARNING: {} simulation failed for {}\n'.format(simName, refFile))
+            continue
+
+        # read stats
+        seqs = [str(rec.seq).upper() for rec in SeqIO.parse(res['simReadsFile'], res['simReadsFileType'])]
+        lens = np.array([len(x) for x in seqs])
+        gc = sum(x.count('G') + x.count('C') for x in seqs) / float(max(lens.sum(), 1))
+
+        # fraction of reads mapped to source reference
+        mappedFrac = 'NA'
+        if indexFiles is not None:
+            params = {'-p' : 1}
+            if res['simReadsFileType'] == 'fasta':
+                params['-f'] = ''
+            samFile = mapper(indexFiles[i], res['simReadsFile'], tmpFile=True, params=params)
+            samfh = pysam.Samfile(samFile, 'r')
+            mapped = [int(not read.is_unmapped) for read in samfh]
+            samfh.close()
+            os.remove(samFile)
+            mappedFrac = np.mean(mapped)
+
+        print '\t'.join([str(x) for x in [simName, refFile, round(seconds, 3), len(seqs),
+                                          lens.mean(), lens.std(), gc, mappedFrac]])
+        os.remove(res['simReadsFile'])
+
+shutil.rmtree(tmpdir, ignore_errors=True)
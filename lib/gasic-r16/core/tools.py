@@ -26,6 +26,10 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import os
+import shlex
+import shutil
+import subprocess
+import tempfile
 
 # Names File Reader
 #
@@ -37,6 +41,47 @@ def read_names(filename):
     return names
 
 
+# Command execution
+#
+# Tools are called with an argument list (no shell), so file names are never
+# interpreted by a shell, and the exit code of every call is checked.
+# Intermediate files are written to a unique temporary directory next to
+# the output file, so any number of calls can run at the same time.
+
+def run_command(argv, stdout=None):
+    """ Run a command (list of arguments). stdout: output file name [default: inherit].
+    Raises an Exception if the exit code is not 0. """
+    print "Executing:", " ".join(argv)
+    if stdout is None:
+        ret = subprocess.call(argv)
+    else:
+        with open(stdout, 'w') as fh:
+            ret = subprocess.call(argv, stdout=fh)
+    if ret != 0:
+        raise Exception('Aborting. "%s" failed with exit code %d'%(argv[0], ret))
+    return 1
+
+def run_command_sam(argv, out, skip_flags=0x900):
+    """ Run a command writing SAM to STDOUT and save it to out, dropping all
+    alignments with any of skip_flags set (default: secondary & supplementary),
+    so that the SAM file contains exactly ONE record per read. """
+    print "Executing:", " ".join(argv)
+    with open(out, 'w') as fh:
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE)
+        for line in proc.stdout:
+            if not line.startswith('@') and int(line.split('\t', 2)[1]) & skip_flags:
+                continue
+            fh.write(line)
+        ret = proc.wait()
+    if ret != 0:
+        raise Exception('Aborting. "%s" failed with exit code %d'%(argv[0], ret))
+    return 1
+
+def temp_dir_for(out):
+    """ Unique temporary directory next to the output file out. """
+    return tempfile.mkdtemp(prefix='.tmp_', dir=os.path.dirname(os.path.abspath(out)))
+
+
 # Read Mappers
 #
 # Define caller functions for the read mappers here. These fuctions call the
@@ -53,37 +98,48 @@ def read_names(filename):
 # match for each read (e.g. the best match).
 
 def run_bowtie2(index, reads, out, param=""):
-    command = "bowtie2 -U {reads} -x {index} -S {samfile} {param} --local -M 0 ".format(reads=reads, index=index, samfile=out, param=param)
-    print "Executing:",command
-    os.system(command)
-    return 1
+    argv = ["bowtie2", "-U", reads, "-x", index, "-S", out] + shlex.split(param) + ["--local", "-M", "0"]
+    return run_command(argv)
 
 def run_bowtie(index, reads, out, param=""):
-    command = "bowtie -S -p 2 -q -3 30 -v 2 {param} {index} {reads} > {samfile}".format(index=index, reads=reads, samfile=out, param=param)
-    print "Executing:",command
-    os.system(command)
-    return 1
+    # threads (-p) & --reorder are set via param (see mapper_threads)
+    argv = ["bowtie", "-S", "-q", "-3", "30", "-v", "2"] + shlex.split(param) + [index, reads]
+    return run_command(argv, stdout=out)
 
 def run_bwa(index, reads, out, param=""):
-    command = "bwa aln {param} {index} {reads} > /tmp/res.sai".format(index=index, reads=reads, param=param)
-    print "Executing:",command
-    os.system(command)
-    # convert the bwa output to SAM and remove temporary file
-    command_sam = "bwa samse %s /tmp/res.sai %s > %s && rm /tmp/res.sai"%(index,reads,out)
-    os.system(command_sam)
+    tmp = temp_dir_for(out)
+    try:
+        sai = os.path.join(tmp, "res.sai")
+        run_command(["bwa", "aln"] + shlex.split(param) + [index, reads], stdout=sai)
+        # convert the bwa output to SAM
+        run_command(["bwa", "samse", index, sai, reads], stdout=out)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
     return 1
 
 def run_bwasw(index, reads, out, param=""):
-    command = "bwa bwasw {param} {index} {reads} > {samfile}".format(index=index, reads=reads, samfile=out, param=param)
-    print "Executing:",command
-    os.system(command)
-    return 1
+    argv = ["bwa", "bwasw"] + shlex.split(param) + [index, reads]
+    return run_command(argv, stdout=out)
+
+def run_bwa_mem(index, reads, out, param=""):
+    # bwa mem reports supplementary alignments; only primary records are kept
+    argv = ["bwa", "mem"] + shlex.split(param) + [index, reads]
+    return run_command_sam(argv, out)
 
 
 run_mapper = dict( bowtie=run_bowtie,
                    bowtie2=run_bowtie2,
                    bwa = run_bwa,
-                   bwasw = run_bwasw,)
+                   bwasw = run_bwasw,
+                   bwa_mem = run_bwa_mem,)
+
+# mapper parameter for setting the number of threads (used via param)
+# multi-threaded bowtie/bowtie2 need --reorder to keep SAM records in read order
+mapper_threads = dict( bowtie="-p %d --reorder",
+                       bowtie2="-p %d --reorder",
+                       bwa = "-t %d",
+                       bwasw = "-t %d",
+                       bwa_mem = "-t %d",)
 
 """
 How to add your custom mapper
@@ -91,6 +147,8 @@ How to add your custom mapper
 1. Create a caller function
    - Create a copy of one of the existing functions, e.g. run_bowtie
    - Rename it, customize it, but DO NOT TOUCH the interface!
+   - Call the mapper via run_command (argument list, exit code check) and
+     write intermediate files to temp_dir_for(out), so parallel calls are safe.
 
 2. Add the caller function to the run_mapper dict
    - The dict entry should have the format: [name] = [caller function]
@@ -115,21 +173,24 @@ How to add your custom mapper
 # to create a seperate caller function for every scenario.
 
 def run_mason_illumina(ref, out):
-    command = "mason illumina -N 10000 -hi 0 -hs 0 -n 72  -sq -o %s %s"%(out,ref)
-    print "Executing:",command
-    os.system(command)
+    argv = ["mason", "illumina", "-N", "10000", "-hi", "0", "-hs", "0", "-n", "72", "-sq", "-o", out, ref]
+    run_command(argv)
     # remove the needless SAM file
-    command = "rm %s.sam"%out
-    os.system(command)
+    if os.path.exists(out + ".sam"):
+        os.remove(out + ".sam")
     return 1
 
 def run_dwgsim(ref, out):
-    command = "dwgsim -c 2 -1 80 -2 0 -r 0 -y 0 -e 0.002 -N 100000 -f TACG %s %s"%(ref, out)
-    print "Executing:",command
-    os.system(command)
-    # remove all additional files and rename reads file
-    command = "mv {out}.bfast.fastq {out} && rm {out}.bwa.read1.fastq && rm {out}.bwa.read2.fastq && rm {out}.mutations.txt".format(out=out)
-    os.system(command)
+    # dwgsim writes several files with the output prefix; only the reads file is kept
+    tmp = temp_dir_for(out)
+    try:
+        prefix = os.path.join(tmp, "reads")
+        argv = ["dwgsim", "-c", "2", "-1", "80", "-2", "0", "-r", "0", "-y", "0", "-e", "0.002",
+                "-N", "100000", "-f", "TACG", ref, prefix]
+        run_command(argv)
+        shutil.move(prefix + ".bfast.fastq", out)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
     return 1
 
 
@@ -142,6 +203,8 @@ How to add your custom read simulator
 1. Create a caller function
    - Create a copy of one of the existing functions, e.g. run_dwgsim
    - Rename it, customize it, but DO NOT TOUCH the interface!
+   - Call the simulator via run_command and write intermediate files to
+     temp_dir_for(out), so parallel calls are safe.
 
 2. Add the caller function to the run_simulator dict
    - The dict entry should have the format: [name] = [caller function]
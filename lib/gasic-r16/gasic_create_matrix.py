@@ -30,6 +30,7 @@ import sys
 import os
 import glob
 import optparse
+import multiprocessing
 
 import numpy as np
 from Bio import SeqIO
@@ -38,7 +39,27 @@ import pysam
 from core import tools
 
 
-def similarity_matrix_raw(names, ref_pattern, index_pattern, temp_dir, simulator, mapper):
+def _simulate(job):
+    """ Pool worker: simulate reads for one reference. job = (simulator, ref_file, sim_file) """
+    simulator, ref_file, sim_file = job
+    return tools.run_simulator[simulator](ref_file, sim_file)
+
+def _map(job):
+    """ Pool worker: map simulated reads to one reference. job = (mapper, index_file, sim_file, samfile, param) """
+    mapper, index_file, sim_file, samfile, param = job
+    return tools.run_mapper[mapper](index_file, sim_file, samfile, param=param)
+
+def _parse(job):
+    """ Pool worker: parse one SAM file. job = samfile
+    Returns the mapped flags as a compact uint8 array. """
+    samfile = job
+    samhandle = pysam.Samfile(samfile, "r")
+    mapped = np.array( [int(not read.is_unmapped) for read in samhandle], dtype=np.uint8 )
+    samhandle.close()
+    return mapped
+
+
+def similarity_matrix_raw(names, ref_pattern, index_pattern, temp_dir, simulator, mapper, jobs=1, mapper_threads=1):
     """
     Perform the read generation and mapping step for the similarity matrix
     calculation. The raw output is used to bootstrap a similarity matrix.
@@ -49,6 +70,8 @@ def similarity_matrix_raw(names, ref_pattern, index_pattern, temp_dir, simulator
     index_pattern:     pattern pointing to the mapping index files used by the read mapper
     temp_dir:          directory where temporary files are stored (simulated reads, SAM files).
                        Attention: make sure that there is enough space available!
+    jobs:              number of simulator/mapper calls & SAM files parsed in parallel
+    mapper_threads:    number of threads used by each mapper call
 
     OUTPUT:
     mapped_reads:      Mapping information about mapped reads readily usable by
@@ -69,31 +92,40 @@ def similarity_matrix_raw(names, ref_pattern, index_pattern, temp_dir, simulator
     ref_files = [ ref_pattern%nm for nm in names ] # filenames of reference sequences
     index_files = [ index_pattern%nm for nm in names ]   # filenames of mapper index files
     sim_files = [ temp_dir+'/'+nm+'.fastq' for nm in names ] # filenames of simulated read files
-    
-    # generate reads for every reference genome
-    for i in rng:
-        tools.run_simulator[simulator](ref_files[i], sim_files[i])
-
-    # find out how many reads were generated
-    # Attention: Here we assume that all files contain the same number of reads
-    # and are stored in fastq format
-    num_reads = len( [ True for i in SeqIO.parse(sim_files[0],'fastq') ] )
-    
-    # map the reads of every reference to all references
-    for i in rng:
-        for j in rng:
-            samfile = temp_dir+'/'+names[i]+'-'+names[j]+'.sam'
-            tools.run_mapper[mapper](index_files[j], sim_files[i], samfile)
-
-    # parse SAM files
-    mapped_reads = np.zeros((n_seq,n_seq, num_reads))
-    for i in rng:
-        for j in rng:
-            # count the reads in i mapping to refernce j
-            samfile = temp_dir+'/'+names[i]+'-'+names[j]+'.sam'
-            samhandle = pysam.Samfile(samfile, "r")
-            mapped_reads[i,j,:] = np.array( [int(not read.is_unmapped) for read in samhandle] )
-
+    sam_files = [ [ temp_dir+'/'+names[i]+'-'+names[j]+'.sam' for j in rng ] for i in rng ]
+
+    # mapper threads param
+    param = ""
+    if mapper_threads > 1:
+        param = tools.mapper_threads[mapper]%mapper_threads
+
+    # bounded process pool for all simulator, mapper & parsing jobs
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # generate reads for every reference genome
+        pool.map(_simulate, [ (simulator, ref_files[i], sim_files[i]) for i in rng ], chunksize=1)
+
+        # find out how many reads were generated
+        # Attention: Here we assume that all files contain the same number of reads
+        # and are stored in fastq format
+        num_reads = len( [ True for i in SeqIO.parse(sim_files[0],'fastq') ] )
+
+        # map the reads of every reference to all references
+        map_jobs = [ (mapper, index_files[j], sim_files[i], sam_files[i][j], param) for i in rng for j in rng ]
+        pool.map(_map, map_jobs, chunksize=1)
+
+        # parse SAM files into a preallocated compact tensor
+        # (count the reads in i mapping to reference j)
+        compact = np.zeros((n_seq,n_seq, num_reads), dtype=np.uint8)
+        parse_jobs = [ sam_files[i][j] for i in rng for j in rng ]
+        for k,mapped in enumerate(pool.imap(_parse, parse_jobs, chunksize=1)):
+            compact[k // n_seq, k % n_seq, :] = mapped
+    finally:
+        pool.close()
+        pool.join()
+
+    # same dtype (float64) as before, so saved matrices are unchanged
+    mapped_reads = compact.astype(np.float64)
     return mapped_reads
 
 
@@ -111,6 +143,7 @@ Second, the simulated reads of each species are mapped against all reference
 genomes using the mapper specified with -m.
 Third, the resulting SAM-files are analyzed to calculate the similarity
 matrix. The similarity matrix is stored as a numpy file (-o).
+Simulator calls, mapper calls and SAM parsing run in a pool of -j processes.
 
 Input:
 NAMES:  Filename of the names file; the plain text names file should
@@ -127,6 +160,8 @@ See the provided LICENSE file or source code for license information.
     parser.add_option('-m', '--mapper', type='string', dest='mapper', default=None, help='Identifier of mapper defined in core/tools.py [default: %default]')
     parser.add_option('-i', '--index', type='string', dest='index', default='./ref/%s.fasta', help='Reference index files for the read mapper. Placeholder for the name is "%s". [default: %default]')    
     parser.add_option('-t', '--temp', type='string', dest='temp', default='./temp', help='Directory to store temporary simulated datasets and SAM files. [default: %default]')
+    parser.add_option('-j', '--jobs', type='int', dest='jobs', default=1, help='Number of simulator & mapper calls (and SAM files parsed) in parallel. [default: %default]')
+    parser.add_option('--mapper-threads', type='int', dest='mapper_threads', default=1, help='Number of threads used by each mapper call. [default: %default]')
     parser.add_option('-o', '--output', type='string', dest='out', default='./similarity_matrix.npy', help='Output similarity matrix file. [default: %default]')
     # parse arguments
     opt, args = parser.parse_args()
@@ -138,7 +173,8 @@ See the provided LICENSE file or source code for license information.
         names = tools.read_names(names_file)
 
         # construct the similarity matrix
-        smat = similarity_matrix_raw(names, opt.ref, opt.index, opt.temp, opt.simulator, opt.mapper)
+        smat = similarity_matrix_raw(names, opt.ref, opt.index, opt.temp, opt.simulator, opt.mapper,
+                                    jobs=opt.jobs, mapper_threads=opt.mapper_threads)
 
         # save the similarity matrix
         np.save(opt.out, smat)
@@ -30,9 +30,18 @@ import optparse
 import glob
 import os
 import sys
+import multiprocessing
 
 from core import tools
 
+
+def _map(job):
+    """ Pool worker: one mapper call. job = (mapper, ref, reads, out) """
+    mapper, ref, reads, out = job
+    print ". mapping reads with %s to %s"%(mapper, ref)
+    return tools.run_mapper[mapper](ref, reads, out)
+
+
 if __name__=="__main__":
     usage = """%prog NAMES READS -i REF -o OUT -m MAPPER
 
@@ -55,6 +64,7 @@ READS:  File containing the reads to be mapped.
     parser = optparse.OptionParser(usage=usage)
     parser.add_option('-m', '--mapper', type='string', dest='mapper', default=None, help='Identifier of mapper defined in core/tools.py [default: %default]')
     parser.add_option('-i', '--index', type='string', dest='ref', default='./ref/%s.fasta', help='Pattern, that points to the reference sequences/indices when used with a name. Placeholder for the name is "%s". [default: %default]')
+    parser.add_option('-j', '--jobs', type='int', dest='jobs', default=1, help='Number of mapper calls in parallel. [default: %default]')
     parser.add_option('-o', '--output', type='string', dest='out', default='./SAM/%s.sam', help='Pattern, that points to the output SAM file, when used with a name. Placeholder for the name is "%s". [default: %default]')
     # parse arguments
     options, args = parser.parse_args()
@@ -74,9 +84,17 @@ READS:  File containing the reads to be mapped.
         if not os.path.exists(os.path.dirname(options.out)):
             os.makedirs(os.path.dirname(options.out))
     
-        for i in range(len(names)):
-            print ". mapping reads with %s to %s"%(options.mapper, ref[i]) 
-            tools.run_mapper[options.mapper](ref[i], reads, out[i])
+        jobs = [ (options.mapper, ref[i], reads, out[i]) for i in range(len(names)) ]
+        if options.jobs > 1:
+            pool = multiprocessing.Pool(options.jobs)
+            try:
+                pool.map(_map, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                _map(job)
     else:
         parser.print_help()
         sys.exit(1)
@@ -0,0 +1,108 @@
+"""Content-addressed file cache (keyed by file checksums & parameters)"""
+
+import os
+import hashlib
+import uuid
+import numpy as np
+
+
+def fileChecksum(fileName, blockSize=2**20):
+    """md5 checksum of a file's contents.
+
+    Args:
+    fileName -- file name
+    blockSize -- number of bytes read at a time
+
+    Return:
+    string -- hex digest
+    """
+    md5 = hashlib.md5()
+    with open(fileName, 'rb') as fh:
+        for block in iter(lambda: fh.read(blockSize), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def paramsKey(*args):
+    """Creating a key from a set of parameters (eg., checksums, param dicts, seeds).
+    Dicts are sorted by key, so parameter order does not matter.
+
+    Args:
+    args -- any objects with a stable repr()
+
+    Return:
+    string -- hex digest
+    """
+    parts = []
+    for x in args:
+        if isinstance(x, dict):
+            x = sorted((str(k), str(v)) for k,v in x.items())
+        parts.append(repr(x))
+    return hashlib.md5('|'.join(parts)).hexdigest()
+
+
+class FileCache(object):
+    """Directory of files named by key. Files are written to a temporary
+    name and then renamed, so concurrent jobs (or nodes sharing the
+    directory) never see partially written entries.
+    """
+
+    def __init__(self, cacheDir):
+        """
+        Args:
+        cacheDir -- cache directory (created if needed)
+        """
+        self.cacheDir = os.path.abspath(cacheDir)
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError:   # created by another process
+                pass
+
+
+    def get_path(self, key, ext=''):
+        """File path for key (the file may not exist).
+
+        Args:
+        key -- cache key (see paramsKey)
+        ext -- file extension
+        """
+        return os.path.join(self.cacheDir, key + ext)
+
+    def exists(self, key, ext=''):
+        return os.path.exists(self.get_path(key, ext))
+
+    def get_tmpPath(self, key, ext=''):
+        """Temporary file path for writing a cache entry (see commit)"""
+        return self.get_path(key, '.tmp' + uuid.uuid4().hex[:10] + ext)
+
+    def commit(self, tmpPath, key, ext=''):
+        """Moving a written temporary file into the cache.
+
+        Return:
+        string -- path of the cache entry
+        """
+        path = self.get_path(key, ext)
+        os.rename(tmpPath, path)
+        return path
+
+
+    def load_npy(self, key):
+        """Loading a numpy array from the cache.
+
+        Return:
+        numpy array; None if not in cache
+        """
+        if not self.exists(key, '.npy'):
+            return None
+        return np.load(self.get_path(key, '.npy'))
+
+    def save_npy(self, key, arr):
+        """Saving a numpy array to the cache.
+
+        Return:
+        string -- path of the cache entry
+        """
+        tmpPath = self.get_tmpPath(key, '.npy')
+        np.save(tmpPath, arr)
+        return self.commit(tmpPath, key, '.npy')
@@ -0,0 +1,114 @@
+"""Collapsing redundant (near-identical) references into clusters"""
+
+import sys
+import numpy as np
+
+from Cache import FileCache, paramsKey
+from Sketch import Sketcher
+
+
+def clusterMatrix(sim, threshold):
+    """Single-linkage clustering of references by pairwise similarity.
+    Two references are linked if the similarity is >= threshold in both
+    directions (eg., k-mer containment of i in j and of j in i, or the
+    fraction of simulated reads of i mapping to j and vice versa).
+
+    Args:
+    sim -- numpy array (n_refs, n_refs) of pairwise similarities (NaN = unknown; not linked)
+    threshold -- min similarity for linking 2 references
+
+    Return:
+    numpy array (n_refs,) -- row index of the cluster representative of each reference.
+    The representative is the member with the highest summed similarity of the
+    other members to it (ties: lowest row index).
+    """
+    n_refs = sim.shape[0]
+    sim = np.nan_to_num(sim)
+    linked = np.minimum(sim, sim.T) >= threshold
+
+    # connected components (union-find)
+    parent = range(n_refs)
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i,j in zip(*np.nonzero(np.triu(linked, 1))):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    # representative of each cluster
+    clusterMap = np.zeros(n_refs, dtype=int)
+    roots = np.array([find(i) for i in range(n_refs)])
+    for root in np.unique(roots):
+        members = np.nonzero(roots == root)[0]
+        score = sim[np.ix_(members, members)].sum(axis=0)
+        clusterMap[members] = members[np.argmax(score)]
+    return clusterMap
+
+
+def writeClusterMap(names, clusterMap, outFile):
+    """Writing the reference -> representative map as a tab-delim table.
+
+    Args:
+    names -- NameFile instance (all references)
+    clusterMap -- numpy array of representative row indices (see clusterMatrix)
+    outFile -- output file name
+    """
+    with open(outFile, 'wb') as outFH:
+        outFH.write('\t'.join(['reference', 'representative', 'cluster_size']) + '\n')
+        sizes = np.bincount(clusterMap, minlength=len(clusterMap))
+        for i,name in enumerate(names.iter_names()):
+            rep = clusterMap[i]
+            outFH.write('\t'.join([name.get_fastaFile(), names.get_name(rep).get_fastaFile(),
+                                   str(sizes[rep])]) + '\n')
+
+
+
+class RefClusterer(object):
+    """Clustering references by k-mer sketch containment"""
+
+    def __init__(self, threshold, k=21, scale=1000, cacheDir=None):
+        """
+        Args:
+        threshold -- min mutual k-mer containment for collapsing 2 references
+        k -- k-mer length (see Sketcher)
+        scale -- sketch scale (see Sketcher)
+        cacheDir -- directory for caching sketches & cluster maps. If None: no caching.
+        """
+        self.threshold = threshold
+        self.sketcher = Sketcher(k=k, scale=scale, cacheDir=cacheDir)
+        if cacheDir is None:
+            self.cache = None
+        else:
+            self.cache = FileCache(cacheDir)
+
+
+    def cluster(self, names, nprocs=1):
+        """Cluster map of the references; loaded from cache if available.
+        Cached maps are keyed by the checksums (in order) of all references,
+        so a map is reused by any run with the same reference set.
+
+        Args:
+        names -- NameFile instance
+        nprocs -- number of parallel sketching calls
+
+        Return:
+        numpy array (n_refs,) -- row index of the cluster representative of each reference
+        """
+        checksums = [name.get_checksum() for name in names.iter_names()]
+        key = paramsKey('clusters', checksums, self.threshold,
+                        self.sketcher.k, self.sketcher.scale)
+        if self.cache is not None:
+            clusterMap = self.cache.load_npy(key)
+            if clusterMap is not None:
+                sys.stderr.write('Using cached reference cluster map: {}\n'.format(key))
+                return clusterMap
+
+        containment = self.sketcher.containment(names, nprocs=nprocs)
+        clusterMap = clusterMatrix(containment, self.threshold)
+
+        if self.cache is not None:
+            self.cache.save_npy(key, clusterMap)
+        return clusterMap
@@ -11,25 +11,15 @@ from core import tools
 class CorrectAbundances(object):
     
     @staticmethod
-    def similarityCorrection(samFiles, smatFile, nBootstrap, npar_boot):
-        """
-        Perform similarity correction step. The similarity matrix and mapping
-        results must be available.
-        
+    def mappedFromSam(samFiles):
+        """Mapping signatures of the query reads from SAM files.
+
         Args:
         samFiles -- list of SAM files (query reads mapped to each reference).
-        smatFile -- mapping information for similarity matrix with same ordering as simSamFile list.
-        nBootstrap -- number of bootstrap samples, use 1 to disable bootstrapping.
-        npar_boot -- number of bootstrap samples to processes in parallel.
-        
-        OUTPUT:
-        total:             total number of reads in the dataset
-        num_reads:         number of reads mapped to each genome (array)
-        corr:              abundance of each genome after similarity correction
-        err:               estimated standard error
-        p:                 p-value for the confidence, that the true abundance is above some threshold
-        """
 
+        Return:
+        numpy array (n_refs, total); [i,j]=1 if read j was successfully mapped to i.
+        """
         # find out the total number of reads for first sam file
         total = len( [1 for read in pysam.Samfile(samFiles[0], "r")] )
         sys.stderr.write("...found {} reads\n".format(total))
@@ -38,9 +28,6 @@ class CorrectAbundances(object):
         #   mapping information; mapped[i,j]=1 if read j was successfully mapped to i.
         mapped = np.zeros( (len(samFiles), total) )
         
-        # total number of successfully mapped reads per reference
-        num_reads = np.zeros( (len(samFiles),) )
-        
         # analyze the SAM files
         for n_ind,samFile in enumerate(samFiles):
             sys.stderr.write("...analyzing SAM-File {} of {}\n".format(n_ind+1, len(samFiles)))
@@ -49,17 +36,63 @@ class CorrectAbundances(object):
             
             # go through reads in samfile and check if it was successfully mapped
             mapped[n_ind,:] = np.array([int(not rd.is_unmapped) for rd in sf])
-            num_reads[n_ind] = sum(mapped[n_ind,:])
+
+        return mapped
+
+
+    @staticmethod
+    def similarityCorrection(samFiles, smatFile, nBootstrap, npar_boot, mapped=None, weights=None):
+        """
+        Perform similarity correction step. The similarity matrix and mapping
+        results must be available.
+        
+        Args:
+        samFiles -- list of SAM files (query reads mapped to each reference).
+                    Not used if mapped is provided.
+        smatFile -- mapping information for similarity matrix with same ordering as simSamFile list.
+                    Either a '.npy' file or a '.npz' file with 'mapped' & 'counts' arrays
+                    (variable number of simulated reads per reference).
+        nBootstrap -- number of bootstrap samples, use 1 to disable bootstrapping.
+        npar_boot -- number of bootstrap samples to processes in parallel.
+        mapped -- mapping signatures of the query reads; numpy array (n_refs, total)
+                  with mapped[i,j]=1 if read j mapped to reference i
+                  (eg., from a single pass against a combined index; see ReadMapper.map_combined).
+        weights -- multiplicity of each query read, if the reads were deduplicated
+                   (see Dedup.dedupReads). Default: each read counted once.
+        
+        OUTPUT:
+        total:             total number of reads in the dataset
+        num_reads:         number of reads mapped to each genome (array)
+        corr:              abundance of each genome after similarity correction
+        err:               estimated standard error
+        p:                 p-value for the confidence, that the true abundance is above some threshold
+        """
+
+        # mapping information; mapped[i,j]=1 if read j was successfully mapped to i.
+        if mapped is None:
+            mapped = CorrectAbundances.mappedFromSam(samFiles)
+        if weights is None:
+            total = mapped.shape[1]
+            num_reads = mapped.sum(axis=1)
+        else:
+            total = int(weights.sum())
+            num_reads = np.dot(mapped, weights)
             
         # run similarity correction step
         smat = np.load(smatFile)
+        sim_counts = None
+        if smatFile.endswith('.npz'):
+            sim_counts = smat['counts']
+            smat = smat['mapped']
         
-        if total <= 1000000:   # only multi-core for smaller datasets; bug with large datasets
-            p,corr,var = gasic.bootstrap_par(mapped, smat, nBootstrap, nprocs=npar_boot)
+        if mapped.shape[1] <= 1000000:   # only multi-core for smaller datasets; bug with large datasets
+            p,corr,var = gasic.bootstrap_par(mapped, smat, nBootstrap, nprocs=npar_boot,
+                                             sim_counts=sim_counts, weights=weights)
         else: 
             msg = ' WARNING: number of reads ({}) is > 1 million. Not using multiple cores\n'
             sys.stderr.write(msg.format(num_reads))
-            p,corr,var = gasic.bootstrap(mapped, smat, nBootstrap)
+            p,corr,var = gasic.bootstrap(mapped, smat, nBootstrap, sim_counts=sim_counts,
+                                         weights=weights)
 
         err = np.sqrt(var)
         return dict(total=total,num_reads=num_reads,corr=corr,err=err,p=p)
@@ -0,0 +1,76 @@
+"""Collapsing exact duplicate reads into unique reads with multiplicities"""
+
+import os
+import shutil
+import tempfile
+import zlib
+import numpy as np
+from Bio import SeqIO
+
+
+def dedupReads(readFile, outFile, fileType='fasta', onDisk=False, nBuckets=64):
+    """Writing the unique read sequences of a read file. The first read
+    of each set of duplicates is kept (with its read ID).
+
+    Args:
+    readFile -- read file name
+    outFile -- output file name for the unique reads (fasta)
+    fileType -- read file format (SeqIO)
+    onDisk -- partition reads by sequence hash into nBuckets temporary files
+              & deduplicate 1 bucket at a time (memory: 1 bucket of unique sequences)
+    nBuckets -- number of buckets (onDisk=True)
+
+    Return:
+    numpy array -- multiplicity of each unique read (same order as in outFile)
+    """
+    if not onDisk:
+        return _dedup(SeqIO.parse(readFile, fileType), outFile)
+
+    # partitioning by sequence hash
+    tmpDir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(outFile)))
+    try:
+        bucketFiles = [os.path.join(tmpDir, 'bucket{}.fasta'.format(k)) for k in range(nBuckets)]
+        bucketFHs = [open(x, 'wb') for x in bucketFiles]
+        for rec in SeqIO.parse(readFile, fileType):
+            seq = str(rec.seq).upper()
+            bucketFHs[zlib.crc32(seq) % nBuckets].write('>{}\n{}\n'.format(rec.id, seq))
+        for fh in bucketFHs:
+            fh.close()
+
+        # deduplicating each bucket
+        weights = []
+        with open(outFile, 'wb') as outFH:
+            for bucketFile in bucketFiles:
+                weights.append(_dedup(SeqIO.parse(bucketFile, 'fasta'), outFH))
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    return np.concatenate(weights)
+
+
+def _dedup(records, out):
+    """Unique sequences of SeqIO records written as fasta to out (file name or handle).
+
+    Return:
+    numpy array -- multiplicity of each unique sequence
+    """
+    index = dict()
+    counts = []
+    ids = []
+    for rec in records:
+        seq = str(rec.seq).upper()
+        i = index.get(seq)
+        if i is None:
+            index[seq] = len(counts)
+            counts.append(1)
+            ids.append(rec.id)
+        else:
+            counts[i] += 1
+
+    # writing in order of 1st occurrence
+    seqs = sorted(index.items(), key=lambda x: x[1])
+    outFH = open(out, 'wb') if isinstance(out, basestring) else out
+    for seq,i in seqs:
+        outFH.write('>{}\n{}\n'.format(ids[i], seq))
+    if outFH is not out:
+        outFH.close()
+    return np.array(counts, dtype=int)
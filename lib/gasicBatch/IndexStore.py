@@ -0,0 +1,124 @@
+"""Content-addressed store of read mapper indexes"""
+
+import os
+import sys
+import time
+import shutil
+import uuid
+import parmap
+
+from Cache import paramsKey
+
+
+class IndexStore(object):
+    """Directory of mapper indexes keyed by the reference fasta checksum and
+    the index builder version. Each index is built in a temporary directory
+    that is renamed into place when complete, and a lock file ensures that
+    an index is built only once, even by concurrent runs (or nodes) sharing
+    the store.
+    """
+
+    def __init__(self, storeDir, mapper, lockTimeout=86400, pollInterval=10):
+        """
+        Args:
+        storeDir -- store directory (created if needed)
+        mapper -- ReadMapper instance with make_index() & get_version() methods
+        lockTimeout -- seconds after which the lock of an unfinished build is
+                       considered stale (eg., the building job was killed)
+        pollInterval -- seconds between checks for an index built by another job
+        """
+        self.storeDir = os.path.abspath(storeDir)
+        if not os.path.isdir(self.storeDir):
+            try:
+                os.makedirs(self.storeDir)
+            except OSError:   # created by another process
+                pass
+        self.mapper = mapper
+        self.version = mapper.get_version()
+        self.lockTimeout = lockTimeout
+        self.pollInterval = pollInterval
+
+
+    def get_dir(self, name):
+        """Store directory of the index for a reference (the index may not exist).
+
+        Args:
+        name -- Name instance (NameFile)
+        """
+        key = paramsKey('index', name.get_checksum(), self.version)
+        return os.path.join(self.storeDir, key)
+
+    def get_index(self, name):
+        """Index name (prefix) for a reference; None if not in the store"""
+        indexDir = self.get_dir(name)
+        if os.path.isdir(indexDir):
+            return os.path.join(indexDir, 'index')
+        return None
+
+
+    def build(self, name, threads=1):
+        """Building the index for a reference, if not already in the store.
+        If another job holds the build lock, waiting for that build to finish.
+
+        Args:
+        name -- Name instance (NameFile)
+        threads -- number of threads used by the index builder
+
+        Return:
+        string -- index name (prefix)
+        """
+        indexDir = self.get_dir(name)
+        lockFile = indexDir + '.lock'
+        while self.get_index(name) is None:
+            # acquiring the build lock
+            try:
+                fd = os.open(lockFile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                # another job is building the index
+                try:
+                    if time.time() - os.path.getmtime(lockFile) > self.lockTimeout:
+                        sys.stderr.write('Removing stale index lock: {}\n'.format(lockFile))
+                        os.remove(lockFile)
+                        continue
+                except OSError:   # lock removed in the meantime
+                    continue
+                time.sleep(self.pollInterval)
+                continue
+            os.close(fd)
+
+            # building in a tmp directory & moving it into place
+            tmpDir = indexDir + '.tmp' + uuid.uuid4().hex[:10]
+            try:
+                if self.get_index(name) is None:
+                    os.makedirs(tmpDir)
+                    self.mapper.make_index(name.get_fastaFile(), outFile=os.path.join(tmpDir, 'index'),
+                                           threads=threads)
+                    os.rename(tmpDir, indexDir)
+            finally:
+                shutil.rmtree(tmpDir, ignore_errors=True)
+                os.remove(lockFile)
+
+        return self.get_index(name)
+
+
+    def parallel(self, names, nprocs=1, threads=1):
+        """Building all indexes missing from the store (bounded process pool)
+        and setting indexFile for each name in names.
+
+        Args:
+        names -- NameFile instance
+        nprocs -- number of parallel index builds
+        threads -- number of threads used by each index build
+        """
+        missing = [name for name in names.iter_names() if self.get_index(name) is None]
+        msg = 'Index store: building {} of {} indexes\n'
+        sys.stderr.write(msg.format(len(missing), names.len()))
+        parmap.map(_build, missing, self, threads, processes=nprocs)
+
+        for name in names.iter_names():
+            name.set_indexFile(self.get_index(name))
+
+
+def _build(name, store, threads):
+    """For calling IndexStore.build via multiprocessing"""
+    return store.build(name, threads=threads)
@@ -0,0 +1,124 @@
+"""Memory-mapped k-mer index of reference sequences for alignment-free
+read classification (see ReadMapper.MapperKmer).
+
+An index (name = file prefix) consists of:
+  {prefix}.kmers.npy   -- sorted canonical k-mer hashes (uint64; see Sketch.kmerHashes)
+  {prefix}.contigs.npy -- contig index of each k-mer (uint32)
+  {prefix}.names.txt   -- k & contig names + lengths
+Each (k-mer, contig) pair is stored once, so k-mers shared by contigs
+are stored once per contig.
+"""
+
+import numpy as np
+from Bio import SeqIO
+
+from Sketch import kmerHashes
+
+
+def buildKmerIndex(fastaFile, k=21):
+    """k-mer index of all sequences in a fasta file.
+
+    Args:
+    fastaFile -- fasta file name
+    k -- k-mer length (<= 31)
+
+    Return:
+    (kmers, contigs, names, lengths) -- sorted k-mer hashes, contig index of each
+    k-mer, contig names & contig lengths
+    """
+    kmers = []
+    contigs = []
+    names = []
+    lengths = []
+    for i,rec in enumerate(SeqIO.parse(fastaFile, 'fasta')):
+        hashes = np.unique(kmerHashes(rec.seq, k))
+        kmers.append(hashes)
+        contigs.append(np.zeros(len(hashes), dtype=np.uint32) + i)
+        names.append(rec.id)
+        lengths.append(len(rec.seq))
+    if len(kmers) == 0:
+        raise ValueError('No sequences in "{0}"'.format(fastaFile))
+
+    kmers = np.concatenate(kmers)
+    contigs = np.concatenate(contigs)
+    order = np.lexsort((contigs, kmers))
+    return kmers[order], contigs[order], names, lengths
+
+
+def writeKmerIndex(prefix, kmers, contigs, names, lengths, k):
+    """Writing a k-mer index (see buildKmerIndex) to {prefix}.* files"""
+    np.save(prefix + '.kmers.npy', kmers)
+    np.save(prefix + '.contigs.npy', contigs)
+    with open(prefix + '.names.txt', 'wb') as outFH:
+        outFH.write('#k\t{0}\n'.format(k))
+        for name,length in zip(names, lengths):
+            outFH.write('{0}\t{1}\n'.format(name, length))
+
+
+def loadKmerIndex(prefix, k):
+    """Loading a k-mer index; k-mer arrays are memory-mapped (read-only), so
+    concurrent processes share the index pages in RAM.
+
+    Args:
+    prefix -- index name
+    k -- k-mer length expected
+
+    Return:
+    (kmers, contigs, names, lengths)
+    """
+    names = []
+    lengths = []
+    with open(prefix + '.names.txt', 'rb') as inFH:
+        for line in inFH:
+            line = line.rstrip('\n').split('\t')
+            if line[0] == '#k':
+                if int(line[1]) != k:
+                    msg = 'k-mer index "{0}" has k={1}, but k={2} is used'
+                    raise ValueError(msg.format(prefix, line[1], k))
+                continue
+            names.append(line[0])
+            lengths.append(int(line[1]))
+    kmers = np.load(prefix + '.kmers.npy', mmap_mode='r')
+    contigs = np.load(prefix + '.contigs.npy', mmap_mode='r')
+    return kmers, contigs, names, lengths
+
+
+def classifyReads(kmers, contigs, n_contigs, seqs, k, minHitFrac=0.2):
+    """Read -> contig hits of a batch of reads. All reads of the batch are
+    hashed in 1 pass (reads joined by 'N', so no k-mer spans 2 reads) and
+    looked up in the index with binary search.
+
+    Args:
+    kmers, contigs -- k-mer index arrays (see buildKmerIndex)
+    n_contigs -- number of contigs in the index
+    seqs -- list of read sequence strings
+    k -- k-mer length
+    minHitFrac -- min fraction of a read's k-mers found in a contig for a hit
+
+    Return:
+    (reads, hitContigs, hitFrac) -- numpy arrays of the read index, contig index
+    & fraction of read k-mers in the contig for each hit; sorted by read and
+    decreasing hitFrac
+    """
+    starts = np.cumsum([0] + [len(x) + 1 for x in seqs])[:-1]
+    hashes, pos = kmerHashes('N'.join(seqs), k, positions=True)
+    readIdx = np.searchsorted(starts, pos, side='right') - 1
+    nkmers = np.bincount(readIdx, minlength=len(seqs))
+
+    # all (read, contig) pairs sharing a k-mer
+    lo = np.searchsorted(kmers, hashes, side='left')
+    nHits = np.searchsorted(kmers, hashes, side='right') - lo
+    offsets = np.arange(nHits.sum()) - np.repeat(np.cumsum(nHits) - nHits, nHits)
+    hitContigs = np.asarray(contigs[np.repeat(lo, nHits) + offsets], dtype=np.int64)
+    pairs = np.repeat(readIdx, nHits).astype(np.int64) * n_contigs + hitContigs
+
+    # shared k-mers per (read, contig)
+    pairs, counts = np.unique(pairs, return_counts=True)
+    reads = pairs // n_contigs
+    hitContigs = pairs % n_contigs
+    hitFrac = counts / nkmers[reads].astype(float)
+
+    keep = hitFrac >= minHitFrac
+    reads, hitContigs, hitFrac = reads[keep], hitContigs[keep], hitFrac[keep]
+    order = np.lexsort((-hitFrac, reads))
+    return reads[order], hitContigs[order], hitFrac[order]
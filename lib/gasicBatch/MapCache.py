@@ -0,0 +1,96 @@
+"""Persistent cache of metagenome read mappings"""
+
+import os
+import numpy as np
+
+from Cache import FileCache, fileChecksum, paramsKey
+
+
+class MapCache(object):
+    """Cache of per-reference mapped-read vectors of metagenome read files.
+    Each entry holds the mapped-read flags of all reads in a read file
+    mapped to 1 reference. Entries are grouped by a sample profile (read
+    file checksum, mapper, mapper version & mapping params) and keyed by
+    the reference fasta checksum (which, with the mapper version,
+    determines the reference index). So only new or changed references
+    need mapping when a metagenome is processed again, and a rerun after
+    an interrupted run skips the mappings that were completed.
+    """
+
+    def __init__(self, cacheDir):
+        """
+        Args:
+        cacheDir -- cache directory (created if needed)
+        """
+        self.cacheDir = os.path.abspath(cacheDir)
+        self.caches = dict()
+
+
+    def _cache(self, profile):
+        """FileCache for a sample profile"""
+        if profile not in self.caches:
+            self.caches[profile] = FileCache(os.path.join(self.cacheDir, profile))
+        return self.caches[profile]
+
+
+    def profile(self, readFile, mapper, params):
+        """Sample profile key.
+
+        Args:
+        readFile -- read file that is mapped
+        mapper -- ReadMapper instance
+        params -- mapping params that affect the mapping results (not thread counts)
+        """
+        return paramsKey(fileChecksum(readFile), mapper.mapperName, mapper.get_version(), params)
+
+    def get(self, profile, name):
+        """Mapped-read flags for a reference; None if not in the cache"""
+        return self._cache(profile).load_npy(name.get_checksum())
+
+    def put(self, profile, name, mapped):
+        """Adding mapped-read flags (1d array) for a reference to the cache"""
+        mapped = np.asarray(mapped, dtype=np.uint8)
+        return self._cache(profile).save_npy(name.get_checksum(), mapped)
+
+
+    def missing(self, names, profile):
+        """Indices of references in names that are not in the cache.
+
+        Args:
+        names -- NameFile instance
+        profile -- sample profile key
+        """
+        cache = self._cache(profile)
+        return [i for i,name in enumerate(names.iter_names())
+                if not cache.exists(name.get_checksum(), '.npy')]
+
+    def add_rows(self, names, profile, rows, mapped):
+        """Adding mapped-read flags to the cache.
+
+        Args:
+        names -- NameFile instance
+        profile -- sample profile key
+        rows -- indices of references in names
+        mapped -- numpy array (len(rows), n_reads)
+        """
+        for k,i in enumerate(rows):
+            self.put(profile, names.get_name(i), mapped[k,:])
+
+    def extract(self, names, profile):
+        """Mapped-read flags for all references in names.
+
+        Args:
+        names -- NameFile instance
+        profile -- sample profile key
+
+        Return:
+        numpy array (n_refs, n_reads)
+        """
+        rows = []
+        for name in names.iter_names():
+            mapped = self.get(profile, name)
+            if mapped is None:
+                msg = 'Reference not in mapping cache: "{}"'
+                raise KeyError(msg.format(name.get_fastaFile()))
+            rows.append(mapped)
+        return np.array(rows, dtype=float)
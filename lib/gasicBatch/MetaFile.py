@@ -3,6 +3,7 @@ import os
 import re
 import gzip
 import zlib
+import random
 from StringIO import StringIO
 
 from Bio import SeqIO
@@ -10,6 +11,34 @@ import scipy
 import requests
 import pandas as pd
 
+from Dedup import dedupReads
+
+
+
+def reservoirSample(records, k, seed=0):
+    """Uniform random sample of k items from an iterable (single pass).
+
+    Args:
+    records -- iterable (eg., SeqIO records)
+    k -- sample size
+    seed -- random seed
+
+    Return:
+    (list of sampled items in iteration order, total number of items)
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    n = 0
+    for n,rec in enumerate(records, 1):
+        if n <= k:
+            reservoir.append((n, rec))
+        else:
+            i = rng.randint(0, n - 1)
+            if i < k:
+                reservoir[i] = (n, rec)
+    reservoir.sort(key=lambda x: x[0])
+    return [rec for i,rec in reservoir], n
+
 
 
 class MetaFile(object):
@@ -311,6 +340,70 @@ class MetaFile_MGRAST_row(object):
             return False
             
             
+    def subsample(self, maxReads, seed=0, rmFile=False):
+        """Subsampling the read file to at most maxReads reads in a single pass
+        (reservoir sampling). Sampled reads keep their order in the read file.
+
+        Args:
+        maxReads -- max number of reads
+        seed -- random seed
+        rmFile -- remove old version of file?
+
+        Attrib edit:
+        readFile name set to the subsampled read file (if subsampled)
+        sampleFraction set to fraction of reads kept (1.0 if not subsampled)
+
+        Return:
+        float -- fraction of reads kept
+        """
+        readFile = self.get_readFile()
+        fileFormat = self.get_readFileFormat()
+        sample, total = reservoirSample(SeqIO.parse(readFile, fileFormat), maxReads, seed=seed)
+
+        self.sampleFraction = 1.0
+        if total > maxReads:
+            basename,ext = os.path.splitext(readFile)
+            newFile = basename + '_sub' + ext
+            SeqIO.write(sample, newFile, fileFormat)
+            if rmFile:
+                os.remove(readFile)
+            self.set_readFile(newFile)
+            self.sampleFraction = maxReads / float(total)
+            msg = 'Subsampled {} of {} reads (fraction: {})\n'
+            sys.stderr.write(msg.format(maxReads, total, self.sampleFraction))
+        return self.sampleFraction
+
+
+    def dedup(self, onDisk=False, rmFile=False):
+        """Collapsing exact duplicate reads (see Dedup.dedupReads).
+        The read file must be in fasta format.
+
+        Args:
+        onDisk -- deduplicate via temporary bucket files instead of in memory
+        rmFile -- remove old version of file?
+
+        Attrib edit:
+        readFile name set to the unique reads file (*_dedup.fasta)
+        readWeights set to the multiplicity of each unique read
+
+        Return:
+        numpy array -- multiplicity of each unique read
+        """
+        readFile = self.get_readFile()
+        basename,ext = os.path.splitext(readFile)
+        newFile = basename + '_dedup.fasta'
+
+        weights = dedupReads(readFile, newFile, fileType=self.get_readFileFormat(), onDisk=onDisk)
+        msg = 'Read deduplication: {} reads -> {} unique reads\n'
+        sys.stderr.write(msg.format(weights.sum(), len(weights)))
+
+        if rmFile:
+            os.remove(readFile)
+        self.set_readFile(newFile)
+        self.readWeights = weights
+        return weights
+
+
     def to_fasta(self, rmFile=False):
         """Converting from fastq to fasta.
 
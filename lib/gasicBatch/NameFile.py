@@ -2,8 +2,11 @@
 
 import os
 import sys
+import copy
 from collections import defaultdict
 
+from Cache import fileChecksum
+
 class NameFile(object):
     """nameFile = 1 or 2 tab-delimited columns
     1st column = refFile (refernece sequence)
@@ -75,10 +78,49 @@ class NameFile(object):
 
     def get_names(self):
         return self.names
-        
+
     def len(self):
         return len(self.names)
 
+    def subset(self, indices):
+        """NameFile instance with a subset of the names.
+        Name instances are shared with this NameFile.
+
+        Args:
+        indices -- list of indices in names list
+        """
+        new = copy.copy(self)
+        new.names = [self.names[i] for i in indices]
+        return new
+
+
+    def write_combinedFasta(self, outFile):
+        """Writing all reference fasta files to one fasta file.
+        Each sequence header is prefixed with the reference row index
+        ('{rowIndex}__{seqID}') so that contig names are unique across references.
+
+        Args:
+        outFile -- output fasta file name
+
+        Return:
+        dict -- {contig_name : reference row index}
+        """
+        contigMap = dict()
+        with open(outFile, 'wb') as outFH:
+            for i,name in enumerate(self.iter_names()):
+                with open(name.get_fastaFile(), 'rb') as inFH:
+                    line = '\n'
+                    for line in inFH:
+                        if line.startswith('>'):
+                            seqID = line[1:].split()[0]
+                            contig = '{0}__{1}'.format(i, seqID)
+                            contigMap[contig] = i
+                            line = '>' + contig + '\n'
+                        outFH.write(line)
+                    if not line.endswith('\n'):
+                        outFH.write('\n')
+        return contigMap
+
 
 
 class Name(object):
@@ -107,6 +149,12 @@ class Name(object):
     def get_indexFile(self):
         return self.indexFile        
 
+    def get_checksum(self):
+        """md5 checksum of fastaFile (calculated once)"""
+        if not hasattr(self, 'checksum'):
+            self.checksum = fileChecksum(self.fastaFile)
+        return self.checksum
+
     def get_simReadsFile(self):
         return self.simReadsFile
 
@@ -120,6 +168,9 @@ class Name(object):
         return self.refSamFile
 
     # setters
+    def set_indexFile(self, indexFile):
+        self.indexFile = indexFile
+
     def set_refSamFile(self, refSamFile):
         self.refSamFile = refSamFile
 
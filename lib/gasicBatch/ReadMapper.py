@@ -10,6 +10,17 @@ import numpy as np
 import uuid
 import multiprocessing as mp
 import parmap
+import pysam
+
+from IndexStore import IndexStore
+from KmerIndex import buildKmerIndex, writeKmerIndex, loadKmerIndex, classifyReads
+from Bio import SeqIO
+import subprocess
+import tempfile
+import time
+import resource
+import gzip
+from collections import deque
 
 
 def randomString(string_length=10):
@@ -18,28 +29,247 @@ def randomString(string_length=10):
     rs = rs.replace('-','')
     return rs[0:string_length]
 
+
+def callStats(cmd):
+    """Running a (bowtie2 -t) command and measuring its resource usage.
+    The command's STDERR is passed on to STDERR. IOError if the command fails.
+
+    Args:
+    cmd -- shell command
+
+    Return:
+    dict -- wall_sec: wall time; max_rss_mb: peak resident memory of the
+    process; index_load_sec: index loading time reported by bowtie2 -t
+    """
+    start = time.time()
+    with tempfile.TemporaryFile() as errFH:
+        p = subprocess.Popen(cmd, shell=True, stderr=errFH)
+        pid,status,rusage = os.wait4(p.pid, 0)
+        p.returncode = status
+        errFH.seek(0)
+        err = errFH.read()
+    sys.stderr.write(err)
+    if not (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0):
+        raise IOError('Command failed (wait status: {0}): "{1}"'.format(status, cmd))
+
+    loadSec = 0
+    for line in err.splitlines():
+        if line.startswith('Time loading') and 'index' in line:
+            h,m,sec = line.split(':')[-3:]
+            loadSec += int(h) * 3600 + int(m) * 60 + float(sec)
+    return dict(wall_sec=time.time() - start,
+                max_rss_mb=rusage.ru_maxrss / 1024.0,
+                index_load_sec=loadSec)
+
+
+def reportStats(stats, stage):
+    """Writing a summary of mapper call stats (see callStats) to STDERR"""
+    if len(stats) == 0:
+        return
+    load = [x['index_load_sec'] for x in stats]
+    rss = [x['max_rss_mb'] for x in stats]
+    msg = ('Mapper stats ({}): {} calls; index load time: total={:.1f}s, mean={:.2f}s; '
+           'max RSS per process: mean={:.1f}MB, max={:.1f}MB\n')
+    sys.stderr.write(msg.format(stage, len(stats), sum(load), np.mean(load), np.mean(rss), max(rss)))
+
+
+def readChunks(readFile, chunkSize, outDir='.', fileType='fasta'):
+    """Splitting a read file into chunks of chunkSize reads. A generator, so
+    chunks are written as they are consumed (eg., while earlier chunks are mapped).
+
+    Args:
+    readFile -- read file name
+    chunkSize -- number of reads per chunk
+    outDir -- directory for the chunk files
+    fileType -- read file format (SeqIO)
+
+    Yield:
+    (chunk file name, number of reads in chunk)
+    """
+    chunk = []
+    for rec in SeqIO.parse(readFile, fileType):
+        chunk.append(rec)
+        if len(chunk) >= chunkSize:
+            yield _writeChunk(chunk, outDir, fileType)
+            chunk = []
+    if len(chunk) > 0:
+        yield _writeChunk(chunk, outDir, fileType)
+
+
+def _writeChunk(chunk, outDir, fileType):
+    chunkFile = os.path.join(outDir, 'chunk_' + randomString() + '.' + fileType)
+    with open(chunkFile, 'wb') as outFH:
+        SeqIO.write(chunk, outFH, fileType)
+    return chunkFile, len(chunk)
+
+
+def fanoutReads(readFile, outFHs, blockSize=2**20):
+    """Streaming a read file (gzip-compressed if '.gz') to several pipes, reading
+    the file once. Each block is written to every pipe before the next block is
+    read; writes block while a pipe is full, so the slowest consumer sets the
+    pace & memory is bounded by 1 block. The pipes are closed at the end.
+
+    Args:
+    readFile -- read file name
+    outFHs -- list of writable file handles (eg., mapper process STDIN pipes)
+    blockSize -- number of bytes read at a time
+
+    Return:
+    int -- number of bytes streamed
+    """
+    if readFile.endswith('.gz'):
+        inFH = gzip.open(readFile, 'rb')
+    else:
+        inFH = open(readFile, 'rb')
+    openFHs = list(outFHs)
+    nBytes = 0
+    try:
+        for block in iter(lambda: inFH.read(blockSize), ''):
+            for fh in list(openFHs):
+                try:
+                    fh.write(block)
+                except IOError:   # consumer exited (see its exit status)
+                    openFHs.remove(fh)
+            nBytes += len(block)
+            if len(openFHs) == 0:
+                break
+    finally:
+        inFH.close()
+        for fh in outFHs:
+            try:
+                fh.close()
+            except IOError:
+                pass
+    return nBytes
+
+
+def _mapChunk(chunk, mapper, indexFiles, params):
+    """Mapping 1 read chunk to all indexes; the chunk file is removed.
+
+    Args:
+    chunk -- (chunk file name, number of reads in chunk)
+    mapper -- ReadMapper instance
+    indexFiles -- list of index files
+    params -- mapper params
+
+    Return:
+    numpy array (n_refs, number of reads in chunk) of mapped-read flags
+    """
+    chunkFile, num_reads = chunk
+    mapped = np.zeros((len(indexFiles), num_reads))
+    for j,indexFile in enumerate(indexFiles):
+        samFile = mapper(indexFile, chunkFile, outFile=chunkFile + '_{}.sam'.format(j), params=params)
+        samfh = pysam.Samfile(samFile, 'r')
+        mapped[j,:] = np.array( [int(not read.is_unmapped) for read in samfh] )
+        samfh.close()
+        os.remove(samFile)
+    os.remove(chunkFile)
+    return mapped
+
+
+def writeJointReads(readFiles, outFile, fileType='fasta'):
+    """Concatenating the reads of several samples into 1 fasta file.
+    Read names are prefixed with the sample index ('{sample index}|{read name}').
+
+    Args:
+    readFiles -- list of read files (1 per sample)
+    outFile -- output fasta file name
+    fileType -- read file format (SeqIO)
+
+    Return:
+    list -- number of reads of each sample
+    """
+    counts = []
+    with open(outFile, 'wb') as outFH:
+        for s,readFile in enumerate(readFiles):
+            n = 0
+            for rec in SeqIO.parse(readFile, fileType):
+                outFH.write('>{0}|{1}\n{2}\n'.format(s, rec.id, str(rec.seq)))
+                n += 1
+            counts.append(n)
+    return counts
+
+
+def samToSampleFlags(samFile, offsets):
+    """Parsing a SAM file of jointly mapped, sample-tagged reads (see
+    writeJointReads) into mapped-read flags. Reads are demultiplexed by the
+    sample prefix of the read name.
+
+    Args:
+    samFile -- SAM file name
+    offsets -- column offset of each sample's reads (cumulative read counts)
+
+    Return:
+    numpy array (total reads); reads of sample s in [offsets[s]:offsets[s+1]]
+    """
+    mapped = np.zeros(offsets[-1])
+    seen = np.zeros(len(offsets) - 1, dtype=int)
+    samfh = pysam.Samfile(samFile, 'r')
+    for read in samfh:
+        if read.is_secondary:
+            continue
+        s = int(read.qname.split('|', 1)[0])
+        mapped[offsets[s] + seen[s]] = int(not read.is_unmapped)
+        seen[s] += 1
+    samfh.close()
+    return mapped
+
+
+def samToMappedRow(samFile, contigMap, n_refs, num_reads):
+    """Parsing a SAM file of reads mapped against a combined multi-reference
+    index into mapped-read flags for each reference.
+    Secondary alignments (multi-hit reporting) are assigned to the same read
+    as the preceding primary alignment.
+
+    Args:
+    samFile -- SAM file name
+    contigMap -- dict {contig_name : reference index}
+    n_refs -- number of references in the combined index
+    num_reads -- number of reads in the read file that was mapped
+
+    Return:
+    numpy array (n_refs, num_reads); [j,k] = 1 if read k mapped to reference j
+    """
+    mapped = np.zeros((n_refs, num_reads))
+    samfh = pysam.Samfile(samFile, 'r')
+    readIdx = -1
+    for read in samfh:
+        if not read.is_secondary:
+            readIdx += 1
+        if read.is_unmapped or readIdx >= num_reads:
+            continue
+        mapped[contigMap[samfh.getrname(read.tid)], readIdx] = 1
+    samfh.close()
+    return mapped
+
     
 
 class ReadMapper(object):
     """General factory class for setting read mapper object"""
+    # mapper can read the query reads from STDIN (see streamCmd & parallel_fanout)
+    streamReads = False
+
     @staticmethod
-    def getMapper(mapper=None):
+    def getMapper(mapper=None, **kwargs):
         """factory designating subclass to use for mapping
 
         Args:
         mapper -- designates mapper subclass
+        kwargs -- passed to the mapper subclass
 
         Supported mappers:
         bowtie2
+        minimap2
+        kmer
         """
 
         # available mapper subclasses
-        mappers = dict(bowtie2=MapperBowtie2)
+        mappers = dict(bowtie2=MapperBowtie2, minimap2=MapperMinimap2, kmer=MapperKmer)
         # designate mapper class
         if mapper in mappers:
-            return mappers[mapper]()
+            return mappers[mapper](**kwargs)
         else:
-            raise TypeError('mapper: "{0}" is not yet supported')
+            raise TypeError('mapper: "{0}" is not yet supported'.format(mapper))
 
 
     def exeExists(self, exe):
@@ -52,55 +282,32 @@ class ReadMapper(object):
         else:
             raise IOError('"{0}" is not in your $PATH'.format(exe))
 
-            
 
-class MapperBowtie2(ReadMapper):
-    """Class for mapping with bowtie2"""
-    
-    def __init__(self, executable=['bowtie2-build', 'bowtie2']):
-        """Checks that executables exists and sets exe attribute
+    def get_indexFile(self, name):
+        """Mapper index of a reference.
+
         Args:
-        executable -- list of executables that need to be used for bowtie2 mapping (indexer and mapper)
+        name -- Name instance (NameFile)
         """
-        # checking for bowtie2 in path
-        [self.exeExists(x) for x in executable]
-        # attr
-        self.exe = executable
-                
+        return name.get_indexFile()
 
-    def __call__(self, indexFile, readFile, outFile=None, tmpFile=False,
-                    params={'-f': ''}):
-        """Calling bowtie2 for mapping
+
+    def multiHitParams(self, params, k, n_refs):
+        """Adding multi-hit reporting to mapper params (see pairwise_combined).
 
         Args:
-        indexFile -- bowtie2 index file
-        readFile -- read file provided to bowtie2 (query)
-        outFile -- sam output file. If None: using indexFile basename.
-        tmpFile -- use a temporary file name (superscedes outFile).
-        subproc -- subprocess? (depreciated?)
-        samFile -- output SAM file name. Default to edited indexFile name.
-        params -- bowtie2 parameters. Value = '' if boolean parameter
-        """
-        # outFile name
-        if outFile is None:
-            (basename, ext) = os.path.splitext(indexFile)
-            outFile = basename + '.sam'
-        if tmpFile is True:
-            outFile = randomString() + '.sam'
+        params -- mapper params
+        k -- max number of alignments reported per read. None or 0: all alignments
+             (a smaller k can spend all alignments on repeat hits within 1 reference
+             & drop hits to other references)
+        n_refs -- number of references in the index
 
-        # setting params if any exist
-        params = ' '.join( ['{0} {1}'.format(k,v) for k,v in params.items()] )
-        
-        # calling bowtie2
-        cmd = 'bowtie2 -U {reads} -x {index} -S {sam} --local {params}'
-        cmd = cmd.format(reads=readFile, index=indexFile, sam=samFile, params=params)
-        sys.stderr.write( 'Executing: "{0}"\n'.format(cmd) )
-        os.system(cmd)
+        Return:
+        new params dict
+        """
+        raise NotImplementedError
 
-        # return
-        return outFile        
 
-        
     def parallel(self, names, mg, nprocs=1, **kwargs):
         """Calling mapper using multiple processors.
 
@@ -114,7 +321,7 @@ class MapperBowtie2(ReadMapper):
         refSamFile attrib set for each name in names 
         """
         # making list of tuples (indexFile, readFile)
-        lt = [(name.get_indexFile(), mg.get_readFile()) for name in names.iter_names()]
+        lt = [(self.get_indexFile(name), mg.get_readFile()) for name in names.iter_names()]
 
         # altering function kwargs
         new_mapper = partial(self, **kwargs)
@@ -127,8 +334,114 @@ class MapperBowtie2(ReadMapper):
             name.set_refSamFile(samFiles[i])
 
 
+    def streamCmd(self, indexFile, outFile, params):
+        """Mapper command (argv) reading the query reads from STDIN.
+
+        Args:
+        indexFile -- mapper index file
+        outFile -- sam output file
+        params -- mapper params
+        """
+        raise NotImplementedError
+
+
+    def streamDone(self, samFile):
+        """Post-processing the SAM file of a streamCmd mapper call (default: none)"""
+        pass
+
+
+    def parallel_fanout(self, names, readFile, nprocs=1, blockSize=2**20, params={'-f': ''}):
+        """Mapping a read file to all references with nprocs concurrent mapper
+        processes that are fed from 1 read of the file (see fanoutReads), instead
+        of each mapper call reading the file on its own. References are mapped in
+        groups of nprocs, so each group costs 1 read of the file.
+
+        Args:
+        names -- NameFile instance with iter_names() method
+        readFile -- read file (gzip-compressed if '.gz')
+        nprocs -- number of concurrent mapper processes
+        blockSize -- number of bytes streamed at a time
+        params -- mapper parameters. Value = '' if boolean parameter
+
+        Return:
+        refSamFile attrib set for each name in names
+        """
+        nameList = list(names.iter_names())
+        for g in range(0, len(nameList), nprocs):
+            group = nameList[g:g+nprocs]
+            samFiles = [randomString() + '.sam' for name in group]
+
+            # mapper processes reading from STDIN (close_fds: each process
+            # must hold only its own pipe, or no process sees end of input)
+            procs = []
+            for name,samFile in zip(group, samFiles):
+                cmd = self.streamCmd(self.get_indexFile(name), samFile, params)
+                sys.stderr.write( 'Executing: "{0}"\n'.format(' '.join(cmd)) )
+                procs.append(subprocess.Popen(cmd, stdin=subprocess.PIPE, close_fds=True))
+
+            nBytes = fanoutReads(readFile, [p.stdin for p in procs], blockSize=blockSize)
+            msg = 'Streamed {} bytes of "{}" to {} mapper processes\n'
+            sys.stderr.write(msg.format(nBytes, readFile, len(procs)))
+
+            for name,samFile,p in zip(group, samFiles, procs):
+                if p.wait() != 0:
+                    msg = 'Mapper failed for "{0}" (exit status: {1})'
+                    raise IOError(msg.format(name.get_fastaFile(), p.returncode))
+                self.streamDone(samFile)
+                name.set_refSamFile(samFile)
+
+
+    def parallel_chunked(self, names, readFile, chunkSize, nprocs=1, outDir='.',
+                         fileType='fasta', params={'-f': ''}):
+        """Mapping a (large) read file to all references in chunks of reads.
+        Chunks are written while earlier chunks are mapped (nprocs chunks at a
+        time), and the mapped-read flags of the chunks are merged in read order.
+        The next chunk is written only when a mapped chunk is done, so at most
+        about nprocs chunk files exist at a time (temp disk use: ~nprocs x chunkSize reads).
+
+        Args:
+        names -- NameFile instance with iter_names() method
+        readFile -- read file
+        chunkSize -- number of reads per chunk
+        nprocs -- number of chunks mapped in parallel
+        outDir -- directory for chunk files
+        fileType -- read file format (SeqIO)
+        params -- bowtie2 parameters. Value = '' if boolean parameter
+
+        Return:
+        numpy array (n_refs, n_reads); [j,k] = 1 if read k mapped to reference j
+        """
+        indexFiles = [self.get_indexFile(name) for name in names.iter_names()]
+
+        # SAM output in read order (multi-threaded bowtie2)
+        params = dict(params)
+        params['--reorder'] = ''
+
+        worker = partial(_mapChunk, mapper=self, indexFiles=indexFiles, params=params)
+        pool = mp.Pool(nprocs)
+        try:
+            mapped = []
+            pending = deque()    # chunks being mapped (in read order)
+            for chunk in readChunks(readFile, chunkSize, outDir=outDir, fileType=fileType):
+                pending.append(pool.apply_async(worker, (chunk,)))
+                if len(pending) >= nprocs:
+                    mapped.append(pending.popleft().get())
+            while len(pending) > 0:
+                mapped.append(pending.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+
+        if len(mapped) == 0:
+            return np.zeros((len(indexFiles), 0))
+        return np.concatenate(mapped, axis=1)
+
+
     def pairwise(self, pairwiseList, nprocs=1, **kwargs):
         """Pairwise read mapping based on list of references and reads to map.
+        Mapper calls using the same index are run back to back (and, across
+        processes, at the same time), so a shared (memory-mapped) index is
+        loaded once for all of them.
 
         Args:
         pairwiseList -- list of tuples (i,j,refIndex,readFile)
@@ -139,11 +452,17 @@ class MapperBowtie2(ReadMapper):
         # adding kwargs to function
         new_mapper = partial(self, **kwargs)
 
+        # grouping calls by subject index
+        pairwiseList = sorted(pairwiseList, key=lambda x: (x[2], x[0]))
+
         # making trimmed list of tuples
         trimmed = [(i[2],i[3],) for i in pairwiseList]
 
         # calling mapper
         samFiles = parmap.starmap(new_mapper, trimmed, processes=nprocs)
+        if kwargs.get('stats'):
+            samFiles,stats = zip(*samFiles) if len(samFiles) > 0 else ([], [])
+            reportStats(stats, 'pairwise mapping')
 
         # creating a numpy array for output
         #simSamFiles = np.array([['' for i in range(n_refs)] for j in range(n_refs)], dtype=object)
@@ -155,38 +474,673 @@ class MapperBowtie2(ReadMapper):
 
         # return
         return pairwiseList2        
+
+
+    def pairwise_rows(self, names, rows, skipPairs=None, nprocs=1, **kwargs):
+        """Pairwise mapping of the simulated reads of each reference in rows
+        to all references (rows of the similarity tensor).
+
+        Args:
+        names -- NameFile instance (simReadsFile & simReadsCount set for each row)
+        rows -- indices of query references in names
+        skipPairs -- boolean array (n_refs, n_refs); pairs not mapped (no reads mapped)
+        nprocs -- max number of parallel mapper calls
+        kwargs -- passsed to mapper method
+
+        Return:
+        list of numpy arrays (n_refs, n_simReads) of mapped-read flags (1 per row)
+        """
+        n_refs = names.len()
+
+        # making list of tuples for all pairwise comparisons
+        pairwiseComps = []
+        for i in rows:
+            simReadsFile = names.get_name(i).get_simReadsFile()
+            for j in range(n_refs):
+                if skipPairs is not None and skipPairs[i,j]:
+                    continue
+                indexFile = self.get_indexFile(names.get_name(j))
+                pairwiseComps.append((i,j,indexFile,simReadsFile,))
+
+        # pairwise mapping
+        kwargs['tmpFile'] = True
+        kwargs.setdefault('stats', True)
+        pairwiseComps = self.pairwise(pairwiseComps, nprocs=nprocs, **kwargs)
+
+        # parse SAM files to create numpy arrays of reads mapped
+        mappedRows = dict((i, np.zeros((n_refs, names.get_name(i).get_simReadsCount())))
+                          for i in rows)
+        for (i,j,indexFile,simReadsFile,samFile) in pairwiseComps:
+            samfh = pysam.Samfile(samFile, "r")
+            mappedRows[i][j,:] = np.array( [int(not read.is_unmapped) for read in samfh] )
+            samfh.close()
+            os.remove(samFile)
+
+        return [mappedRows[i] for i in rows]
+
+
+    def map_joint(self, names, readFiles, outDir='.', nprocs=1, indexFile=None, contigMap=None,
+                  params={'-f': ''}):
+        """Mapping the reads of several (small) samples in 1 mapper run per
+        reference (or 1 run against a combined index), instead of 1 run per
+        sample & reference. Reads are tagged with the sample index, mapped
+        jointly and demultiplexed into per-sample mapped-read flags.
+
+        Args:
+        names -- NameFile instance
+        readFiles -- list of read files (fasta; 1 per sample)
+        outDir -- directory for the joint read file
+        nprocs -- max number of parallel mapper calls
+        indexFile -- combined index (see make_combinedIndex). If None: 1 run per reference index.
+        contigMap -- dict {contig_name : reference index} of the combined index
+        params -- mapper parameters. Value = '' if boolean parameter
+
+        Return:
+        list of numpy arrays (n_refs, n_reads of sample); 1 per sample. n_refs = all
+        references in the combined index if indexFile is provided.
+        """
+        jointFile = os.path.join(outDir, 'joint_' + randomString() + '.fasta')
+        counts = writeJointReads(readFiles, jointFile)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(int)
+
+        if indexFile is not None:
+            mapped = self.map_combined(indexFile, contigMap, jointFile, offsets[-1], params=params)
+        else:
+            lt = [(self.get_indexFile(name), jointFile) for name in names.iter_names()]
+            new_mapper = partial(self, tmpFile=True, params=params)
+            samFiles = parmap.starmap(new_mapper, lt, processes=nprocs)
+            mapped = np.zeros((len(lt), offsets[-1]))
+            for j,samFile in enumerate(samFiles):
+                mapped[j,:] = samToSampleFlags(samFile, offsets)
+                os.remove(samFile)
+        os.remove(jointFile)
+
+        msg = 'Joint mapping: {} samples, {} reads\n'
+        sys.stderr.write(msg.format(len(readFiles), offsets[-1]))
+        return [mapped[:,offsets[s]:offsets[s+1]] for s in range(len(readFiles))]
+
+
+    def make_combinedIndex(self, names, outDir='.'):
+        """Making one index for all reference sequences in names.
+
+        Args:
+        names -- NameFile instance
+        outDir -- directory for the combined fasta & index files
+
+        Return:
+        (indexFile, contigMap) -- combined index name & {contig_name : reference index}
+        """
+        fastaFile = os.path.join(outDir, 'combined_' + randomString() + '.fna')
+        contigMap = names.write_combinedFasta(fastaFile)
+        indexFile = self.make_index(fastaFile, outFile=os.path.splitext(fastaFile)[0])
+        return indexFile, contigMap
+
+
+    def pairwise_combined(self, names, indexFile, contigMap, nprocs=1,
+                          k=None, params={'-f': ''}):
+        """Pairwise read mapping against a combined multi-reference index.
+        The simulated reads of each reference are mapped once with multi-hit
+        reporting (bowtie2 -k); hits are assigned to subjects via contigMap.
+        This fills a whole row of the similarity tensor per mapper call.
+
+        Args:
+        names -- NameFile instance (simReadsFile & simReadsCount set for each name).
+                 Can be a subset of the references in the combined index.
+        indexFile -- combined index (see make_combinedIndex)
+        contigMap -- dict {contig_name : reference index}
+        nprocs -- max number of parallel mapper calls
+        k -- max number of alignments reported per read. Default: all alignments (bowtie2 -a),
+             so the mapped-read flags match mapping to each reference separately.
+        params -- bowtie2 parameters. Value = '' if boolean parameter
+
+        Return:
+        list of numpy arrays (n_refs, n_simReads) of mapped-read flags (1 per name)
+        """
+        n_refs = max(contigMap.values()) + 1
+
+        # multi-hit reporting
+        params = self.multiHitParams(params, k, n_refs)
+
+        # mapping simulated reads of each reference
+        lt = [(indexFile, name.get_simReadsFile()) for name in names.iter_names()]
+        new_mapper = partial(self, tmpFile=True, params=params)
+        samFiles = parmap.starmap(new_mapper, lt, processes=nprocs)
+
+        # parsing SAM files into rows of the tensor
+        lt = [(samFile, contigMap, n_refs, name.get_simReadsCount())
+              for samFile,name in zip(samFiles, names.iter_names())]
+        rows = parmap.starmap(samToMappedRow, lt, processes=nprocs)
+        for samFile in samFiles:
+            os.remove(samFile)
+
+        return rows
+
+
+    def map_combined(self, indexFile, contigMap, readFile, num_reads, k=None,
+                     params={'-f': ''}):
+        """Mapping (metagenome) reads once against a combined multi-reference index
+        with multi-hit reporting (see pairwise_combined). Replaces 1 mapper call
+        (and 1 pass over the read file) per reference.
+
+        Args:
+        indexFile -- combined index (see make_combinedIndex)
+        contigMap -- dict {contig_name : reference index}
+        readFile -- read file
+        num_reads -- number of reads in readFile
+        k -- max number of alignments reported per read (see pairwise_combined)
+        params -- bowtie2 parameters. Value = '' if boolean parameter
+
+        Return:
+        numpy array (n_refs, num_reads); [j,k] = 1 if read k mapped to reference j
+        """
+        n_refs = max(contigMap.values()) + 1
+
+        # multi-hit reporting
+        params = self.multiHitParams(params, k, n_refs)
+
+        samFile = self(indexFile, readFile, tmpFile=True, params=params)
+        mapped = samToMappedRow(samFile, contigMap, n_refs, num_reads)
+        os.remove(samFile)
+        return mapped
+
         
-            
-    def __call__(self, indexFile, readFile, outDir, samFile=None, params={'-f': ''}):
-        """For calling method via multiprocessing"""
-        return self.run_mapper(indexFile, readFile, outDir, samFile=samFile, params=params)
+    def pairwise_tagged(self, readFile, indexFile, contigMap, counts, k=None,
+                        params={'-f': ''}):
+        """Mapping simulated reads of all references (tagged with the source
+        reference index; see numpySim.simulate_tagged) against a combined
+        multi-reference index in one mapper call. Fills the whole similarity tensor.
+
+        Args:
+        readFile -- tagged read file ('{reference index}|{read index}' read names)
+        indexFile -- combined index (see make_combinedIndex)
+        contigMap -- dict {contig_name : reference index}
+        counts -- number of simulated reads for each reference
+        k -- max number of alignments reported per read (see pairwise_combined)
+        params -- bowtie2 parameters. Value = '' if boolean parameter
+
+        Return:
+        numpy array (n_refs, n_refs, max(counts)) of mapped-read flags
+        """
+        n_refs = max(contigMap.values()) + 1
+
+        # multi-hit reporting
+        params = self.multiHitParams(params, k, n_refs)
+
+        samFile = self(indexFile, readFile, tmpFile=True, params=params)
+
+        # demultiplexing hits by source reference
+        mapped = np.zeros((n_refs, n_refs, max(counts)))
+        samfh = pysam.Samfile(samFile, 'r')
+        for read in samfh:
+            if read.is_unmapped:
+                continue
+            i,readIdx = [int(x) for x in read.qname.split('|')]
+            mapped[i, contigMap[samfh.getrname(read.tid)], readIdx] = 1
+        samfh.close()
+        os.remove(samFile)
 
+        return mapped
+
+
+
+class MapperBowtie2(ReadMapper):
+    """Class for mapping with bowtie2"""
+    mapperName = 'bowtie2'
+    streamReads = True
+    
+    def __init__(self, executable=['bowtie2-build', 'bowtie2'], sharedIndex=False):
+        """Checks that executables exists and sets exe attribute
+        Args:
+        executable -- list of executables that need to be used for bowtie2 mapping (indexer and mapper)
+        sharedIndex -- memory-map the index (bowtie2 --mm), so concurrent mapper calls
+                       using the same index share 1 copy of it in RAM (page cache)
+        """
+        # checking for bowtie2 in path
+        [self.exeExists(x) for x in executable]
+        # attr
+        self.exe = executable
+        self.sharedIndex = sharedIndex
+                
+
+    def __call__(self, indexFile, readFile, outFile=None, tmpFile=False,
+                    params={'-f': ''}, stats=False):
+        """Calling bowtie2 for mapping
+
+        Args:
+        indexFile -- bowtie2 index file
+        readFile -- read file provided to bowtie2 (query)
+        outFile -- sam output file. If None: using indexFile basename.
+        tmpFile -- use a temporary file name (superscedes outFile).
+        params -- bowtie2 parameters. Value = '' if boolean parameter
+        stats -- also return resource usage of the call (see callStats)
+
+        Return:
+        sam file name; (sam file name, stats dict) if stats=True
+        """
+        # outFile name
+        if outFile is None:
+            (basename, ext) = os.path.splitext(indexFile)
+            outFile = basename + '.sam'
+        if tmpFile is True:
+            outFile = randomString() + '.sam'
+
+        # setting params if any exist
+        params = self._callParams(params, stats=stats)
+        params = ' '.join( ['{0} {1}'.format(k,v) for k,v in params.items()] )
         
-    def make_index(self,subjectFile, outFile=None, **kwargs):
+        # calling bowtie2
+        cmd = 'bowtie2 -U {reads} -x {index} -S {sam} --local {params}'
+        cmd = cmd.format(reads=readFile, index=indexFile, sam=outFile, params=params)
+        sys.stderr.write( 'Executing: "{0}"\n'.format(cmd) )
+        if stats:
+            return outFile, callStats(cmd)
+        os.system(cmd)
+
+        # return
+        return outFile        
+
+
+    def _callParams(self, params, stats=False):
+        """bowtie2 params of a mapper call"""
+        params = dict(params)
+        if int(params.get('-p', 1)) > 1:
+            params['--reorder'] = ''    # SAM records in read order (parsers rely on it)
+        if self.sharedIndex:
+            params['--mm'] = ''
+        if stats:
+            params['-t'] = ''
+        return params
+
+
+    def streamCmd(self, indexFile, outFile, params):
+        """bowtie2 command reading the reads from STDIN; see ReadMapper.streamCmd"""
+        cmd = ['bowtie2', '-U', '-', '-x', indexFile, '-S', outFile, '--local']
+        for k,v in self._callParams(params).items():
+            cmd.append(k)
+            if v != '':
+                cmd.append(str(v))
+        return cmd
+
+        
+    def make_index(self, subjectFile, outFile=None, **kwargs):
         """Making index file for subject fasta file
 
         Args:
         subjectFile -- subject sequence to call bowtie2 (sequence being mapped to)
-        outFile -- output file name
-        kwargs -- passed to bowtie2-build
+        outFile -- output index name. If None: subjectFile basename.
+        kwargs -- passed to bowtie2-build (eg., threads=4 -> '--threads 4').
+                  Value = '' if boolean parameter
+
+        Return:
+        index name
         """
         # outFile
         if outFile is None:
-            (basename, ext) = os.path.splitext(indexFile)
-            outFile = basename + '_' + randomString() + '.sam'            
+            (outFile, ext) = os.path.splitext(subjectFile)
 
         # setting params if any exist
-        params = ' '.join( ['-{0} {1}'.format(k,v) for k,v in kwargs.items()] )
+        params = []
+        for k,v in kwargs.items():
+            dash = '-' if len(k) == 1 else '--'
+            params.append('{0}{1} {2}'.format(dash, k, v))
+        params = ' '.join(params)
 
         # call command
-        cmd = 'bowtie2-build {subject} {outFile}'
-        cmd = cmd.format(subject=subjectFile, outFile=outFile)        
+        cmd = 'bowtie2-build {params} {subject} {outFile}'
+        cmd = cmd.format(params=params, subject=subjectFile, outFile=outFile)
         sys.stderr.write( 'Executing: "{0}"\n'.format(cmd) )
-        os.system(cmd)
+        if os.system(cmd) != 0:
+            raise IOError('bowtie2-build failed for "{0}"'.format(subjectFile))
         return outFile
-    
 
-        
+
+    def get_version(self):
+        """Index builder version (eg., for keying stored indexes)"""
+        out = subprocess.check_output(['bowtie2-build', '--version'])
+        line = out.splitlines()[0]
+        return line.split('version')[-1].strip()
+
+
+    def multiHitParams(self, params, k, n_refs):
+        """bowtie2 -k (-a if k is None or 0); see ReadMapper.multiHitParams"""
+        params = dict(params)
+        if k is None or k == 0:
+            params['-a'] = ''
+        else:
+            params['-k'] = k
+        return params
+
+
+
+
+class MapperMinimap2(ReadMapper):
+    """Class for mapping with minimap2 (eg., long, indel-rich 454 & Sanger reads)"""
+    mapperName = 'minimap2'
+    streamReads = True
+
+    # bowtie2 params used by callers -> minimap2 params (None = not used)
+    bowtie2Params = {'-p' : '-t', '-f' : None, '--reorder' : None, '--local' : None}
+
+    def __init__(self, executable=['minimap2'], preset=None, indexStore=None, threads=1):
+        """Checks that executables exists and sets exe attribute
+        Args:
+        executable -- list of executables needed for minimap2 mapping
+        preset -- minimap2 preset (-x; eg., 'sr'). If None: minimap2 default.
+        indexStore -- index store directory (see IndexStore). minimap2 indexes of the
+                      references are built once & kept in the store. If None: each
+                      mapper call indexes the reference fasta.
+        threads -- number of threads for index builds
+        """
+        [self.exeExists(x) for x in executable]
+        self.exe = executable
+        self.preset = preset
+        self.indexStore = indexStore
+        self.threads = threads
+
+
+    def get_indexFile(self, name):
+        """minimap2 index of a reference (built if not in the index store);
+        the reference fasta if no index store is used.
+
+        Args:
+        name -- Name instance (NameFile)
+        """
+        if self.indexStore is None:
+            return name.get_fastaFile()
+        return IndexStore(self.indexStore, self).build(name, threads=self.threads)
+
+
+    def _presetArgs(self):
+        if self.preset is None:
+            return []
+        return ['-x', self.preset]
+
+
+    def __call__(self, indexFile, readFile, outFile=None, tmpFile=False,
+                 params={}, stats=False):
+        """Calling minimap2 for mapping (SAM output). Supplementary alignments
+        are not written, so the SAM file has 1 record per read (plus secondary
+        alignments if requested; see multiHitParams).
+
+        Args:
+        indexFile -- minimap2 index or reference fasta
+        readFile -- read file (query)
+        outFile -- sam output file. If None: using indexFile basename.
+        tmpFile -- use a temporary file name (superscedes outFile).
+        params -- minimap2 parameters (bowtie2 params in bowtie2Params are converted).
+                  Value = '' if boolean parameter
+        stats -- also return resource usage of the call (see callStats)
+
+        Return:
+        sam file name; (sam file name, stats dict) if stats=True
+        """
+        # outFile name
+        if outFile is None:
+            (basename, ext) = os.path.splitext(indexFile)
+            outFile = basename + '.sam'
+        if tmpFile is True:
+            outFile = randomString() + '.sam'
+
+        # command
+        cmd = self._mapCmd(params) + [indexFile, readFile]
+        sys.stderr.write( 'Executing: "{0}"\n'.format(' '.join(cmd)) )
+
+        # calling minimap2; dropping supplementary alignments
+        start = time.time()
+        with tempfile.TemporaryFile() as errFH, open(outFile, 'wb') as outFH:
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errFH)
+            for line in p.stdout:
+                if not line.startswith('@') and int(line.split('\t', 2)[1]) & 2048:
+                    continue
+                outFH.write(line)
+            pid,status,rusage = os.wait4(p.pid, 0)
+            p.returncode = status
+            errFH.seek(0)
+            err = errFH.read()
+        sys.stderr.write(err)
+        if status != 0:
+            raise IOError('minimap2 failed for "{0}" (exit status: {1})'.format(readFile, status))
+
+        if stats:
+            loadSec = 0
+            for line in err.splitlines():
+                # eg., "[M::main::0.015*1.00] loaded/built the index for 1 target sequence(s)"
+                if 'loaded/built the index' in line:
+                    loadSec = float(line.split('::')[-1].split('*')[0])
+            return outFile, dict(wall_sec=time.time() - start,
+                                 max_rss_mb=rusage.ru_maxrss / 1024.0,
+                                 index_load_sec=loadSec)
+        return outFile
+
+
+    def _mapCmd(self, params):
+        """minimap2 mapping command (argv) without index & read file"""
+        cmd = [self.exe[0], '-a'] + self._presetArgs()
+        for k,v in params.items():
+            k = self.bowtie2Params.get(k, k)
+            if k is None:
+                continue
+            cmd.append(k)
+            if v != '':
+                cmd.append(str(v))
+        if '--secondary=yes' in cmd:
+            # multi-hit reporting: all secondary hits, however low their score relative
+            # to the primary hit (minimap2 -p; default 0.8 drops hits to other references)
+            cmd += ['-p', '0']
+        else:
+            cmd.append('--secondary=no')
+        return cmd
+
+
+    def streamCmd(self, indexFile, outFile, params):
+        """minimap2 command reading the reads from STDIN; see ReadMapper.streamCmd"""
+        return self._mapCmd(params) + ['-o', outFile, indexFile, '-']
+
+
+    def streamDone(self, samFile):
+        """Dropping supplementary alignments (as in __call__)"""
+        tmpFile = samFile + '.tmp'
+        with open(samFile, 'rb') as inFH, open(tmpFile, 'wb') as outFH:
+            for line in inFH:
+                if not line.startswith('@') and int(line.split('\t', 2)[1]) & 2048:
+                    continue
+                outFH.write(line)
+        os.rename(tmpFile, samFile)
+
+
+    def make_index(self, subjectFile, outFile=None, **kwargs):
+        """Making minimap2 index file for subject fasta file
+
+        Args:
+        subjectFile -- subject sequence (sequence being mapped to)
+        outFile -- output index file name. If None: subjectFile basename + '.mmi'
+        kwargs -- passed to minimap2 (threads=4 -> '-t 4')
+
+        Return:
+        index file name
+        """
+        if outFile is None:
+            outFile = os.path.splitext(subjectFile)[0] + '.mmi'
+
+        cmd = [self.exe[0]] + self._presetArgs()
+        for k,v in kwargs.items():
+            if k == 'threads':
+                k = 't'
+            dash = '-' if len(k) == 1 else '--'
+            cmd += [dash + k, str(v)]
+        cmd += ['-d', outFile, subjectFile]
+        sys.stderr.write( 'Executing: "{0}"\n'.format(' '.join(cmd)) )
+        if subprocess.call(cmd) != 0:
+            raise IOError('minimap2 index build failed for "{0}"'.format(subjectFile))
+        return outFile
+
+
+    def get_version(self):
+        """minimap2 version & preset (indexes depend on both)"""
+        if not hasattr(self, 'version'):
+            out = subprocess.check_output([self.exe[0], '--version'])
+            self.version = 'minimap2 {0} {1}'.format(out.strip(), self.preset)
+        return self.version
+
+
+    def multiHitParams(self, params, k, n_refs):
+        """minimap2 secondary alignments (-N; -p 0, see _mapCmd); see ReadMapper.multiHitParams"""
+        params = dict(params)
+        if k is None or k == 0:
+            k = 1000000
+        params['--secondary=yes'] = ''
+        params['-N'] = k
+        return params
+
+
+class MapperKmer(ReadMapper):
+    """Alignment-free read classification by exact k-mer matching (in-process;
+    no 3rd party software). A read 'maps' to a reference if >= minHitFrac of
+    its k-mers are in the reference. Reads are classified in batches against
+    a memory-mapped k-mer index (see KmerIndex), and the hits are written as
+    SAM (1 record per read, plus secondary records for multi-hit reporting),
+    so all mapping methods of ReadMapper can be used.
+    """
+    mapperName = 'kmer'
+
+    def __init__(self, k=21, minHitFrac=0.2, indexStore=None, batchSize=10000):
+        """
+        Args:
+        k -- k-mer length (<= 31)
+        minHitFrac -- min fraction of the read k-mers found in a reference
+        indexStore -- index store directory (see IndexStore). k-mer indexes of the
+                      references are built once & kept in the store. If None: each
+                      mapper call builds the index of the reference fasta in memory.
+        batchSize -- number of reads classified at a time
+        """
+        if k > 31:
+            raise ValueError('k must be <= 31')
+        self.k = k
+        self.minHitFrac = minHitFrac
+        self.indexStore = indexStore
+        self.batchSize = batchSize
+
+
+    def get_indexFile(self, name):
+        """k-mer index of a reference (built if not in the index store);
+        the reference fasta if no index store is used.
+
+        Args:
+        name -- Name instance (NameFile)
+        """
+        if self.indexStore is None:
+            return name.get_fastaFile()
+        return IndexStore(self.indexStore, self).build(name)
+
+
+    def _loadIndex(self, indexFile):
+        """k-mer index (memory-mapped) or index of a fasta file (built in memory)"""
+        if os.path.isfile(indexFile + '.kmers.npy'):
+            return loadKmerIndex(indexFile, self.k)
+        return buildKmerIndex(indexFile, k=self.k)
+
+
+    def __call__(self, indexFile, readFile, outFile=None, tmpFile=False,
+                 params={'-f': ''}, stats=False):
+        """Classifying reads & writing the hits as SAM.
+
+        Args:
+        indexFile -- k-mer index (see make_index) or reference fasta
+        readFile -- read file (query)
+        outFile -- sam output file. If None: using indexFile basename.
+        tmpFile -- use a temporary file name (superscedes outFile).
+        params -- bowtie2-style params: '-f' = fasta reads (else: fastq);
+                  '-k'/'-a' = report secondary hits (see multiHitParams). Others are ignored.
+        stats -- also return resource usage of the call (see callStats)
+
+        Return:
+        sam file name; (sam file name, stats dict) if stats=True
+        """
+        # outFile name
+        if outFile is None:
+            (basename, ext) = os.path.splitext(indexFile)
+            outFile = basename + '.sam'
+        if tmpFile is True:
+            outFile = randomString() + '.sam'
+        fileType = 'fasta' if '-f' in params else 'fastq'
+        multiHit = '-k' in params or '-a' in params
+        sys.stderr.write( 'Classifying k-mers: "{0}" -> "{1}"\n'.format(readFile, indexFile) )
+
+        start = time.time()
+        kmers, contigs, names, lengths = self._loadIndex(indexFile)
+        loadSec = time.time() - start
+
+        with open(outFile, 'wb') as outFH:
+            outFH.write('@HD\tVN:1.0\n')
+            for name,length in zip(names, lengths):
+                outFH.write('@SQ\tSN:{0}\tLN:{1}\n'.format(name, length))
+
+            batch = []
+            for rec in SeqIO.parse(readFile, fileType):
+                batch.append((rec.id, str(rec.seq)))
+                if len(batch) >= self.batchSize:
+                    self._writeBatch(outFH, batch, kmers, contigs, names, multiHit)
+                    batch = []
+            if len(batch) > 0:
+                self._writeBatch(outFH, batch, kmers, contigs, names, multiHit)
+
+        if stats:
+            return outFile, dict(wall_sec=time.time() - start,
+                                 max_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                                 index_load_sec=loadSec)
+        return outFile
+
+
+    def _writeBatch(self, outFH, batch, kmers, contigs, names, multiHit):
+        """Classifying a batch of (read name, sequence) & writing SAM records"""
+        reads, hitContigs, hitFrac = classifyReads(kmers, contigs, len(names), [x[1] for x in batch],
+                                                   self.k, minHitFrac=self.minHitFrac)
+        first = np.searchsorted(reads, np.arange(len(batch) + 1))
+        record = '{0}\t{1}\t{2}\t{3}\t{4}\t*\t*\t0\t0\t{5}\t*\n'
+        for r,(readName,seq) in enumerate(batch):
+            hits = range(first[r], first[r+1])
+            if len(hits) == 0:
+                outFH.write(record.format(readName, 4, '*', 0, 0, seq))
+                continue
+            if not multiHit:
+                hits = hits[:1]
+            for n,h in enumerate(hits):
+                flag = 0 if n == 0 else 256
+                mapq = int(round(60 * hitFrac[h])) if len(hits) == 1 else 0
+                outFH.write(record.format(readName, flag, names[hitContigs[h]], 1, mapq, seq))
+
+
+    def make_index(self, subjectFile, outFile=None, **kwargs):
+        """Making k-mer index for subject fasta file
+
+        Args:
+        subjectFile -- subject sequence (sequence being mapped to)
+        outFile -- output index name (file prefix). If None: subjectFile basename.
+        kwargs -- not used (for compatibility with other mappers; eg., threads)
+
+        Return:
+        index name
+        """
+        if outFile is None:
+            (outFile, ext) = os.path.splitext(subjectFile)
+        sys.stderr.write( 'Building k-mer index (k={0}): "{1}"\n'.format(self.k, subjectFile) )
+        kmers, contigs, names, lengths = buildKmerIndex(subjectFile, k=self.k)
+        writeKmerIndex(outFile, kmers, contigs, names, lengths, self.k)
+        return outFile
+
+
+    def get_version(self):
+        """k-mer index version (indexes depend on k)"""
+        return 'kmer k={0}'.format(self.k)
+
+
+    def multiHitParams(self, params, k, n_refs):
+        """Secondary hits (all hits >= minHitFrac are reported); see ReadMapper.multiHitParams"""
+        params = dict(params)
+        params['-a'] = ''
+        return params
+
+
 
 class PairwiseMapper_OLD(object):
     """Class for pairwise read mapping"""
@@ -2,13 +2,191 @@
 
 import sys
 import os
+import shutil
+import uuid
 
 from distutils.spawn import find_executable
 import multiprocessing as mp
 import parmap
 from functools import partial
+import numpy as np
 from Bio import SeqIO
 
+from Cache import FileCache, paramsKey
+
+
+def quantize(x, binSize):
+    """Rounding a value to the nearest multiple of binSize.
+
+    Args:
+    x -- value
+    binSize -- bin size. If 0: x is returned unchanged.
+
+    Return:
+    float
+    """
+    if binSize <= 0:
+        return x
+    return round(float(x) / binSize) * binSize
+
+
+
+def countReads(readFile, fileType='fasta'):
+    """Counting reads in a fasta/fastq file without parsing the records.
+    fastq files are assumed to have 4 lines per record.
+    """
+    with open(readFile, 'rb') as fh:
+        if fileType.lower() == 'fasta':
+            return sum(1 for line in fh if line.startswith('>'))
+        else:
+            return sum(1 for line in fh if line.strip()) // 4
+
+
+
+def _runSimulator(job, simulator):
+    """For calling a simulator via multiprocessing.
+    job = (reference index, fasta file, simulator kwargs)"""
+    i, fastaFile, kwargs = job
+    return simulator(fastaFile, **kwargs)
+
+
+def shardFasta(fastaFile, shardSize, prefix, overlap=0):
+    """Splitting a fasta file into shards of <= shardSize bp.
+    Contigs > shardSize are split into regions (overlapping by 'overlap' bp,
+    so reads spanning region borders can be simulated); smaller contigs are
+    grouped into shards.
+
+    Args:
+    fastaFile -- fasta file name
+    shardSize -- max shard size (bp)
+    prefix -- output file prefix ('{prefix}_shard{k}.fna')
+    overlap -- overlap of regions split from the same contig
+
+    Return:
+    list of (shard fasta file, shard length)
+    """
+    # regions: (seqID, sequence array)
+    regions = []
+    overlap = min(overlap, shardSize // 2)
+    step = shardSize - overlap
+    for seqID,seq in loadFasta(fastaFile):
+        if len(seq) <= shardSize:
+            regions.append((seqID, seq))
+        else:
+            for start in range(0, len(seq) - overlap, step):
+                regions.append(('{}:{}'.format(seqID, start), seq[start:start+shardSize]))
+
+    # grouping regions into shards
+    shards = []
+    group = []
+    groupSize = 0
+    for region in regions:
+        if len(group) > 0 and groupSize + len(region[1]) > shardSize:
+            shards.append(group)
+            group = []
+            groupSize = 0
+        group.append(region)
+        groupSize += len(region[1])
+    if len(group) > 0:
+        shards.append(group)
+
+    # writing shards
+    shardFiles = []
+    for k,group in enumerate(shards):
+        shardFile = '{}_shard{}.fna'.format(prefix, k)
+        with open(shardFile, 'wb') as outFH:
+            for seqID,seq in group:
+                outFH.write('>{}\n{}\n'.format(seqID, seq.tostring()))
+        shardFiles.append((shardFile, sum(len(x[1]) for x in group)))
+    return shardFiles
+
+
+
+class MasterReadSet(object):
+    """Set of long simulated reads (same length) stored as numpy arrays.
+    Read sets with shorter reads are derived by trimming the reads, so
+    the per-position error profile of the simulator is kept.
+    """
+
+    def __init__(self, prefix):
+        """Loading (memory-mapped) a master read set written by from_file().
+
+        Args:
+        prefix -- file name prefix of the master read set
+        """
+        self.prefix = prefix
+        self.ids = np.load(prefix + '.ids.npy')
+        self.seqs = np.load(prefix + '.seqs.npy', mmap_mode='r')
+        self.quals = np.load(prefix + '.quals.npy', mmap_mode='r')
+
+    @classmethod
+    def from_file(cls, readFile, prefix, fileType='fastq'):
+        """Creating a master read set from a simulated read file.
+
+        Args:
+        readFile -- simulated read file (all reads with the same length)
+        prefix -- file name prefix for the master read set
+        fileType -- read file format
+
+        Return:
+        MasterReadSet instance
+        """
+        ids = []
+        seqs = []
+        quals = []
+        for rec in SeqIO.parse(readFile, fileType):
+            ids.append(rec.id)
+            seqs.append(str(rec.seq))
+            quals.append(rec.letter_annotations.get('phred_quality', []))
+
+        if len(set(len(x) for x in seqs)) > 1:
+            raise ValueError('Master read set reads must all be the same length: {}'.format(readFile))
+        seqs = np.array([np.frombuffer(x, dtype=np.uint8) for x in seqs], dtype=np.uint8)
+        quals = np.array(quals, dtype=np.uint8)
+
+        # written to tmp files & renamed (quals last; see exists)
+        tmpPrefix = prefix + '.tmp' + uuid.uuid4().hex[:10]
+        np.save(tmpPrefix + '.ids.npy', np.array(ids))
+        np.save(tmpPrefix + '.seqs.npy', seqs)
+        np.save(tmpPrefix + '.quals.npy', quals)
+        for ext in ['.ids.npy', '.seqs.npy', '.quals.npy']:
+            os.rename(tmpPrefix + ext, prefix + ext)
+        return cls(prefix)
+
+    @staticmethod
+    def exists(prefix):
+        """Is a complete master read set stored under prefix?"""
+        return os.path.isfile(prefix + '.quals.npy')
+
+    def len(self):
+        return len(self.ids)
+
+    def get_readLength(self):
+        return self.seqs.shape[1]
+
+    def trim(self, readLength, outFile):
+        """Writing a fasta file of the reads trimmed to readLength.
+
+        Args:
+        readLength -- read length (<= master read length)
+        outFile -- output fasta file name
+
+        Return:
+        number of reads written
+        """
+        if readLength > self.get_readLength():
+            msg = 'Read length ({}) > master read length ({})'
+            raise ValueError(msg.format(readLength, self.get_readLength()))
+
+        # trimmed reads as 1 string per read
+        seqs = np.ascontiguousarray(self.seqs[:,:readLength])
+        seqs = seqs.view('S{}'.format(readLength)).ravel()
+
+        with open(outFile, 'wb') as outFH:
+            for readID,seq in zip(self.ids, seqs):
+                outFH.write('>{}\n{}\n'.format(readID, seq))
+        return self.len()
+
 
 class ReadSimulator(object):
     """Factory class for read simulator"""
@@ -21,9 +199,10 @@ class ReadSimulator(object):
 
         Supported simulators:
         mason
+        numpy (in-process simulator; see numpySim)
         """
         
-        simulators = dict(mason=mason) #, griner=grinder)
+        simulators = dict(mason=mason, numpy=numpySim) #, griner=grinder)
 
         simulator = simulator.lower()
         if simulator in simulators:
@@ -42,40 +221,20 @@ class ReadSimulator(object):
             raise IOError('"{0}" is not in your $PATH'.format(exe))
 
 
-class grinder(ReadSimulator):
-    """Class for calling Grinder simulator"""
-
-    # TODO
-    
-    def run_simulator(refFile, outFile=None, params=''):
-        """Calling grinder simulator"""
-        print 'Not yet supported!'
-        pass
-
-
-class mason(ReadSimulator):
-    """Class for calling mason simulator"""
-
-    def __init__(self, executable='mason'):
-        """
-        Args:
-        executable -- name of executable
-        """
-        # in PATH?
-        self.exeExists(executable)
-        # attr
-        self.exe = executable
-
-
-    def get_paramsByReadStats(self, mg, params=dict()):
+    def get_paramsByReadStats(self, mg, params=dict(), lengthBin=0, errorBin=0):
         """Getting simulator params based on read stats (e.g. read lengths &
         sequencing platform.
         For illumina: read-length = median of actual read lengths
         For 454: read mean and error determined from actual read lengths
 
+        Read lengths & errors can be binned, so that metagenomes with similar
+        read stats get the same simulation profile (& can share simulated reads).
+
         Args:
         mg -- MetaFile row class
         params -- dict that sets initial params
+        lengthBin -- read length bin size (bp). 0 = no binning.
+        errorBin -- read length error (stdev) bin size (bp). 0 = no binning.
 
         Return:
         platform -- string
@@ -95,12 +254,222 @@ class mason(ReadSimulator):
         # stats
         if hasattr(mg, 'readStats'):
             if mg.platform == 'illumina':
-                params['--read-length'] =  int(mg.readStats['median'])
+                readLen = quantize(mg.readStats['median'], lengthBin)
+                params['--read-length'] = int(max(readLen, lengthBin))
             elif mg.platform == '454' or mg.platform == 'sanger':
-                params['--read-length-mean'] = mg.readStats['mean']
-                params['--read-length-error'] = mg.readStats['stdev']
+                readLen = quantize(mg.readStats['mean'], lengthBin)
+                params['--read-length-mean'] = max(readLen, lengthBin)
+                params['--read-length-error'] = quantize(mg.readStats['stdev'], errorBin)
         return platform, params
+
+
+    def parallel(self, names, fileType='fasta', nprocs=1, cacheDir=None, shardSize=None, **kwargs):
+        """Running simulator using apply_async
+
+        If cacheDir is provided, mason runs are seeded ('--seed'; default: 0) and
+        the simulated reads (after any format conversion) & read counts are
+        cached, keyed by simulator, reference checksum, platform, all params & the seed.
+        Cached read sets are used instead of calling mason.
+
+        References with fasta files > shardSize bytes are split into shards of
+        contigs or contig regions (see shardFasta). Each shard is simulated as a
+        separate job (reads in proportion to shard length; seed = seed * 10000 + shard),
+        and the shard reads are concatenated ('{reference}_{shard}_{read}' read names).
+
+        Args:
+        names -- NameFile class with iter_names() method
+        fileType -- sequence file format
+        nprocs -- max number of parallel simulation calls
+        cacheDir -- directory for caching simulated reads. None = no caching.
+        shardSize -- max shard size (bp) for splitting large references. None = no splitting.
+        kwargs -- passed to simulator
+
+        Attribs added to each name instance in names:
+        simReadsFile -- file name of simulated reads
+        simReadsFileType -- file type (eg., 'fasta' or 'fastq')
+        simReadsFileCount -- number of simulated reads
+
+        Return:
+        boolean on run success/fail
+        """
+        n_refs = names.len()
+
+        # cache keys
+        cache = None
+        if cacheDir is not None:
+            cache = FileCache(cacheDir)
+            params = dict(kwargs.get('params') or {})
+            params.setdefault('--seed', 0)
+            kwargs['params'] = params
+            platform = kwargs.get('platform', 'illumina')
+            keys = [paramsKey('simReads', self.__class__.__name__, name.get_checksum(), platform,
+                              params, fileType.lower(), shardSize)
+                    for name in names.iter_names()]
+        
+        # references without cached simulated reads
+        res = [None] * n_refs
+        todo = range(n_refs)
+        if cache is not None:
+            for i in range(n_refs):
+                if cache.exists(keys[i], '.count'):
+                    with open(cache.get_path(keys[i], '.count'), 'rb') as fh:
+                        count, simFileType = fh.read().split()
+                    res[i] = dict(simReadsFile=cache.get_path(keys[i], '.reads'),
+                                  simReadsFileType=simFileType,
+                                  simReadsCount=int(count))
+            todo = [i for i in range(n_refs) if res[i] is None]
+            msg = 'Simulated read cache: {} of {} references cached\n'
+            sys.stderr.write(msg.format(n_refs - len(todo), n_refs))
+
+        # simulation jobs: (reference index, fasta file, simulator kwargs)
+        jobs = []
+        for i in todo:
+            fastaFile = names.get_name(i).get_fastaFile()
+            if shardSize is not None and os.path.getsize(fastaFile) > shardSize:
+                jobs += self._shardJobs(i, fastaFile, shardSize, kwargs)
+            else:
+                jobs.append((i, fastaFile, kwargs))
+
+        # calling simulator
+        jobRes = parmap.map(_runSimulator, jobs, self, processes=nprocs)
+
+        # checking that simulated reads were created for all jobs; return 1 if no file
+        for row in jobRes:
+            if row['simReadsFile'] is None or not os.path.isfile(row['simReadsFile']):
+                return 1
+
+        # concatenating reads of sharded references
+        simRes = []
+        for i in todo:
+            shardRes = [row for job,row in zip(jobs, jobRes) if job[0] == i]
+            if len(shardRes) == 1:
+                simRes.append(shardRes[0])
+            else:
+                simRes.append(self._mergeShards(names.get_name(i).get_fastaFile(), shardRes,
+                                                kwargs.get('outDir')))
+
+        # checking that simulated reads were created for all references; return 1 if no file
+        for row in simRes:
+            if row['simReadsFile'] is None or not os.path.isfile(row['simReadsFile']):
+                return 1
+            elif os.stat(row['simReadsFile'])[6] == 0:  # file size = 0
+                return 1
+        
+        # converting reads to fasta if needed; counting reads
+        for i,result in zip(todo, simRes):
+            simFile = result['simReadsFile']
+            simFileType = result['simReadsFileType'].lower()
+            if fileType.lower() == 'fasta' and simFileType != 'fasta':
+                fastaFile = os.path.splitext(simFile)[0] + '.fna'
+                result['simReadsCount'] = SeqIO.convert(simFile, simFileType, fastaFile, 'fasta')
+                result['simReadsFile'] = fastaFile
+                result['simReadsFileType'] = 'fasta'
+            else:
+                result['simReadsFileType'] = simFileType
+                result['simReadsCount'] = countReads(simFile, simFileType)
+
+            # adding to cache
+            if cache is not None:
+                tmpPath = cache.get_tmpPath(keys[i], '.reads')
+                shutil.copyfile(result['simReadsFile'], tmpPath)
+                result['simReadsFile'] = cache.commit(tmpPath, keys[i], '.reads')
+                tmpPath = cache.get_tmpPath(keys[i], '.count')
+                with open(tmpPath, 'wb') as fh:
+                    fh.write('{}\t{}\n'.format(result['simReadsCount'], result['simReadsFileType']))
+                cache.commit(tmpPath, keys[i], '.count')
+            res[i] = result
+                    
+        # setting attribs in name instances                    
+        for i,name in enumerate(names.iter_names()):
+            name.set_simReadsFile(res[i]['simReadsFile'])
+            name.set_simReadsFileType(res[i]['simReadsFileType'])
+            name.set_simReadsCount(res[i]['simReadsCount'])
             
+        return 0
+
+
+    def _shardJobs(self, i, fastaFile, shardSize, kwargs):
+        """Simulation jobs for the shards of a large reference.
+
+        Return:
+        list of (reference index, shard fasta file, simulator kwargs)
+        """
+        outDir = kwargs.get('outDir') or os.curdir
+        params = dict(kwargs.get('params') or {})
+        readLength = params.get('--read-length', params.get('--read-length-mean', 1000))
+        basename = os.path.splitext(os.path.basename(fastaFile))[0]
+        shards = shardFasta(fastaFile, shardSize, os.path.join(outDir, basename),
+                            overlap=int(readLength))
+        
+        # read quota for each shard in proportion to shard length
+        nReads = int(params.get('--num-reads', 10000))
+        lens = np.array([length for shardFile,length in shards], dtype=float)
+        quota = np.floor(nReads * lens / lens.sum()).astype(int)
+        remainder = nReads * lens / lens.sum() - quota
+        quota[np.argsort(-remainder)[:nReads - quota.sum()]] += 1
+        
+        jobs = []
+        seed = int(params.get('--seed', 0))
+        for k,(shardFile,length) in enumerate(shards):
+            if quota[k] == 0:
+                continue
+            shardParams = dict(params)
+            shardParams['--num-reads'] = quota[k]
+            shardParams['--seed'] = seed * 10000 + k
+            shardKwargs = dict(kwargs)
+            shardKwargs['params'] = shardParams
+            jobs.append((i, shardFile, shardKwargs))
+        msg = 'Split "{}" into {} shards for read simulation\n'
+        sys.stderr.write(msg.format(fastaFile, len(jobs)))
+        return jobs
+
+
+    def _mergeShards(self, fastaFile, shardRes, outDir=None):
+        """Concatenating simulated reads of reference shards.
+        Reads are named '{reference}_{shard}_{read}'.
+
+        Return:
+        dict(simReadsFile=file name, simReadsFileType=file type)
+        """
+        fileType = shardRes[0]['simReadsFileType'].lower()
+        basename = os.path.splitext(os.path.basename(fastaFile))[0]
+        outFile = basename + '_simReads.' + ('fna' if fileType == 'fasta' else 'fq')
+        outFile = os.path.join(outDir or os.curdir, outFile)
+
+        def renamed():
+            for k,row in enumerate(shardRes):
+                for n,rec in enumerate(SeqIO.parse(row['simReadsFile'], fileType)):
+                    rec.id = '{}_{}_{}'.format(basename, k, n)
+                    rec.description = ''
+                    yield rec
+        SeqIO.write(renamed(), outFile, fileType)
+        return dict(simReadsFile=outFile, simReadsFileType=fileType)
+
+
+class grinder(ReadSimulator):
+    """Class for calling Grinder simulator"""
+
+    # TODO
+    
+    def run_simulator(refFile, outFile=None, params=''):
+        """Calling grinder simulator"""
+        print 'Not yet supported!'
+        pass
+
+
+class mason(ReadSimulator):
+    """Class for calling mason simulator"""
+
+    def __init__(self, executable='mason'):
+        """
+        Args:
+        executable -- name of executable
+        """
+        # in PATH?
+        self.exeExists(executable)
+        # attr
+        self.exe = executable
+
 
     def __call__(self, refFile, outFile=None, outDir=None,
                       platform='illumina', params=None, tries=5):
@@ -208,60 +577,369 @@ class mason(ReadSimulator):
             return dict(simReadsFile=outFile, simReadsFileType=fileType)
 
         
-    def parallel(self, names, fileType='fasta', nprocs=1, **kwargs):
-        """Running simulator using apply_async
+    def parallel_trimmed(self, names, masterLength, masterDir, outDir=None,
+                         nprocs=1, platform='illumina', params=None, cacheDir=None):
+        """Simulating one master read set per reference with masterLength reads,
+        and deriving the requested read length (params['--read-length']) by
+        trimming the master reads. Master read sets are kept in masterDir and
+        reused for all read lengths <= masterLength, so simulator runs are
+        only needed for new parameter sets.
+        Falls back to parallel() if the read length > masterLength.
 
         Args:
         names -- NameFile class with iter_names() method
-        fileType -- sequence file format
+        masterLength -- read length of master read sets
+        masterDir -- directory for master read sets
+        outDir -- directory for trimmed read files
         nprocs -- max number of parallel simulation calls
-        kwargs -- passed to simulator
-
-        Attribs added to each name instance in names:
-        simReadsFile -- file name of simulated reads
-        simReadsFileType -- file type (eg., 'fasta' or 'fastq')
-        simReadsFileCount -- number of simulated reads
+        platform -- sequencing platform (only 'illumina' has fixed read lengths)
+        params -- parameters passed to mason (see __call__)
+        cacheDir -- passed to parallel() (fallback only)
 
         Return:
-        boolean on run success/fail
+        boolean on run success/fail (see parallel)
         """
-        # making list of fasta file to provide simulator call
-        fastaFiles = [name.get_fastaFile() for name in names.iter_names()]
+        readLength = int(params.get('--read-length', 100))
+        if platform != 'illumina' or readLength > masterLength:
+            return self.parallel(names, nprocs=nprocs, outDir=outDir, cacheDir=cacheDir,
+                                 platform=platform, params=params)
+        if outDir is None:
+            outDir = os.curdir
+
+        # master read sets for this parameter set (any read length); keyed by
+        # reference checksum, so any subset of references can reuse them
+        masterParams = dict(params)
+        masterParams['--read-length'] = masterLength
+        masterParams['-sq'] = ''
+        if not os.path.isdir(masterDir):
+            try:
+                os.makedirs(masterDir)
+            except OSError:   # created by another process
+                pass
+        prefixes = [os.path.join(masterDir, paramsKey('master', name.get_checksum(), platform, masterParams))
+                    for name in names.iter_names()]
+
+        # simulating missing master read sets
+        todo = [i for i,prefix in enumerate(prefixes) if not MasterReadSet.exists(prefix)]
+        msg = 'Master read sets: {} of {} references need read simulation\n'
+        sys.stderr.write(msg.format(len(todo), names.len()))
+        if len(todo) > 0:
+            fastaFiles = [names.get_name(i).get_fastaFile() for i in todo]
+            new_simulator = partial(self, outDir=masterDir, platform=platform, params=masterParams)
+            res = parmap.map(new_simulator, fastaFiles, processes=nprocs)
+            for row in res:
+                if row['simReadsFile'] is None or not os.path.isfile(row['simReadsFile']):
+                    return 1
+            for i,row in zip(todo, res):
+                MasterReadSet.from_file(row['simReadsFile'], prefixes[i], row['simReadsFileType'])
+                os.remove(row['simReadsFile'])
+
+        # trimming
+        for prefix,name in zip(prefixes, names.iter_names()):
+            basename = os.path.splitext(os.path.basename(name.get_fastaFile()))[0]
+            simReadsFile = os.path.join(outDir, basename + '_simReads.fna')
+            num_reads = MasterReadSet(prefix).trim(readLength, simReadsFile)
+            name.set_simReadsFile(simReadsFile)
+            name.set_simReadsFileType('fasta')
+            name.set_simReadsCount(num_reads)
 
-        # settig kwargs
-        new_simulator = partial(self, **kwargs)
+        return 0
 
-        # calling simulator
-        res = parmap.map(new_simulator, fastaFiles, processes=nprocs)
 
-        # checking that simulated reads were created for all references; return 1 if no file
-        for row in res:
-            if row['simReadsFile'] is None or not os.path.isfile(row['simReadsFile']):
-                return 1
-            elif os.stat(row['simReadsFile'])[0] == 0:  # file size = 0
-                return 1
+
+#-- in-process simulator --#
+_COMPLEMENT = np.arange(256, dtype=np.uint8)
+for _a,_b in zip('ACGTacgt', 'TGCAtgca'):
+    _COMPLEMENT[ord(_a)] = ord(_b)
+_UPPER = np.arange(256, dtype=np.uint8)
+_UPPER[ord('a'):ord('z')+1] -= 32
+_BASES = np.frombuffer('ACGT', dtype=np.uint8)
+
+
+def loadFasta(fastaFile):
+    """Loading all sequences of a (memory-mapped) fasta file.
+
+    Args:
+    fastaFile -- fasta file name
+
+    Return:
+    list of (seqID, numpy uint8 array of the upper-case sequence)
+    """
+    mm = np.memmap(fastaFile, dtype=np.uint8, mode='r')
+    if len(mm) == 0:
+        return []
+
+    # header line positions
+    headerStarts = np.flatnonzero(mm == ord('>'))
+    headerStarts = headerStarts[(headerStarts == 0) |
+                                (mm[np.maximum(headerStarts - 1, 0)] == ord('\n'))]
+
+    contigs = []
+    for k,start in enumerate(headerStarts):
+        seqEnd = headerStarts[k+1] if k + 1 < len(headerStarts) else len(mm)
+        headerEnd = start + np.argmax(mm[start:seqEnd] == ord('\n'))
+        if mm[headerEnd] != ord('\n'):   # header without sequence
+            continue
+        seqID = mm[start+1:headerEnd].tostring().split()[0]
+        seq = np.asarray(mm[headerEnd:seqEnd])
+        seq = seq[(seq != ord('\n')) & (seq != ord('\r'))]
+        contigs.append((seqID, _UPPER[seq]))
+    return contigs
+
+
+
+class numpySim(ReadSimulator):
+    """In-process read simulator (numpy).
+    Reads are drawn in vectorized batches: uniform start positions on
+    both strands, fixed (illumina) or normally distributed (454/sanger)
+    read lengths, and a per-base substitution/indel error model.
+    Takes the same params as mason (see __call__).
+    """
+    
+    defaultParams = {'illumina' : {
+        '--num-reads' : 10000,
+        '--read-length' : 100,
+        '--sub-rate' : 0.004,
+        '--indel-rate' : 0.0001,
+        '--seed' : 0 },
+        '454' : {
+        '--num-reads' : 10000,
+        '--read-length-mean' : 400,
+        '--read-length-error' : 40,
+        '--sub-rate' : 0.001,
+        '--indel-rate' : 0.005,
+        '--seed' : 0 },
+        'sanger' : {
+        '--num-reads' : 10000,
+        '--read-length-mean' : 400,
+        '--read-length-error' : 40,
+        '--sub-rate' : 0.001,
+        '--indel-rate' : 0.001,
+        '--seed' : 0 }}
+
+    def __init__(self, batchSize=10000):
+        """
+        Args:
+        batchSize -- number of reads drawn per vectorized batch
+        """
+        self.batchSize = batchSize
+
+
+    def get_params(self, platform='illumina', params=None):
+        """Default params for platform updated with params.
+        Params not used by this simulator (eg., mason-specific) are ignored.
+        """
+        simParams = dict(self.defaultParams[platform])
+        if params is not None:
+            simParams.update(dict((k,v) for k,v in params.items() if k in simParams))
+        return simParams
+
+
+    def simulate(self, refFile, platform='illumina', params=None):
+        """Simulating reads in memory.
+
+        Args:
+        refFile -- fasta file used for generating reads
+        platform -- sequencing platform
+        params -- simulation params (see __call__)
+
+        Return:
+        list of read sequences (strings)
+        """
+        params = self.get_params(platform, params)
+        rng = np.random.RandomState(int(params['--seed']))
+        nReads = int(params['--num-reads'])
+
+        contigs = loadFasta(refFile)
+        if len(contigs) == 0:
+            return []
+        seqs = [seq for seqID,seq in contigs]
+        contigLens = np.array([len(seq) for seq in seqs])
+        contigProbs = contigLens / float(contigLens.sum())
         
-        # converting reads to fasta if needed
-        if fileType.lower() == 'fasta':
-            for result in res:
-                simFile = result['simReadsFile']
-                fileType = result['simReadsFileType'].lower()
-                if fileType != 'fasta':
-                    fastaFile = os.path.splitext(simFile)[0] + '.fna'
-                    SeqIO.convert(simFile, fileType, fastaFile, 'fasta')
-                    result['simReadsFile'] = fastaFile
-                    result['simReadsFileType'] = 'fasta'
-                    
-        # setting attribs in name instances                    
-        for i,name in enumerate(names.iter_names()):
-            # read file
-            simReadsFile = res[i]['simReadsFile']
-            name.set_simReadsFile(simReadsFile)
-            # file type
-            fileType = res[i]['simReadsFileType'].lower()
-            name.set_simReadsFileType(fileType)
-            # number of simulated reads            
-            num_reads = len([True for i in SeqIO.parse(simReadsFile, fileType)])
-            name.set_simReadsCount(num_reads)
+        reads = []
+        for batchStart in range(0, nReads, self.batchSize):
+            n = min(self.batchSize, nReads - batchStart)
             
-        return 0
\ No newline at end of file
+            # read lengths
+            if platform == 'illumina':
+                lens = np.zeros(n, dtype=int) + int(params['--read-length'])
+            else:
+                lens = rng.normal(params['--read-length-mean'], params['--read-length-error'], n)
+                lens = np.maximum(np.round(lens), 1).astype(int)
+
+            # source contig, start position & strand
+            contig = rng.choice(len(seqs), size=n, p=contigProbs)
+            lens = np.minimum(lens, contigLens[contig])
+            starts = (rng.random_sample(n) * (contigLens[contig] - lens + 1)).astype(int)
+            rev = rng.random_sample(n) < 0.5
+            
+            # substitution errors (all positions up to max read length)
+            maxLen = lens.max()
+            subs = rng.random_sample((n, maxLen)) < params['--sub-rate']
+            subBases = _BASES[rng.randint(0, 4, size=(n, maxLen))]
+
+            # indel errors: insertion (before the base) or deletion (50:50)
+            indels = rng.random_sample((n, maxLen)) < params['--indel-rate']
+            insertions = indels & (rng.random_sample((n, maxLen)) < 0.5)
+            insBases = _BASES[rng.randint(0, 4, size=(n, maxLen))]
+
+            for c in np.unique(contig):
+                idx = np.flatnonzero(contig == c)
+                seq = seqs[c]
+                # gathering read bases (padded to max read length)
+                pos = starts[idx,np.newaxis] + np.arange(maxLen)
+                pos = np.minimum(pos, len(seq) - 1)
+                bases = seq[pos]
+                bases = np.where(subs[idx], subBases[idx], bases)
+
+                # full-length reads without indels: vectorized
+                simple = (lens[idx] == maxLen) & ~indels[idx].any(axis=1)
+                simpleBases = bases[simple]
+                r = rev[idx][simple]
+                simpleBases[r] = _COMPLEMENT[simpleBases[r][:,::-1]]
+                simpleBases = np.ascontiguousarray(simpleBases)
+                reads.extend(simpleBases.view('S{}'.format(maxLen)).ravel())
+
+                # other reads (shorter and/or with indels): vectorized
+                other = idx[~simple]
+                if len(other) > 0:
+                    reads.extend(self._buildReads(bases[~simple], lens[other], indels[other],
+                                                  insertions[other], insBases[other], rev[other]))
+        return reads
+
+
+    def simulate_tagged(self, names, outFile, outDir=None, split=False,
+                        platform='illumina', params=None):
+        """Simulating reads for all references in one run.
+        Each read is tagged with the index of its source reference
+        (read name: '{reference index}|{read index}'), so that the reads of
+        all references can be mapped in one mapper call.
+
+        Args:
+        names -- NameFile instance
+        outFile -- output fasta file (reads of all references)
+        outDir -- directory for per-reference read files (split=True)
+        split -- also write the reads of each reference to a separate file
+                 (simReadsFile attrib of each name)
+        platform -- sequencing platform
+        params -- simulation params (see __call__). The seed of reference i is
+                  seed * 10000 + i.
+
+        Attribs added to each name instance in names:
+        simReadsCount (& simReadsFile, simReadsFileType if split=True)
+
+        Return:
+        numpy array of read counts per reference
+        """
+        params = self.get_params(platform, params)
+        seed = int(params['--seed'])
+        if outDir is None:
+            outDir = os.curdir
+        
+        counts = np.zeros(names.len(), dtype=int)
+        with open(outFile, 'wb') as outFH:
+            for i,name in enumerate(names.iter_names()):
+                refParams = dict(params)
+                refParams['--seed'] = seed * 10000 + i
+                reads = self.simulate(name.get_fastaFile(), platform=platform, params=refParams)
+                tagged = ''.join(['>{}|{}\n{}\n'.format(i, k, read) for k,read in enumerate(reads)])
+                outFH.write(tagged)
+                counts[i] = len(reads)
+                name.set_simReadsCount(len(reads))
+
+                # per-reference read file
+                if split:
+                    basename = os.path.splitext(os.path.basename(name.get_fastaFile()))[0]
+                    simReadsFile = os.path.join(outDir, basename + '_simReads.fna')
+                    with open(simReadsFile, 'wb') as fh:
+                        fh.write(tagged)
+                    name.set_simReadsFile(simReadsFile)
+                    name.set_simReadsFileType('fasta')
+        return counts
+
+
+    def _buildReads(self, bases, lens, indels, insertions, insBases, rev):
+        """Building reads of differing lengths with indels from padded base
+        arrays. All reads are built at once on 1 concatenated buffer: each base
+        is repeated 0 (deletion), 1 or 2 times (insertion; the 1st copy is
+        replaced by the inserted base), and reverse-strand reads are reverse
+        complemented via an index map.
+
+        Args:
+        bases -- numpy array (n, maxLen) of read bases (padded)
+        lens -- read lengths (before indels)
+        indels -- boolean array (n, maxLen) of indel sites
+        insertions -- boolean array (n, maxLen); indel site is an insertion (else: deletion)
+        insBases -- numpy array (n, maxLen) of inserted bases
+        rev -- boolean array (n,); read from the reverse strand
+
+        Return:
+        list of read sequences (strings)
+        """
+        inRead = np.arange(bases.shape[1]) < lens[:,np.newaxis]
+        reps = np.where(inRead, 1, 0)
+        reps[inRead & indels & ~insertions] = 0
+        reps[inRead & insertions] = 2
+        reps = reps.ravel()
+
+        # concatenated reads (indels applied)
+        buf = np.repeat(bases.ravel(), reps)
+        ins = np.flatnonzero(reps == 2)
+        buf[(np.cumsum(reps) - reps)[ins]] = insBases.ravel()[ins]
+
+        # read boundaries
+        readLens = reps.reshape(bases.shape).sum(axis=1)
+        offsets = np.cumsum(readLens) - readLens
+        readOf = np.repeat(np.arange(len(readLens)), readLens)
+
+        # reverse complement of reverse-strand reads
+        local = np.arange(len(buf)) - offsets[readOf]
+        isRev = rev[readOf]
+        src = np.where(isRev, offsets[readOf] + readLens[readOf] - 1 - local, np.arange(len(buf)))
+        buf = buf[src]
+        buf = np.where(isRev, _COMPLEMENT[buf], buf).astype(np.uint8)
+
+        buf = buf.tostring()
+        return [buf[o:o+l] for o,l in zip(offsets, readLens)]
+        
+
+    def __call__(self, refFile, outFile=None, outDir=None,
+                 platform='illumina', params=None):
+        """Simulating reads and writing them to a fasta file.
+
+        Default params (override any of them with params):
+
+        illumina: '--num-reads' : 10000, '--read-length' : 100,
+                  '--sub-rate' : 0.004, '--indel-rate' : 0.0001, '--seed' : 0
+        454:      '--num-reads' : 10000, '--read-length-mean' : 400,
+                  '--read-length-error' : 40, '--sub-rate' : 0.001,
+                  '--indel-rate' : 0.005, '--seed' : 0
+        sanger:   same as 454, but '--indel-rate' : 0.001
+
+        Args:
+        refFile -- fasta file using for generating reads
+        outFile -- output. Default: refFile basename + '_simReads.fa'
+        outDir -- directory to write output. Default: same as refFile
+        platform -- sequencing platform
+        params -- simulation params. {param : value}
+
+        Return:
+        dict(simReadsFile=file name, simReadsFileType='fasta')
+        """
+        if outFile is None:
+            outFile = os.path.splitext(refFile)[0] + '_simReads.fa'
+        if outDir is not None:
+            outFile = os.path.join(outDir, os.path.basename(outFile))
+
+        sys.stderr.write('Simulating reads (numpy): {}\n'.format(refFile))
+        reads = self.simulate(refFile, platform=platform, params=params)
+
+        basename = os.path.splitext(os.path.basename(refFile))[0]
+        with open(outFile, 'wb') as outFH:
+            for i,read in enumerate(reads):
+                outFH.write('>{}_{}\n{}\n'.format(basename, i, read))
+
+        if len(reads) == 0:
+            return dict(simReadsFile=None, simReadsFileType=None)
+        return dict(simReadsFile=outFile, simReadsFileType='fasta')
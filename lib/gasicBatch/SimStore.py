@@ -0,0 +1,142 @@
+"""Persistent all-vs-all similarity store"""
+
+import os
+import numpy as np
+
+from Cache import FileCache, paramsKey
+
+
+class SimStore(object):
+    """Store of pairwise mapped-read vectors for the similarity tensor.
+    Each entry holds the mapped-read flags of the simulated reads of a query
+    reference mapped to a subject reference. Entries are keyed by the
+    simulation profile and the query & subject fasta checksums, so any
+    NameFile can extract its tensor from the store without mapping.
+    The simulation profile must fully determine the simulated reads
+    (i.e., include the simulator seed).
+    """
+
+    def __init__(self, storeDir):
+        """
+        Args:
+        storeDir -- store directory (created if needed)
+        """
+        self.storeDir = os.path.abspath(storeDir)
+        self.caches = dict()
+
+
+    def _cache(self, profile):
+        """FileCache for a simulation profile"""
+        if profile not in self.caches:
+            self.caches[profile] = FileCache(os.path.join(self.storeDir, profile))
+        return self.caches[profile]
+
+    def _key(self, query, subject):
+        return paramsKey(query.get_checksum(), subject.get_checksum())
+
+
+    def has(self, profile, query, subject):
+        """Is the pair in the store?
+
+        Args:
+        profile -- simulation profile key
+        query -- Name instance of the reference providing the simulated reads
+        subject -- Name instance of the reference the reads were mapped to
+        """
+        return self._cache(profile).exists(self._key(query, subject), '.npy')
+
+    def get(self, profile, query, subject):
+        """Mapped-read flags for the pair; None if not in the store"""
+        return self._cache(profile).load_npy(self._key(query, subject))
+
+    def put(self, profile, query, subject, mapped):
+        """Adding mapped-read flags (1d array) for the pair to the store"""
+        mapped = np.asarray(mapped, dtype=np.uint8)
+        return self._cache(profile).save_npy(self._key(query, subject), mapped)
+
+
+    def missing(self, names, profile, skipPairs=None):
+        """Pairs of references in names that are not in the store.
+
+        Args:
+        names -- NameFile instance
+        profile -- simulation profile key
+        skipPairs -- boolean array (n_refs, n_refs); pairs not needed
+
+        Return:
+        list of (i,j) tuples
+        """
+        n_refs = names.len()
+        pairs = []
+        for i in range(n_refs):
+            for j in range(n_refs):
+                if skipPairs is not None and skipPairs[i,j]:
+                    continue
+                if not self.has(profile, names.get_name(i), names.get_name(j)):
+                    pairs.append((i,j))
+        return pairs
+
+
+    def skipMask(self, names, profile, skipPairs=None):
+        """Pairs of references in names that need no mapping (in the store or in skipPairs).
+
+        Args:
+        names -- NameFile instance
+        profile -- simulation profile key
+        skipPairs -- boolean array (n_refs, n_refs); pairs not needed
+
+        Return:
+        boolean array (n_refs, n_refs); rows with any False need mapping
+        """
+        mask = np.ones((names.len(), names.len()), dtype=bool)
+        for i,j in self.missing(names, profile, skipPairs):
+            mask[i,j] = False
+        return mask
+
+
+    def add_rows(self, names, profile, rows, mappedRows, skipPairs=None):
+        """Adding rows of the similarity tensor to the store.
+
+        Args:
+        names -- NameFile instance
+        profile -- simulation profile key
+        rows -- indices of query references in names
+        mappedRows -- list of numpy arrays (n_refs, n_simReads); 1 per row
+        skipPairs -- boolean array (n_refs, n_refs); pairs that were not mapped
+        """
+        for i,mapped in zip(rows, mappedRows):
+            for j in range(names.len()):
+                if skipPairs is not None and skipPairs[i,j]:
+                    continue
+                self.put(profile, names.get_name(i), names.get_name(j), mapped[j,:])
+
+
+    def extract(self, names, profile, skipPairs=None):
+        """Extracting the similarity tensor for the references in names.
+
+        Args:
+        names -- NameFile instance
+        profile -- simulation profile key
+        skipPairs -- boolean array (n_refs, n_refs); pairs set to no reads mapped
+
+        Return:
+        numpy array (n_refs, n_refs, n_simReads) of mapped-read flags
+        """
+        n_refs = names.len()
+        entries = dict()
+        for i in range(n_refs):
+            for j in range(n_refs):
+                if skipPairs is not None and skipPairs[i,j]:
+                    continue
+                mapped = self.get(profile, names.get_name(i), names.get_name(j))
+                if mapped is None:
+                    msg = 'Pair not in similarity store: "{}" -> "{}"'
+                    raise KeyError(msg.format(names.get_name(i).get_fastaFile(),
+                                              names.get_name(j).get_fastaFile()))
+                entries[(i,j)] = mapped
+
+        num_reads = min(len(x) for x in entries.values())
+        mappedReads = np.zeros((n_refs, n_refs, num_reads))
+        for (i,j),mapped in entries.items():
+            mappedReads[i,j,:] = mapped[:num_reads]
+        return mappedReads
@@ -0,0 +1,167 @@
+"""k-mer sketches of reference sequences for estimating sequence containment.
+Sketches are FracMinHash sketches: all canonical k-mer hashes below
+2^64 / scale are kept, so containment can be estimated directly from
+the sketch intersection.
+"""
+
+import sys
+import numpy as np
+import parmap
+from Bio import SeqIO
+
+from Cache import FileCache, paramsKey
+
+
+# nucleotide -> 2-bit code; everything else = 4 (invalid)
+_NUC_CODE = np.zeros(256, dtype=np.uint8) + 4
+for _i,_nuc in enumerate('ACGT'):
+    _NUC_CODE[ord(_nuc)] = _i
+    _NUC_CODE[ord(_nuc.lower())] = _i
+
+
+def _hash64(x):
+    """Vectorized 64 bit mixing function (splitmix64 finalizer)"""
+    x = x.copy()
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xbf58476d1ce4e5b9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94d049bb133111eb)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def kmerHashes(seq, k, positions=False):
+    """Hashes of all canonical k-mers in a sequence.
+    k-mers containing non-ACGT characters are skipped.
+
+    Args:
+    seq -- sequence string
+    k -- k-mer length (<= 31)
+    positions -- also return the start position of each k-mer in seq
+
+    Return:
+    numpy array (uint64) of k-mer hashes; (hashes, positions) if positions=True
+    """
+    codes = _NUC_CODE[np.frombuffer(str(seq), dtype=np.uint8)]
+    nkmers = len(codes) - k + 1
+    if nkmers <= 0:
+        if positions:
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=int)
+        return np.zeros(0, dtype=np.uint64)
+
+    # k-mers with an invalid character
+    invalid = np.concatenate([[0], np.cumsum(codes == 4)])
+    valid = (invalid[k:] - invalid[:-k]) == 0
+
+    # forward & reverse complement 2-bit encoded k-mers
+    codes = np.where(codes == 4, 0, codes).astype(np.uint64)
+    fwd = np.zeros(nkmers, dtype=np.uint64)
+    rev = np.zeros(nkmers, dtype=np.uint64)
+    for p in range(k):
+        fwd = (fwd << np.uint64(2)) | codes[p:p+nkmers]
+        rev |= (np.uint64(3) - codes[p:p+nkmers]) << np.uint64(2*p)
+    canonical = np.minimum(fwd, rev)[valid]
+
+    if positions:
+        return _hash64(canonical), np.nonzero(valid)[0]
+    return _hash64(canonical)
+
+
+def sketchFasta(fastaFile, k=21, scale=1000):
+    """FracMinHash sketch of all sequences in a fasta file.
+
+    Args:
+    fastaFile -- fasta file name
+    k -- k-mer length
+    scale -- keep 1/scale of all k-mer hashes
+
+    Return:
+    numpy array (uint64) of sorted, unique k-mer hashes
+    """
+    maxHash = np.uint64((2**64 - 1) // scale)
+    sketch = []
+    for rec in SeqIO.parse(fastaFile, 'fasta'):
+        hashes = kmerHashes(rec.seq, k)
+        sketch.append(hashes[hashes <= maxHash])
+    if len(sketch) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    return np.unique(np.concatenate(sketch))
+
+
+
+class Sketcher(object):
+    """Sketching reference sequences & estimating pairwise containment"""
+
+    def __init__(self, k=21, scale=1000, minHashes=10, cacheDir=None):
+        """
+        Args:
+        k -- k-mer length (<= 31)
+        scale -- keep 1/scale of all k-mer hashes
+        minHashes -- min sketch size for estimating the containment of a reference
+                     (smaller sketches, eg., of small references: containment unknown)
+        cacheDir -- directory for caching sketches (keyed by fasta checksum).
+                    If None: no caching.
+        """
+        if k > 31:
+            raise ValueError('k must be <= 31')
+        self.k = k
+        self.scale = scale
+        self.minHashes = minHashes
+        if cacheDir is None:
+            self.cache = None
+        else:
+            self.cache = FileCache(cacheDir)
+
+
+    def sketch(self, name):
+        """Sketch of a reference; loaded from cache if available.
+
+        Args:
+        name -- Name instance (NameFile)
+
+        Return:
+        numpy array of k-mer hashes
+        """
+        key = paramsKey('sketch', name.get_checksum(), self.k, self.scale)
+        if self.cache is not None:
+            sketch = self.cache.load_npy(key)
+            if sketch is not None:
+                return sketch
+
+        sys.stderr.write('Sketching: {}\n'.format(name.get_fastaFile()))
+        sketch = sketchFasta(name.get_fastaFile(), k=self.k, scale=self.scale)
+
+        if self.cache is not None:
+            self.cache.save_npy(key, sketch)
+        return sketch
+
+
+    def containment(self, names, nprocs=1):
+        """Pairwise containment of all references.
+
+        Args:
+        names -- NameFile instance
+        nprocs -- number of parallel sketching calls
+
+        Return:
+        numpy array (n_refs, n_refs); [i,j] = fraction of k-mers in reference i
+        that are also in reference j. Rows of references with sketches smaller than
+        minHashes are NaN (unknown).
+        """
+        sketches = parmap.map(_sketch, names.get_names(), self, processes=nprocs)
+
+        n_refs = len(sketches)
+        cont = np.zeros((n_refs, n_refs))
+        for i in range(n_refs):
+            if len(sketches[i]) < self.minHashes:
+                cont[i,:] = np.nan
+                continue
+            for j in range(n_refs):
+                shared = np.intersect1d(sketches[i], sketches[j], assume_unique=True)
+                cont[i,j] = float(len(shared)) / len(sketches[i])
+        return cont
+
+
+def _sketch(name, sketcher):
+    """For calling Sketcher.sketch via multiprocessing"""
+    return sketcher.sketch(name)
@@ -6,7 +6,7 @@ import pandas as pd
 class OutputWriter(object):
     """Writing functions for gasic batch"""
 
-    def __init__(self, metagenome_ID, nCol=8, sep='\t'):
+    def __init__(self, metagenome_ID, nCol=9, sep='\t'):
         """
         Args:
         mgID -- MGRAST metagenome ID
@@ -24,8 +24,9 @@ class OutputWriter(object):
         TODO:
         make more flexible
         """        
-        # metagenome_id, refSequences, n-mapped, corrected-abundacne, error, pval, mg_platform
-        print '{mgID}\t{ref}\t{total}\t{mapped}\t{corr}\t{error}\t{pval}\t{mg_platform}'.format(**outvals)
+        # metagenome_id, refSequences, n-mapped, corrected-abundacne, error, pval, mg_platform, sample_fraction
+        outvals.setdefault('sample_frac', 1.0)
+        print '{mgID}\t{ref}\t{total}\t{mapped}\t{corr}\t{error}\t{pval}\t{mg_platform}\t{sample_frac}'.format(**outvals)
         
     def lastRun(self, df):
         """If metagenome in last run output, write old output
@@ -34,6 +35,12 @@ class OutputWriter(object):
         """
         msg =  '  Metagenome "{}" in last-run file. Writing old output; moving to next metagenome\n\n'
         sys.stderr.write(msg.format(self.mgID))
+        # padding rows of older output versions (eg., without sample_fraction) to nCol columns
+        df = df.copy()
+        isError = df[1].astype(str).str.startswith('ERROR')
+        for col in range(df.shape[1], self.nCol + 2):
+            # sample_fraction: no subsampling in older versions
+            df[col] = ['NA' if x else 1.0 for x in isError]
         df.to_csv(sys.stdout, sep=self.sep, header=None, index=None)
 
     def noReadFile(self):
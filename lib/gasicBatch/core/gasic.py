@@ -109,12 +109,15 @@ def similarity_correction_smp(sim, reads, N, subsets=1):
 
 
 
-def bootstrap_similarity_matrix(mapped_reads):
+def bootstrap_similarity_matrix(mapped_reads, sim_counts=None):
     """
     Calculate a similarity matrix by bootstrapping.
 
     INPUT:
     mapped_reads:    mapping information as generated by similarity_matrix_raw().
+    sim_counts:      [numpy.array (M,)] number of simulated reads for each reference (row)
+                     of mapped_reads, if the number differs between references. Rows are
+                     padded to the max number of reads. Default: all reads are used.
 
     OUTPUT:
     d_matrix:        similarity matrix. Ordering is the same as in 'names' used in the
@@ -124,6 +127,15 @@ def bootstrap_similarity_matrix(mapped_reads):
     num_reads = mapped_reads.shape[2]
     num_seq = mapped_reads.shape[0]
 
+    if sim_counts is not None:
+        # variable number of reads per reference: bootstrap each row & use mapped fractions
+        frac = np.zeros((num_seq,num_seq))
+        for i in range(num_seq):
+            n = int(sim_counts[i])
+            bootstrap_indices = np.random.randint(n, size=(n,))
+            frac[i,:] = np.sum( mapped_reads[i][:,bootstrap_indices], axis=1 ) / float(n)
+        return frac.T / np.diag(frac)[:,np.newaxis]
+
     # create a bootstrap index vector
     bootstrap_indices = np.random.randint(num_reads, size=(num_reads,))
 
@@ -141,7 +153,29 @@ def bootstrap_similarity_matrix(mapped_reads):
 
 
 
-def bootstrap(reads, smat_raw, B, test_c=0.01):
+def resample_found(reads, N, weights=None):
+    """
+    Number of matching reads per species in a bootstrap sample of N reads.
+
+    Args:
+    reads -- [numpy.array (M,U)] array with mapping information
+    N -- total number of reads
+    weights -- [numpy.array (U,)] multiplicity of each read (deduplicated reads).
+               Resampling N reads with probabilities weights/N is equivalent to
+               resampling the N reads before deduplication.
+
+    Return:
+    [numpy.array (M,)]
+    """
+    if weights is None:
+        random_set = np.random.randint(N,size=N)
+        return np.sum(reads[:,random_set], axis=1)
+    counts = np.random.multinomial(N, weights / float(N))
+    return np.dot(reads, counts)
+
+
+
+def bootstrap(reads, smat_raw, B, test_c=0.01, sim_counts=None, weights=None):
     """
     Similarity correction using a bootstrapping procedure for more robust corrections and error
     estimates.
@@ -152,6 +186,8 @@ def bootstrap(reads, smat_raw, B, test_c=0.01):
     smat_raw -- mapping information for similarity matrix. species have same ordering as reads array
     B -- Number of bootstrap samples
     test_c -- For testing: treat species as not present, if estimated concentration is below test_c.
+    sim_counts -- number of simulated reads per reference in smat_raw (see bootstrap_similarity_matrix)
+    weights -- [numpy.array (N,)] multiplicity of each read, if reads are deduplicated (see resample_found)
     
     Return:
     [p_values, abundances, variances] -- list of floats
@@ -159,6 +195,8 @@ def bootstrap(reads, smat_raw, B, test_c=0.01):
     """
     # M: Number of species, N: Number of reads
     M,N = reads.shape 
+    if weights is not None:
+        N = int(np.sum(weights))
 
     # initialize arrays to store results
     found = np.zeros( (B,M) )
@@ -167,16 +205,13 @@ def bootstrap(reads, smat_raw, B, test_c=0.01):
 
     for b in range(B):
         sys.stderr.write("... bootstrapping {} of {}\n".format(b+1,B))
-        # select a bootstrap sample 
-        random_set = np.random.randint(N,size=N)
-
-        # count the number of matching reads in bootstrap sample
-        found[b,:] = np.sum(reads[:,random_set], axis=1)
+        # select a bootstrap sample & count the number of matching reads in it
+        found[b,:] = resample_found(reads, N, weights)
         #for r in range(N):
         #    found[b,:] += reads[:,random_set[r]]
 
         # bootstrap a similarity matrix
-        smat = bootstrap_similarity_matrix(smat_raw)
+        smat = bootstrap_similarity_matrix(smat_raw, sim_counts)
         
         # calculate abundances
         corr[b,:] = similarity_correction(smat,found[b,:],N)
@@ -191,7 +226,7 @@ def bootstrap(reads, smat_raw, B, test_c=0.01):
 
 
 
-def _boot_iteration(b, reads, smat_raw, test_c, B, M, N):
+def _boot_iteration(b, reads, smat_raw, test_c, B, M, N, sim_counts=None, weights=None):
     """One bootstrap iteration for bootstrap_par function.
     See bootstrap_par for arg doc."""    
     sys.stderr.write("...bootstrapping {} of {}\n".format(b+1,B))
@@ -201,14 +236,11 @@ def _boot_iteration(b, reads, smat_raw, test_c, B, M, N):
            'corr' : np.zeros( (1,M) ),
            'fails' : np.zeros( (1,M) )}
     
-    # select a bootstrap sample 
-    random_set = np.random.randint(N,size=N)
-    
-    # count the number of matching reads in bootstrap sample
-    res['found'][0,:] = np.sum(reads[:,random_set], axis=1)
+    # select a bootstrap sample & count the number of matching reads in it
+    res['found'][0,:] = resample_found(reads, N, weights)
 
     # bootstrap a similarity matrix
-    smat = bootstrap_similarity_matrix(smat_raw)
+    smat = bootstrap_similarity_matrix(smat_raw, sim_counts)
     
     # calculate abundances
     res['corr'][0,:] = similarity_correction(smat,res['found'][0,:],N)
@@ -220,7 +252,7 @@ def _boot_iteration(b, reads, smat_raw, test_c, B, M, N):
     return res
 
 
-def bootstrap_par(reads, smat_raw, B, test_c=0.01, nprocs=1):
+def bootstrap_par(reads, smat_raw, B, test_c=0.01, nprocs=1, sim_counts=None, weights=None):
     """
     Similarity correction using a bootstrapping procedure for more robust corrections and error
     estimates. Bootstrapping conducted in parallel.
@@ -232,6 +264,8 @@ def bootstrap_par(reads, smat_raw, B, test_c=0.01, nprocs=1):
     B -- Number of bootstrap samples
     test_c -- For testing: treat species as not present, if estimated concentration is below test_c.
     nprocs -- Number of parallel bootstrap processes to perform.
+    sim_counts -- number of simulated reads per reference in smat_raw (see bootstrap_similarity_matrix)
+    weights -- [numpy.array (N,)] multiplicity of each read, if reads are deduplicated (see resample_found)
 
     Return:
     [p_values, abundances, variances] -- list of floats
@@ -239,8 +273,11 @@ def bootstrap_par(reads, smat_raw, B, test_c=0.01, nprocs=1):
     """
     # M: Number of species, N: Number of reads
     M,N = reads.shape 
+    if weights is not None:
+        N = int(np.sum(weights))
 
-    resList = parmap.map(_boot_iteration, range(B), reads, smat_raw, test_c, B, M, N, processes=nprocs)
+    resList = parmap.map(_boot_iteration, range(B), reads, smat_raw, test_c, B, M, N,
+                         sim_counts, weights, processes=nprocs)
 
     # merging arrays (found, core, fails)
     found = np.concatenate( [x['found'] for x in resList] )